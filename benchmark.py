@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks for compiler.py
+
+Usage: python benchmark.py [options]
+
+Options:
+    -h, --h         show help
+    -s file         the source file used as the workload, default source.c
+    -n number       how many copies of the source file are lexed, default 200
+    -b name         only run the named benchmark: lexer, tree, depth,
+                    incremental, emit, jit, vm
+
+Examples:
+    python benchmark.py
+    python benchmark.py -s source.c -n 1000
+    python benchmark.py -b tree
+'''
+
+import io
+import os
+import re
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+import compiler
+
+
+def _timeit(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+# the lexer of compiler.py before its master regex, it indexes the
+# characters of compiler.content one by one. kept as the baseline
+def _lex_by_char(lexer):
+    content = compiler.content
+    tokens = lexer.tokens
+    i = 0
+    while i < len(content):
+        i = lexer.skip_blank(i)
+        if content[i] == '#':
+            tokens.append(compiler.Token(4, content[i]))
+            i = lexer.skip_blank(i + 1)
+            while i < len(content):
+                if re.match('include', content[i:]):
+                    tokens.append(compiler.Token(0, 'include'))
+                    i = lexer.skip_blank(i + 7)
+                elif content[i] == '\"' or content[i] == '<':
+                    tokens.append(compiler.Token(4, content[i]))
+                    i = lexer.skip_blank(i + 1)
+                    close_flag = '\"' if content[i] == '\"' else '>'
+                    lib = ''
+                    while content[i] != close_flag:
+                        lib += content[i]
+                        i += 1
+
+                    tokens.append(compiler.Token(1, lib))
+                    tokens.append(compiler.Token(4, close_flag))
+                    i = lexer.skip_blank(i + 1)
+                    break
+                else:
+                    print ('include error!')
+                    exit()
+        elif content[i].isalpha() or content[i] == '_':
+            temp = ''
+            while i < len(content) and (
+                    content[i].isalpha() or
+                    content[i] == '_' or
+                    content[i].isdigit()):
+                temp += content[i]
+                i += 1
+            if lexer.is_keyword(temp):
+                tokens.append(compiler.Token(0, temp))
+            else:
+                tokens.append(compiler.Token(1, temp))
+            i = lexer.skip_blank(i)
+        elif content[i].isdigit():
+            temp = ''
+            while i < len(content):
+                if content[i].isdigit() or (
+                        content[i] == '.' and content[i + 1].isdigit()):
+                    temp += content[i]
+                    i += 1
+                elif not content[i].isdigit():
+                    if content[i] == '.':
+                        print ('float number error!')
+                        exit()
+                    else:
+                        break
+            tokens.append(compiler.Token(2, temp))
+            i = lexer.skip_blank(i)
+        elif content[i] in compiler.delimiters:
+            tokens.append(compiler.Token(4, content[i]))
+            if content[i] == '\"':
+                i += 1
+                temp = ''
+                while i < len(content):
+                    if content[i] != '\"':
+                        temp += content[i]
+                        i += 1
+                    else:
+                        break
+                else:
+                    print ('error:lack of \"')
+                    exit()
+                tokens.append(compiler.Token(5, temp))
+                tokens.append(compiler.Token(4, '\"'))
+            i = lexer.skip_blank(i + 1)
+        elif content[i] in compiler.operators:
+            if (content[i] == '+' or content[i] == '-') and (
+                    content[i + 1] == content[i]):
+                tokens.append(compiler.Token(3, content[i] * 2))
+                i = lexer.skip_blank(i + 2)
+            elif (content[i] == '>' or content[i] == '<') and content[i + 1] == '=':
+                tokens.append(compiler.Token(3, content[i] + '='))
+                i = lexer.skip_blank(i + 2)
+            else:
+                tokens.append(compiler.Token(3, content[i]))
+                i = lexer.skip_blank(i + 1)
+
+
+def bench_lexer(text, copies):
+    text = text * copies
+    print ('lexer: %d bytes' % len(text))
+    for name, lex in [('by char', _lex_by_char), ('main', compiler.Lexer.main)]:
+        # the baseline lexer indexes characters, the regex one scans bytes
+        compiler.content = text if name == 'main' else compiler._to_str(text)
+        lexer = compiler.Lexer()
+        cost, _ = _timeit(lambda: lex(lexer))
+        print ('  %-14s %8d tokens %8.3fs %12.0f tokens/s' % (
+            name, len(lexer.tokens), cost, len(lexer.tokens) / max(cost, 1e-9)))
+
+
+def bench_tree(text, copies):
+    print ('syntax tree of an array initializer')
+    for number in [25000, 50000, 100000]:
+        compiler.content = ('int a[%d] = {%s};' % (number, ', '.join(
+            str(item % 100) for item in range(number)))).encode('ascii')
+        parser = compiler.Parser()
+        cost, _ = _timeit(parser.main)
+        arena = compiler.SyntaxTreeArena()
+        arena.pack(parser.tree.root)
+        print ('  %8d items %8.3fs %10.3fus/item %8d arena nodes' % (
+            number, cost, cost * 1e6 / number, len(arena)))
+
+
+class _Null(object):
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def bench_depth(text, copies):
+    depth = 100000
+    compiler.content = ('int main() { int x; x = %s; return 0; }' % ' + '.join(
+        ['x'] * (depth + 1))).encode('ascii')
+    print ('expression of depth %d, recursion limit %d' % (
+        depth, sys.getrecursionlimit()))
+    parser = compiler.Parser()
+    parser.main()
+    assem = compiler.Assembler(parser.tree)
+    stdout = sys.stdout
+    sys.stdout = _Null()
+    try:
+        display_cost, _ = _timeit(lambda: parser.display(parser.tree.root))
+    finally:
+        sys.stdout = stdout
+    traverse_cost, _ = _timeit(lambda: assem.traverse(assem.tree.root))
+    print ('  %-14s %8.3fs' % ('display', display_cost))
+    print ('  %-14s %8.3fs %8d lines' % (
+        'traverse', traverse_cost, len(assem.ass_file_handler)))
+
+
+def bench_incremental(text, copies):
+    number = 20000
+    source = ('int main() {\n%s    return 0;\n}\n' % ''.join(
+        '    int x%d;\n    x%d = %d + %d;\n' % (item, item, item, item)
+        for item in range(number))).encode('ascii')
+    target = 'x%d = ' % (number // 2)
+    edited = source.replace(target.encode('ascii'), (target + '1 + ').encode('ascii'))
+    print ('one statement edited in %d sentences, %d bytes' % (
+        number * 2 + 1, len(source)))
+    parser = compiler.IncrementalParser()
+    parser.parse(source)
+    incremental_cost, tree = _timeit(lambda: parser.parse(edited))
+    compiler.content = edited
+    cold_parser = compiler.Parser()
+    cold_cost, _ = _timeit(cold_parser.main)
+    assert tree.root.same(cold_parser.tree.root)
+    print ('  %-14s %8.3fs' % ('cold', cold_cost))
+    print ('  %-14s %8.3fs %8.0fx' % (
+        'incremental', incremental_cost, cold_cost / max(incremental_cost, 1e-9)))
+
+
+def bench_emit(text, copies):
+    print ('assembler of declarations and assignments, .bss and .text interleaved')
+    directory = tempfile.mkdtemp()
+    compiler.file_name = os.path.join(directory, 'emit')
+    try:
+        for number in [20000, 40000, 80000]:
+            compiler.content = ('int main() {\n%s    return 0;\n}\n' % ''.join(
+                '    int x%d;\n    x%d = %d;\n' % (item, item, item)
+                for item in range(number))).encode('ascii')
+            parser = compiler.Parser()
+            parser.main()
+            for name, stream, optimize in [('buffer', False, False),
+                                           ('stream', True, False),
+                                           ('-O', False, True)]:
+                peephole = compiler.Peephole() if optimize else None
+                assem = compiler.Assembler(parser.tree, stream, peephole)
+                cost, _ = _timeit(lambda: (assem.traverse(assem.tree.root),
+                                           assem.ass_file_handler.generate_ass_file()))
+                lines = len(assem.ass_file_handler)
+                print ('  %8d lines %-8s %8.3fs %10.3fus/line' % (
+                    lines, name, cost, cost * 1e6 / lines))
+                if peephole:
+                    print ('    ' + peephole.report())
+    finally:
+        shutil.rmtree(directory)
+
+
+# the time from the source to the end of the program, runs times each
+def bench_jit(text, copies):
+    runs = 5
+    print ('source to exit of the x86-64 code, %d runs' % runs)
+    directory = tempfile.mkdtemp()
+    compiler.file_name = os.path.join(directory, 'jit')
+    compiler.content = text
+    compiler.long_mode = True
+    input_name = os.path.join(directory, 'input')
+    input_file = open(input_name, 'w')
+    input_file.write('1\n' * 64)
+    input_file.close()
+    devnull = open(os.devnull, 'w')
+
+    def jit():
+        parser = compiler.Parser()
+        parser.main()
+        compiler._run(parser.tree)
+
+    def gcc():
+        parser = compiler.Parser()
+        parser.main()
+        assem = compiler._assembler(parser.tree)
+        assem.emit(compiler._intermediate(parser.tree))
+        assem.ass_file_handler.generate_ass_file()
+        subprocess.check_call(['gcc', compiler.file_name + '.S', '-o', compiler.file_name],
+                              stderr=devnull)
+        subprocess.call([compiler.file_name], stdin=open(input_name), stdout=devnull)
+
+    # printf and scanf of the code run here use the descriptors of python
+    stdin, stdout = os.dup(0), os.dup(1)
+    try:
+        costs = {}
+        for name, func in [('jit', jit), ('gcc', gcc)]:
+            descriptor = os.open(input_name, os.O_RDONLY)
+            os.dup2(descriptor, 0)
+            os.close(descriptor)
+            os.dup2(devnull.fileno(), 1)
+            try:
+                costs[name], _ = _timeit(lambda: [func() for run in range(runs)])
+            except OSError:
+                costs[name] = None
+            finally:
+                sys.stdout.flush()
+                os.dup2(stdin, 0)
+                os.dup2(stdout, 1)
+        for name in ['jit', 'gcc']:
+            if costs[name] is None:
+                print ('  %-14s not found' % name)
+            else:
+                print ('  %-14s %8.3fms/run' % (name, costs[name] * 1e3 / runs))
+        if costs['gcc'] is not None:
+            print ('  %-14s %8.1fx' % ('speedup', costs['gcc'] / max(costs['jit'], 1e-9)))
+    finally:
+        devnull.close()
+        os.close(stdin)
+        os.close(stdout)
+        shutil.rmtree(directory)
+
+
+# the instructions the virtual machine runs in a second, of the source and
+# of loops run copies * 100 times
+def bench_vm(text, copies):
+    print ('bytecode in the virtual machine')
+    compiler.long_mode = False
+    loops = ('int main() {\n    int a[8] = {3, 1, 4, 1, 5, 9, 2, 6};\n'
+             '    int i, j, s;\n    float f;\n    s = 0;\n    f = 0.5;\n'
+             '    for (j = 0; j < %d; j++) {\n        for (i = 0; i < 8; i++) {\n'
+             '            s = s + a[i] * j / 3;\n            f = f + s * 0.25;\n'
+             '        }\n    }\n    printf("%%d %%f\\n", s, f);\n    return 0;\n}\n' % (
+                 copies * 100)).encode('ascii')
+    for name, source in [('source', text), ('loops', loops)]:
+        compiler.content = source
+        parser = compiler.Parser()
+        parser.main()
+        cost, bytecode = _timeit(lambda: compiler.BytecodeCompiler(
+            compiler._intermediate(parser.tree)).compile())
+        machine = compiler.VirtualMachine(bytecode, stdin=io.BytesIO(b'1\n' * 64),
+                                          stdout=io.BytesIO())
+        run_cost, _ = _timeit(machine.run)
+        print ('  %-8s %6d instructions compiled in %.3fs, %10d run %8.3fs %12.0f/s' % (
+            name, len(bytecode.code), cost, machine.executed, run_cost,
+            machine.executed / max(run_cost, 1e-9)))
+
+
+BENCHMARKS = [('lexer', bench_lexer), ('tree', bench_tree),
+              ('depth', bench_depth), ('incremental', bench_incremental),
+              ('emit', bench_emit), ('jit', bench_jit), ('vm', bench_vm)]
+
+
+if __name__ == '__main__':
+    try:
+        opts, argvs = getopt.getopt(sys.argv[1:], 's:n:b:h', ['help'])
+    except:
+        print (__doc__)
+        exit()
+
+    source_name = 'source.c'
+    copies = 200
+    names = [name for name, bench in BENCHMARKS]
+    for opt, argv in opts:
+        if opt in ['-h', '--h', '--help']:
+            print (__doc__)
+            exit()
+        elif opt == '-s':
+            source_name = argv
+        elif opt == '-n':
+            copies = int(argv)
+        elif opt == '-b':
+            names = [argv]
+
+    source_file = open(source_name, 'rb')
+    text = source_file.read()
+    source_file.close()
+    for name, bench in BENCHMARKS:
+        if name in names:
+            bench(text, copies)
@@ -15,7 +15,28 @@ Options:
     -s file         import the source file, required!
     -l              lexer
     -p              parser
+    -g              FIRST, FOLLOW sets and LL(1) parse table of grammar.txt
+    -i              the intermediate representation, three address
+                    instructions in basic blocks
     -a              assembler, the assembler file is in the same path with compiler.py
+    -m              stream the tokens from a memory-mapped source file, and
+                    the .text section of -a to the assembler file
+    -c dir          directory of the syntax tree cache of -a, default .ast_cache
+    -n              do not use the syntax tree cache
+    -O              constant folding of the syntax tree, jump threading,
+                    block layout and common subexpressions of the IR, SSE2
+                    vectors of the sums over arrays with --m64 and peephole
+                    optimization of the assembler, prints the rewrites to
+                    stderr
+    -e              ELF object file, encoded without the system assembler,
+                    link it with gcc or ld
+    -r              run the x86-64 code of main in this process, printf and
+                    scanf are the ones of libc, implies --m64
+    -v              run the bytecode of the source in the virtual machine,
+                    printf and scanf are emulated with python
+    -w              watch the source file, assemble it again when it is saved
+    --m64           x86-64 assembler of -a, -e and -w, SSE floats and the SysV
+                    calling convention, the SSE floats of -v
 
 Examples:
     python compiler.py -h
@@ -24,9 +45,23 @@ Examples:
 Enjoy ^_^.
 '''
 
+import os
 import re
 import sys
+import math
+import mmap
+import time
+import ctypes
+import types
+import bisect
+import struct
 import getopt
+import hashlib
+from array import array
+try:
+    from itertools import zip_longest as _zip_longest
+except ImportError:
+    from itertools import izip_longest as _zip_longest
 
 TOKEN_STYLE = [
     'KEY_WORD', 'IDENTIFIER', 'DIGIT_CONSTANT',
@@ -45,6 +80,7 @@ DETAIL_TOKEN_STYLE = {
     'while': 'WHILE',
     'do': 'DO',
     'return': 'RETURN',
+    'void': 'VOID',
     '=': 'ASSIGN',
     '&': 'ADDRESS',
     '<': 'LT',
@@ -80,10 +116,382 @@ operators = [
 
 delimiters = ['(', ')', '{', '}', '[', ']', ',', '\"', ';']
 
+# the larger the priority, the tighter the operator binds
+operator_priority = {'>': 0, '<': 0, '>=': 0, '<=': 0,
+                     '+': 1, '-': 1, '*': 2, '/': 2, '++': 3, '--': 3, '!': 3}
+
+# the integer kinds of tokens, TOKEN_TYPES[kind] is the type name
+TOKEN_TYPES = [
+    'INT', 'FLOAT', 'DOUBLE', 'CHAR', 'VOID',
+    'IF', 'FOR', 'WHILE', 'DO', 'ELSE', 'INCLUDE', 'RETURN',
+    'ASSIGN', 'ADDRESS', 'LT', 'GT', 'SELF_PLUS', 'SELF_MINUS',
+    'PLUS', 'MINUS', 'MUL', 'DIV', 'GET', 'LET',
+    'LL_BRACKET', 'RL_BRACKET', 'LB_BRACKET', 'RB_BRACKET', 'LM_BRACKET',
+    'RM_BRACKET', 'COMMA', 'DOUBLE_QUOTE', 'SEMICOLON', 'SHARP',
+    'IDENTIFIER', 'DIGIT_CONSTANT', 'STRING_CONSTANT',
+]
+
+(T_INT, T_FLOAT, T_DOUBLE, T_CHAR, T_VOID,
+ T_IF, T_FOR, T_WHILE, T_DO, T_ELSE, T_INCLUDE, T_RETURN,
+ T_ASSIGN, T_ADDRESS, T_LT, T_GT, T_SELF_PLUS, T_SELF_MINUS,
+ T_PLUS, T_MINUS, T_MUL, T_DIV, T_GET, T_LET,
+ T_LL_BRACKET, T_RL_BRACKET, T_LB_BRACKET, T_RB_BRACKET, T_LM_BRACKET,
+ T_RM_BRACKET, T_COMMA, T_DOUBLE_QUOTE, T_SEMICOLON, T_SHARP,
+ T_IDENTIFIER, T_DIGIT_CONSTANT, T_STRING_CONSTANT) = range(len(TOKEN_TYPES))
+
+# the kinds before T_IDENTIFIER always have the same value
+TOKEN_VALUES = [None] * len(TOKEN_TYPES)
+for value, _type in DETAIL_TOKEN_STYLE.items():
+    TOKEN_VALUES[TOKEN_TYPES.index(_type)] = value
+
+# kind of a keyword, operator or delimiter, keyed by its bytes in the source
+LEXEME_KINDS = dict(
+    (value.encode('ascii'), TOKEN_TYPES.index(_type))
+    for value, _type in DETAIL_TOKEN_STYLE.items())
+
+TYPE_KINDS = frozenset([T_INT, T_FLOAT, T_DOUBLE, T_CHAR, T_VOID])
+
+OPERATOR_KINDS = frozenset([
+    T_ASSIGN, T_ADDRESS, T_LT, T_GT, T_SELF_PLUS, T_SELF_MINUS,
+    T_PLUS, T_MINUS, T_MUL, T_DIV, T_GET, T_LET])
+
+# symbols of grammar.txt that are not lexemes
+GRAMMAR_TERMINALS = {'ID': T_IDENTIFIER, 'Num': T_DIGIT_CONSTANT,
+                     'String': T_STRING_CONSTANT}
+
+GRAMMAR_EMPTY = u'\u2211'
+
+# kind after the last token
+GRAMMAR_END = -1
+
+# most tokens looked at to tell the sentence pattern
+GRAMMAR_LOOKAHEAD = 4
+
+# instructions a peephole rule looks through, and the instructions kept
+# back when the .text section is streamed
+PEEPHOLE_WINDOW = 32
+
+# the assembler reads the operands and writes the last one
+STORE_OPCODES = frozenset([
+    'movl', 'leal', 'fstps', 'fsts', 'fstpl', 'fstl', 'fisttpl', 'popl'])
+
+# the assembler reads all the operands and writes the last one
+UPDATE_OPCODES = frozenset([
+    'add', 'addl', 'sub', 'subl', 'imull', 'andl', 'orl', 'xorl', 'shll',
+    'sarl', 'shrl', 'incl', 'decl', 'negl', 'notl'])
+
+# the assembler only reads the operands, the x87 registers are not followed
+READ_OPCODES = frozenset([
+    'cmpl', 'testl', 'pushl', 'finit', 'flds', 'fldl', 'filds', 'fildl',
+    'fld1', 'fldz', 'fstp', 'fadd', 'fsub', 'fmul', 'fdiv', 'fadds', 'fsubs',
+    'fmuls', 'fdivs', 'fsubrs', 'fdivrs', 'faddp', 'fsubp', 'fsubrp',
+    'fmulp', 'fdivp', 'fdivrp', 'fiadd', 'fisub', 'fimul', 'fidiv', 'fiaddl',
+    'fisubl', 'fimull', 'fidivl', 'fisubrl', 'fidivrl', 'fcom', 'fcoms',
+    'fcomp', 'ficom', 'fucomip'])
+
+# they read and write %eax and %edx besides the operands
+MULTIPLY_OPCODES = frozenset(['mull', 'divl', 'idivl', 'cltd'])
+
+# the registers a called function may change
+CALLER_SAVED = frozenset(['%eax', '%ecx', '%edx'])
+
+# the 32 bit register of a part of it
+REGISTER_ALIASES = dict(
+    ('%' + name + part, '%e' + name + 'x') for name in 'abcd' for part in 'xhl')
+
+# registers of the integer temporaries of the expressions, the caller saved
+# ones first
+TEMPORARY_REGISTERS = ['%eax', '%ecx', '%edx', '%ebx', '%esi', '%edi']
+
+# the x86-64 registers of the int and float temporaries, %r9d to %r11d are
+# the scratch registers and %xmm13 to %xmm15 the float and vector ones
+LONG_TEMPORARY_REGISTERS = [
+    '%eax', '%ecx', '%edx', '%esi', '%edi', '%r8d', '%ebx', '%r12d', '%r13d',
+    '%r14d', '%r15d']
+LONG_SCRATCH_REGISTERS = ['%r9d', '%r10d', '%r11d']
+LONG_FLOAT_REGISTERS = ['%xmm' + str(number) for number in range(13)]
+
+# the registers a called function may change in the SysV ABI
+LONG_CALLER_SAVED = frozenset([
+    '%eax', '%ecx', '%edx', '%esi', '%edi', '%r8d', '%r9d', '%r10d',
+    '%r11d'] + LONG_FLOAT_REGISTERS)
+
+# the registers of the int and float arguments of the calls
+INTEGER_ARGUMENTS = ['%edi', '%esi', '%edx', '%ecx', '%r8d', '%r9d']
+FLOAT_ARGUMENTS = ['%xmm' + str(number) for number in range(8)]
+
+# the 64 bit register of a 32 bit one
+QUAD_REGISTERS = dict(
+    [('%e' + name, '%r' + name) for name in ['ax', 'bx', 'cx', 'dx', 'si', 'di', 'bp', 'sp']] +
+    [('%r' + str(number) + 'd', '%r' + str(number)) for number in range(8, 16)])
+
+# the peephole rules follow the 32 bit register of a 64 bit one
+REGISTER_ALIASES.update((quad, name) for name, quad in QUAD_REGISTERS.items())
+
+# the x87 registers of the float temporaries
+FLOAT_STACK_SIZE = 8
+
+INTEGER_INSTRUCTIONS = {'add': 'addl', 'sub': 'subl', 'mul': 'imull'}
+
+# xmm = xmm op memory or xmm
+SSE_INSTRUCTIONS = {'add': 'addss', 'sub': 'subss', 'mul': 'mulss', 'div': 'divss'}
+
+# xmm = xmm op xmm of the vectors, SSE2 multiplies the int lanes in pairs
+VECTOR_INSTRUCTIONS = {
+    'int4': {'add': 'paddd', 'sub': 'psubd'},
+    'float4': {'add': 'addps', 'sub': 'subps', 'mul': 'mulps', 'div': 'divps'}}
+
+# st(0) = st(0) op memory, and st(1) = st(1) op st(0) with a p after them,
+# the assembler swaps the operands of fsubp and fdivp
+FLOAT_INSTRUCTIONS = {'add': 'fadd', 'sub': 'fsub', 'mul': 'fmul', 'div': 'fdiv'}
+
+# st(0) = memory op st(0), and st(1) = st(0) op st(1) with a p after them
+REVERSED_FLOAT_INSTRUCTIONS = {'add': 'fadd', 'sub': 'fsubr', 'mul': 'fmul', 'div': 'fdivr'}
+
+# the jumps taken when a comparison holds, signed after cmpl and unsigned
+# after fucomip
+INTEGER_JUMPS = {'>': 'jg', '<': 'jl', '>=': 'jge', '<=': 'jle', '==': 'je', '!=': 'jne'}
+FLOAT_JUMPS = {'>': 'ja', '<': 'jb', '>=': 'jae', '<=': 'jbe', '==': 'je', '!=': 'jne'}
+
+# a < b fails when a >= b holds
+NEGATED_COMPARISONS = {'>': '<=', '<': '>=', '>=': '<', '<=': '>', '==': '!=', '!=': '=='}
+
+# a < b is b > a
+MIRRORED_COMPARISONS = {'>': '<', '<': '>', '>=': '<=', '<=': '>='}
+
+# opcodes of the IR and their numbers of operands, call takes any number
+IR_OPCODES = {
+    'load': 1, 'store': 2, 'load_item': 2, 'store_item': 3, 'addr': 1,
+    'add': 2, 'sub': 2, 'mul': 2, 'div': 2, 'itof': 1, 'ftoi': 1,
+    'call': None, 'jump': 1, 'branch': 5, 'return': 1,
+    'load_vector': 2, 'broadcast': 1, 'lane': 2, 'sum': 1}
+
+# the last instruction of every basic block, and only it
+IR_TERMINATORS = frozenset(['jump', 'branch', 'return'])
+
+# the instructions without a target
+IR_EFFECTS = frozenset(['store', 'store_item', 'call', 'jump', 'branch', 'return'])
+
+IR_ARITHMETIC = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'div'}
+
+# the comparisons of branch, != 0 tests a value which is not one
+IR_COMPARISONS = frozenset(NEGATED_COMPARISONS)
+
+# the vectors of the IR hold VECTOR_LANES ints or floats, load_vector reads
+# them from the items of an array from an index, broadcast puts a constant
+# in all of them, lane takes one of them and sum adds the int ones
+VECTOR_LANES = 4
+VECTOR_TYPES = {'int': 'int4', 'float': 'float4'}
+LANE_TYPES = dict((vector, lane) for lane, vector in VECTOR_TYPES.items())
+
+# times a block in a loop is taken to run for every run of the block
+# around the loop, and the chance a branch leaves the loop it is in
+LOOP_FREQUENCY = 10
+LOOP_EXIT_CHANCE = 0.1
+# the deeper loops weigh as much as this depth, the weight stays a float
+LOOP_DEPTH_LIMIT = 300
+
+# the callee saved registers the variables promoted in the loops are kept
+# in, and the most loads of the variables a loop does not write which are
+# hoisted in front of it
+LOOP_REGISTERS = ['%ebx', '%edi']
+LOOP_HOISTS = 2
+
+# the callee saved registers of them in the x86-64 code
+LONG_LOOP_REGISTERS = ['%ebx', '%r12d']
+
+# the numbers of the registers in the ModRM and SIB bytes, the ones from 8
+# on take a bit of the REX prefix
+MACHINE_REGISTERS = dict(
+    [(name, number) for number, name in enumerate(
+        ['%eax', '%ecx', '%edx', '%ebx', '%esp', '%ebp', '%esi', '%edi'])] +
+    [(name, number) for number, name in enumerate(
+        ['%rax', '%rcx', '%rdx', '%rbx', '%rsp', '%rbp', '%rsi', '%rdi'])] +
+    [('%r' + str(number) + 'd', number) for number in range(8, 16)] +
+    [('%r' + str(number), number) for number in range(8, 16)] +
+    [('%xmm' + str(number), number) for number in range(16)])
+
+# the instructions of two operands: the /digit of the immediate form, and
+# the opcodes of the register to r/m, r/m to register and %eax immediate
+# forms
+ARITHMETIC_OPCODES = {
+    'add': (0, 0x01, 0x03, 0x05), 'or': (1, 0x09, 0x0b, 0x0d),
+    'and': (4, 0x21, 0x23, 0x25), 'sub': (5, 0x29, 0x2b, 0x2d),
+    'xor': (6, 0x31, 0x33, 0x35), 'cmp': (7, 0x39, 0x3b, 0x3d)}
+
+# the instructions of one r/m operand, the opcode and the /digit
+UNARY_OPCODES = {
+    'not': (0xf7, 2), 'neg': (0xf7, 3), 'mul': (0xf7, 4), 'imul': (0xf7, 5),
+    'div': (0xf7, 6), 'idiv': (0xf7, 7), 'inc': (0xff, 0), 'dec': (0xff, 1)}
+
+SHIFT_OPCODES = {'shl': 4, 'shr': 5, 'sar': 7}
+
+# the x87 instructions of a memory operand, the opcode and the /digit
+X87_OPCODES = {
+    'fadds': (0xd8, 0), 'fmuls': (0xd8, 1), 'fcoms': (0xd8, 2), 'fcomps': (0xd8, 3),
+    'fsubs': (0xd8, 4), 'fsubrs': (0xd8, 5), 'fdivs': (0xd8, 6), 'fdivrs': (0xd8, 7),
+    'flds': (0xd9, 0), 'fsts': (0xd9, 2), 'fstps': (0xd9, 3),
+    'fiaddl': (0xda, 0), 'fimull': (0xda, 1), 'ficoml': (0xda, 2), 'fisubl': (0xda, 4),
+    'fisubrl': (0xda, 5), 'fidivl': (0xda, 6), 'fidivrl': (0xda, 7),
+    'fildl': (0xdb, 0), 'fisttpl': (0xdb, 1), 'fistl': (0xdb, 2), 'fistpl': (0xdb, 3),
+    'fldl': (0xdd, 0), 'fstl': (0xdd, 2), 'fstpl': (0xdd, 3)}
+
+# the x87 instructions of the stack registers, keyed by their operands too
+X87_BYTES = {
+    ('finit',): b'\x9b\xdb\xe3', ('fld1',): b'\xd9\xe8', ('fldz',): b'\xd9\xee',
+    ('fchs',): b'\xd9\xe0', ('faddp',): b'\xde\xc1', ('fmulp',): b'\xde\xc9',
+    ('fsubp',): b'\xde\xe1', ('fsubrp',): b'\xde\xe9', ('fdivp',): b'\xde\xf1',
+    ('fdivrp',): b'\xde\xf9', ('fstp', '%st(0)'): b'\xdd\xd8',
+    ('fucomip', '%st(1)', '%st'): b'\xdf\xe9'}
+
+# the SSE instructions: the prefix, the opcode after 0x0f of the form
+# writing the register and the one writing the r/m operand
+SSE_OPCODES = {
+    'movss': (0xf3, 0x10, 0x11), 'movsd': (0xf2, 0x10, 0x11),
+    'addss': (0xf3, 0x58, None), 'mulss': (0xf3, 0x59, None),
+    'subss': (0xf3, 0x5c, None), 'divss': (0xf3, 0x5e, None),
+    'cvtsi2ssl': (0xf3, 0x2a, None), 'cvttss2si': (0xf3, 0x2c, None),
+    'cvtss2sd': (0xf3, 0x5a, None), 'ucomiss': (None, 0x2e, None),
+    'addps': (None, 0x58, None), 'mulps': (None, 0x59, None),
+    'subps': (None, 0x5c, None), 'divps': (None, 0x5e, None),
+    'cvtdq2ps': (None, 0x5b, None), 'movdqa': (0x66, 0x6f, 0x7f),
+    'movdqu': (0xf3, 0x6f, 0x7f), 'movd': (0x66, 0x6e, 0x7e),
+    'paddd': (0x66, 0xfe, None), 'psubd': (0x66, 0xfa, None),
+    'pmuludq': (0x66, 0xf4, None), 'punpckldq': (0x66, 0x62, None),
+    'pshufd': (0x66, 0x70, None)}
+
+# the condition codes of the jumps, jcc is 0x70 + code or 0x0f 0x80 + code
+JUMP_CONDITIONS = {
+    'jo': 0, 'jno': 1, 'jb': 2, 'jae': 3, 'je': 4, 'jne': 5, 'jbe': 6, 'ja': 7,
+    'js': 8, 'jns': 9, 'jp': 10, 'jnp': 11, 'jl': 12, 'jge': 13, 'jle': 14, 'jg': 15}
+
+# the relocation types of the absolute, %rip or %eip relative and call
+# displacements in ELF32 and ELF64
+RELOCATION_TYPES = {
+    False: {'absolute': 1, 'relative': 2, 'call': 2},
+    True: {'absolute': 10, 'relative': 2, 'call': 4}}
+
+# the code around main of -r: it keeps the callee saved registers and the
+# stack of the caller, exit goes back to them and returns its status
+JIT_LINES = [
+    'jit_main:', 'pushq %rbx', 'pushq %rbp', 'pushq %r12', 'pushq %r13', 'pushq %r14',
+    'pushq %r15', 'subq $8, %rsp', 'movq %rsp, jit_stack(%rip)', 'call main',
+    'movl %eax, %edi', 'exit:', 'movq jit_stack(%rip), %rsp', 'movl %edi, %eax',
+    'addq $8, %rsp', 'popq %r15', 'popq %r14', 'popq %r13', 'popq %r12', 'popq %rbp',
+    'popq %rbx', 'ret']
+
+# the functions of libc called by -r, through jmp *address(%rip)
+JIT_FUNCTIONS = ['printf', 'scanf']
+
+# the opcodes of the bytecode of -v, BYTECODE_OPCODES[opcode] is the name.
+# an instruction is the opcode and four operands, the slots of the values,
+# the items of the ints or floats or the indexes of the instructions
+BYTECODE_OPCODES = [
+    'load_int', 'load_float', 'store_int', 'store_float',
+    'load_item_int', 'load_item_float', 'store_item_int', 'store_item_float',
+    'add_int', 'sub_int', 'mul_int', 'div_int',
+    'add_float', 'sub_float', 'mul_float', 'div_float', 'itof', 'ftoi',
+    'jump', 'branch<', 'branch<=', 'branch>', 'branch>=', 'branch==', 'branch!=',
+    'call', 'return']
+
+(B_LOAD_INT, B_LOAD_FLOAT, B_STORE_INT, B_STORE_FLOAT,
+ B_LOAD_ITEM_INT, B_LOAD_ITEM_FLOAT, B_STORE_ITEM_INT, B_STORE_ITEM_FLOAT,
+ B_ADD_INT, B_SUB_INT, B_MUL_INT, B_DIV_INT,
+ B_ADD_FLOAT, B_SUB_FLOAT, B_MUL_FLOAT, B_DIV_FLOAT, B_ITOF, B_FTOI,
+ B_JUMP, B_BRANCH_LT, B_BRANCH_LE, B_BRANCH_GT, B_BRANCH_GE, B_BRANCH_EQ, B_BRANCH_NE,
+ B_CALL, B_RETURN) = range(len(BYTECODE_OPCODES))
+
+# the conversions of printf without their length modifiers, which python
+# does not take, and the ones of scanf
+PRINTF_CONVERSION = re.compile(br'%([-+ #0]*[0-9]*(?:\.[0-9]*)?)[hlLqjzt]*([diouxXeEfFgGcs%])')
+SCANF_CONVERSION = re.compile(br'%[0-9]*[hlLqjzt]*([a-zA-Z])')
+
+# C prints the ints of these conversions as an unsigned char and int
+PRINTF_MASKS = {b'c': 0xff, b'u': 0xffffffff, b'o': 0xffffffff,
+                b'x': 0xffffffff, b'X': 0xffffffff}
+
+# the text scanf reads for the conversions
+SCANF_NUMBERS = {
+    'int': re.compile(br'\s*([-+]?[0-9]+)'),
+    'float': re.compile(br'\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)')}
+
+AST_MAGIC = b'CAST'
+
+AST_FORMAT = 1
+
+# magic, format, numbers of nodes, strings, extra_infos and extra_info items
+AST_HEADER = '<4sHIIII'
+
+AST_CACHE_SIZE = 64 << 20
+
+# the closing bracket of an opening one is the next kind
+OPENING_KINDS = frozenset([T_LL_BRACKET, T_LB_BRACKET, T_LM_BRACKET])
+
+CLOSING_KINDS = frozenset([T_RL_BRACKET, T_RB_BRACKET, T_RM_BRACKET])
+
+UNARY_PRIORITY = operator_priority['++']
+
+# priority of the binary operators, keyed by kind
+BINARY_PRIORITY = dict(
+    (LEXEME_KINDS[operator.encode('ascii')], priority)
+    for operator, priority in operator_priority.items()
+    if priority < UNARY_PRIORITY)
+
+# one alternation for the whole lexer, the name of the matched group is the
+# kind of the lexeme
+TOKEN_PATTERN = re.compile(br'''
+    (?P<BLANK>[ \t\r\n]+)
+  | \#[ \t\r\n]*(?P<INCLUDE>include)[ \t\r\n]*(?:
+        (?P<OPEN_LT><)[ \t\r\n]*(?P<LIB_LT>[^>]*)>
+      | "(?P<LIB_QUOTE>[^"]*)")
+  | (?P<WORD>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<NUMBER>[0-9]+(?:\.[0-9]*)?)
+  | "(?P<STRING>[^"]*)"
+  | (?P<OPERATOR>\+\+|--|>=|<=|[=&<>+\-*/])
+  | (?P<DELIMITER>[(){}\[\],;])
+  | (?P<ERROR>.)
+''', re.VERBOSE | re.DOTALL)
+
+# part of the syntax tree cache key, bump it when the syntax tree changes
+VERSION = '2.1'
+
 file_name = None
 
+source_name = None
+
 content = None
 
+stream_mode = False
+
+optimize = False
+
+long_mode = False
+
+cache_dir = '.ast_cache'
+
+
+def _to_str(value):
+    return value if isinstance(value, str) else value.decode('utf-8')
+
+
+# arrays are stored little endian
+def _array_to_bytes(items):
+    if sys.byteorder != 'little':
+        items = array(items.typecode, items)
+        items.byteswap()
+    return items.tobytes() if hasattr(items, 'tobytes') else items.tostring()
+
+
+def _array_from_bytes(typecode, data):
+    items = array(typecode)
+    if hasattr(items, 'frombytes'):
+        items.frombytes(data)
+    else:
+        items.fromstring(data)
+    if sys.byteorder != 'little':
+        items.byteswap()
+    return items
+
 
 class Token(object):
 
@@ -121,93 +529,197 @@ class Lexer(object):
                 return True
         return False
 
-    def main(self):
-        i = 0
-        while i < len(content):
-            i = self.skip_blank(i)
-            if content[i] == '#':
-                self.tokens.append(Token(4, content[i]))
-                i = self.skip_blank(i + 1)
-                while i < len(content):
-                    if re.match('include', content[i:]):
-                        self.tokens.append(Token(0, 'include'))
-                        i = self.skip_blank(i + 7)
-                    elif content[i] == '\"' or content[i] == '<':
-                        self.tokens.append(Token(4, content[i]))
-                        i = self.skip_blank(i + 1)
-                        close_flag = '\"' if content[i] == '\"' else '>'
-                        lib = ''
-                        while content[i] != close_flag:
-                            lib += content[i]
-                            i += 1
-
-                        self.tokens.append(Token(1, lib))
-                        self.tokens.append(Token(4, close_flag))
-                        i = self.skip_blank(i + 1)
-                        break
-                    else:
-                        print ('include error!')
-                        exit()
-            elif content[i].isalpha() or content[i] == '_':
-                temp = ''
-                while i < len(content) and (
-                        content[i].isalpha() or
-                        content[i] == '_' or
-                        content[i].isdigit()):
-                    temp += content[i]
-                    i += 1
-                if self.is_keyword(temp):
-                    self.tokens.append(Token(0, temp))
+    # (kind, start, end) of every token in source[start:end]
+    def scan(self, source, start=0, end=None):
+        if end is None:
+            end = len(source)
+        for match in TOKEN_PATTERN.finditer(source, start, end):
+            group = match.lastgroup
+            if group == 'BLANK':
+                continue
+            start, end = match.span(group)
+            if group == 'WORD':
+                yield LEXEME_KINDS.get(match.group(group), T_IDENTIFIER), start, end
+            elif group == 'DELIMITER' or group == 'OPERATOR':
+                yield LEXEME_KINDS[match.group(group)], start, end
+            elif group == 'NUMBER':
+                if match.group(group).endswith(b'.'):
+                    print ('float number error!')
+                    exit()
+                yield T_DIGIT_CONSTANT, start, end
+            elif group == 'STRING':
+                yield T_DOUBLE_QUOTE, start - 1, start
+                yield T_STRING_CONSTANT, start, end
+                yield T_DOUBLE_QUOTE, end, end + 1
+            elif group == 'LIB_LT' or group == 'LIB_QUOTE':
+                yield T_SHARP, match.start(), match.start() + 1
+                yield (T_INCLUDE,) + match.span('INCLUDE')
+                if group == 'LIB_LT':
+                    yield (T_LT,) + match.span('OPEN_LT')
+                    yield T_IDENTIFIER, start, end
+                    yield T_GT, end, end + 1
                 else:
-                    self.tokens.append(Token(1, temp))
-                i = self.skip_blank(i)
-            elif content[i].isdigit():
-                temp = ''
-                while i < len(content):
-                    if content[i].isdigit() or (
-                            content[i] == '.' and content[i + 1].isdigit()):
-                        temp += content[i]
-                        i += 1
-                    elif not content[i].isdigit():
-                        if content[i] == '.':
-                            print ('float number error!')
-                            exit()
-                        else:
-                            break
-                self.tokens.append(Token(2, temp))
-                i = self.skip_blank(i)
-            elif content[i] in delimiters:
-                self.tokens.append(Token(4, content[i]))
-                if content[i] == '\"':
-                    i += 1
-                    temp = ''
-                    while i < len(content):
-                        if content[i] != '\"':
-                            temp += content[i]
-                            i += 1
-                        else:
-                            break
-                    else:
-                        print ('error:lack of \"')
-                        exit()
-                    self.tokens.append(Token(5, temp))
-                    self.tokens.append(Token(4, '\"'))
-                i = self.skip_blank(i + 1)
-            elif content[i] in operators:
-                if (content[i] == '+' or content[i] == '-') and (
-                        content[i + 1] == content[i]):
-                    self.tokens.append(Token(3, content[i] * 2))
-                    i = self.skip_blank(i + 2)
-                elif (content[i] == '>' or content[i] == '<') and content[i + 1] == '=':
-                    self.tokens.append(Token(3, content[i] + '='))
-                    i = self.skip_blank(i + 2)
+                    yield T_DOUBLE_QUOTE, start - 1, start
+                    yield T_IDENTIFIER, start, end
+                    yield T_DOUBLE_QUOTE, end, end + 1
+            else:
+                value = _to_str(match.group())
+                if value == '#':
+                    print ('include error!')
+                elif value == '\"':
+                    print ('error:lack of \"')
                 else:
-                    self.tokens.append(Token(3, content[i]))
-                    i = self.skip_blank(i + 1)
+                    print ('unknown character: ' + value)
+                exit()
+
+    # scan and pair the brackets, the fourth item is the index of the
+    # opening bracket for a closing one and -1 for the others
+    def scan_brackets(self, source, start=0, end=None):
+        openers = []
+        index = -1
+        for kind, start, end in self.scan(source, start, end):
+            index += 1
+            opener = -1
+            if kind in OPENING_KINDS:
+                openers.append((index, kind, start))
+            elif kind in CLOSING_KINDS:
+                if not openers or openers[-1][1] + 1 != kind:
+                    self._bracket_error(source, TOKEN_VALUES[kind], start)
+                opener = openers.pop()[0]
+            yield kind, start, end, opener
+        if openers:
+            index, kind, start = openers[-1]
+            self._bracket_error(source, TOKEN_VALUES[kind], start)
+
+    def _bracket_error(self, source, value, offset):
+        line = source[:offset].count(b'\n') + 1
+        print ('error: unbalanced bracket ' + value + ' in line ' + str(line))
+        exit()
+
+    def main(self):
+        self.tokens = TokenArray(content)
+        append = self.tokens.append
+        for kind, start, end, opener in self.scan_brackets(content):
+            append(kind, start, end, opener)
+
+    # (kind, value, opener) of every token in a memory-mapped file
+    def stream(self, path):
+        source_file = open(path, 'rb')
+        try:
+            try:
+                source = mmap.mmap(
+                    source_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file can not be mapped
+                return
+            try:
+                for kind, start, end, opener in self.scan_brackets(source):
+                    if kind < T_IDENTIFIER:
+                        yield kind, TOKEN_VALUES[kind], opener
+                    else:
+                        yield kind, _to_str(source[start:end]), opener
+            finally:
+                source.close()
+        finally:
+            source_file.close()
+
+
+class TokenArray(object):
+    '''
+    columnar token list, the kinds are kept in an array of bytes and the
+    values are sliced from the source only when asked for
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('i')
+        self.ends = array('i')
+        # index of the paired bracket, -1 for the other tokens
+        self.matches = array('i')
+        # kind(index) raises IndexError after the last token
+        self.kind = self.kinds.__getitem__
+        self.match = self.matches.__getitem__
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind, start, end, opener=-1):
+        if opener >= 0:
+            self.matches[opener] = len(self.kinds)
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.matches.append(opener)
+
+    def value(self, index):
+        kind = self.kinds[index]
+        if kind < T_IDENTIFIER:
+            return TOKEN_VALUES[kind]
+        return _to_str(self.source[self.starts[index]:self.ends[index]])
+
+    # the tokens are all kept, unlike the ones of TokenStream. they take a
+    # few bytes each next to the source in memory, and the incremental
+    # parser reads the starts of the sentences it has parsed
+    def release(self, index):
+        pass
+
+
+class TokenStream(object):
+    '''
+    token list over a (kind, value, opener) generator, only the tokens from
+    the start of the current sentence up to the furthest lookahead are kept
+    in memory
+    '''
+
+    def __init__(self, tokens):
+        self.generator = iter(tokens)
+        self.buffer = []
+        # index of buffer[0]
+        self.base = 0
+        # opening bracket -> closing bracket, for the buffered closers
+        self.closers = {}
+
+    def _get(self, index):
+        offset = index - self.base
+        if offset < 0:
+            raise IndexError('token ' + str(index) + ' is released')
+        while offset >= len(self.buffer):
+            try:
+                token = next(self.generator)
+            except StopIteration:
+                raise IndexError('token index out of range')
+            if token[2] >= 0:
+                self.closers[token[2]] = self.base + len(self.buffer)
+            self.buffer.append(token)
+        return self.buffer[offset]
+
+    def kind(self, index):
+        return self._get(index)[0]
+
+    def value(self, index):
+        return self._get(index)[1]
+
+    # closing bracket of the opening one at index
+    def match(self, index):
+        while index not in self.closers:
+            self._get(self.base + len(self.buffer))
+        return self.closers[index]
+
+    # drop the tokens before index
+    def release(self, index):
+        if index > self.base:
+            del self.buffer[:index - self.base]
+            self.base = index
+            for opener in [opener for opener in self.closers if opener < index]:
+                del self.closers[opener]
 
 
 class SyntaxTreeNode(object):
 
+    __slots__ = ('value', 'type', 'extra_info', 'father',
+                 'left', 'right', 'first_son', 'last_son')
+
     def __init__(self, value=None, _type=None, extra_info=None):
         self.value = value
         self.type = _type
@@ -216,6 +728,7 @@ class SyntaxTreeNode(object):
         self.left = None
         self.right = None
         self.first_son = None
+        self.last_son = None
     # value
 
     def set_value(self, value):
@@ -229,9 +742,45 @@ class SyntaxTreeNode(object):
     def set_extra_info(self, extra_info):
         self.extra_info = extra_info
 
+    # (node, True) before and (node, False) after the sons of every node
+    # under self, walked with an explicit stack instead of recursion
+    def walk(self):
+        yield self, True
+        stack = [self]
+        node = self.first_son
+        while True:
+            if node:
+                yield node, True
+                stack.append(node)
+                node = node.first_son
+            else:
+                node = stack.pop()
+                yield node, False
+                if not stack:
+                    return
+                node = node.right
+
+    def preorder(self):
+        for node, entering in self.walk():
+            if entering:
+                yield node
+
+    # whether the trees under self and other have the same shape and nodes
+    def same(self, other):
+        missing = object()
+        for (a, a_entering), (b, b_entering) in _zip_longest(
+                self.walk(), other.walk(), fillvalue=(missing, None)):
+            if a is missing or b is missing or a_entering != b_entering:
+                return False
+            if (a.value, a.type, a.extra_info) != (b.value, b.type, b.extra_info):
+                return False
+        return True
+
 
 class SyntaxTree(object):
 
+    __slots__ = ('root', 'current')
+
     def __init__(self):
         self.root = None
         self.current = None
@@ -243,13 +792,35 @@ class SyntaxTree(object):
         if not father.first_son:
             father.first_son = new_node
         else:
-            current_node = father.first_son
-            while current_node.right:
-                current_node = current_node.right
-            current_node.right = new_node
-            new_node.left = current_node
+            father.last_son.right = new_node
+            new_node.left = father.last_son
+        father.last_son = new_node
         self.current = new_node
 
+    # replace the sons of father between the brothers left and right (None
+    # for the ends) by the sons of new_father
+    def replace_sons(self, father, left, right, new_father):
+        first = new_father.first_son
+        last = new_father.last_son
+        node = first
+        while node:
+            node.father = father
+            node = node.right
+        if first:
+            first.left = left
+            last.right = right
+        else:
+            first, last = right, left
+        if left:
+            left.right = first
+        else:
+            father.first_son = first
+        if right:
+            right.left = last
+        else:
+            father.last_son = last
+        new_father.first_son = new_father.last_son = None
+
     def switch(self, left, right):
         left_left = left.left
         right_right = right.right
@@ -259,44 +830,532 @@ class SyntaxTree(object):
         right.right = left
         if left_left:
             left_left.right = right
+        else:
+            left.father.first_son = right
         if right_right:
             right_right.left = left
+        else:
+            right.father.last_son = left
 
 
-class Parser(object):
+class SyntaxTreeArena(object):
+    '''
+    syntax tree kept in parallel arrays, a node is an index into them and
+    -1 stands for no node
+    '''
 
     def __init__(self):
-        lexer = Lexer()
-        lexer.main()
+        self.values = []
+        self.types = []
+        self.extra_infos = []
+        self.fathers = array('i')
+        self.lefts = array('i')
+        self.rights = array('i')
+        self.first_sons = array('i')
+        self.last_sons = array('i')
+
+    def __len__(self):
+        return len(self.values)
+
+    def add_node(self, value=None, _type=None, extra_info=None, father=-1):
+        node = len(self.values)
+        self.values.append(value)
+        self.types.append(_type)
+        self.extra_infos.append(extra_info)
+        self.fathers.append(father)
+        self.rights.append(-1)
+        self.first_sons.append(-1)
+        self.last_sons.append(-1)
+        if father < 0:
+            self.lefts.append(-1)
+        elif self.first_sons[father] < 0:
+            self.lefts.append(-1)
+            self.first_sons[father] = self.last_sons[father] = node
+        else:
+            tail = self.last_sons[father]
+            self.lefts.append(tail)
+            self.rights[tail] = self.last_sons[father] = node
+        return node
+
+    # copy the tree under root into the arena, return the index of root
+    def pack(self, root):
+        first = len(self.values)
+        stack = [(root, -1)]
+        while stack:
+            tree_node, father = stack.pop()
+            node = self.add_node(
+                tree_node.value, tree_node.type, tree_node.extra_info, father)
+            # push the sons backwards so that the first son is added first
+            child = tree_node.last_son
+            while child:
+                stack.append((child, node))
+                child = child.left
+        return first
+
+    # binary format: header, then int arrays of the fathers and of the ids of
+    # the values, types and extra_infos of the nodes, then the tables
+    def dumps(self):
+        strings = []
+        string_ids = {None: -1}
+        extras = []
+        extra_ids = {None: -1}
+
+        def string_id(value):
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            return string_ids[value]
+
+        def extra_id(extra_info):
+            if extra_info is None:
+                return -1
+            key = tuple(sorted(extra_info.items()))
+            if key not in extra_ids:
+                extra_ids[key] = len(extras)
+                extras.append(key)
+            return extra_ids[key]
+
+        values = array('i', [string_id(value) for value in self.values])
+        _types = array('i', [string_id(_type) for _type in self.types])
+        extra_infos = array(
+            'i', [extra_id(extra_info) for extra_info in self.extra_infos])
+        extra_sizes = array('i', [len(extra) for extra in extras])
+        extra_items = array('i')
+        for extra in extras:
+            for key, value in extra:
+                extra_items.append(string_id(key))
+                extra_items.append(string_id(value))
+        blobs = [string.encode('utf-8') for string in strings]
+        string_sizes = array('i', [len(blob) for blob in blobs])
+        header = struct.pack(AST_HEADER, AST_MAGIC, AST_FORMAT, len(self.values),
+                             len(strings), len(extras), len(extra_items))
+        return b''.join([header] + [_array_to_bytes(items) for items in [
+            self.fathers, values, _types, extra_infos, extra_sizes,
+            extra_items, string_sizes]] + blobs)
+
+    @classmethod
+    def loads(cls, data):
+        magic, _format, node_number, string_number, extra_number, item_number = struct.unpack_from(
+            AST_HEADER, data)
+        if magic != AST_MAGIC or _format != AST_FORMAT:
+            raise ValueError('not a syntax tree')
+        offset = struct.calcsize(AST_HEADER)
+        columns = []
+        for size in [node_number] * 4 + [extra_number, item_number, string_number]:
+            columns.append(_array_from_bytes('i', data[offset:offset + 4 * size]))
+            offset += 4 * size
+        fathers, values, _types, extra_infos, extra_sizes, extra_items, string_sizes = columns
+        strings = []
+        for size in string_sizes:
+            strings.append(_to_str(data[offset:offset + size]))
+            offset += size
+        if offset != len(data):
+            raise ValueError('broken syntax tree')
+        strings.append(None)
+        extras = []
+        start = 0
+        for size in extra_sizes:
+            extras.append([(strings[extra_items[item]], strings[extra_items[item + 1]])
+                           for item in range(start, start + 2 * size, 2)])
+            start += 2 * size
+        # strings[-1] and extras[-1] stand for None
+        extras.append(None)
+        arena = cls()
+        arena.values = [strings[value] for value in values]
+        arena.types = [strings[_type] for _type in _types]
+        arena.extra_infos = [extra and dict(extra) for extra in [
+            extras[extra_info] for extra_info in extra_infos]]
+        arena.fathers = fathers
+        arena.lefts = array('i', [-1]) * node_number
+        arena.rights = array('i', [-1]) * node_number
+        arena.first_sons = array('i', [-1]) * node_number
+        arena.last_sons = array('i', [-1]) * node_number
+        lefts, rights, first_sons, last_sons = arena.lefts, arena.rights, arena.first_sons, arena.last_sons
+        for node in range(node_number):
+            father = fathers[node]
+            if father < 0:
+                continue
+            if father >= node:
+                raise ValueError('broken syntax tree')
+            tail = last_sons[father]
+            if tail < 0:
+                first_sons[father] = node
+            else:
+                rights[tail] = node
+                lefts[node] = tail
+            last_sons[father] = node
+        return arena
+
+    # rebuild the SyntaxTreeNode objects under node, in pre-order so that
+    # every node is appended after its left brother
+    def unpack(self, node=0):
+        values, _types, extra_infos = self.values, self.types, self.extra_infos
+        first_sons, rights = self.first_sons, self.rights
+        root = SyntaxTreeNode(values[node], _types[node], extra_infos[node])
+        stack = [(first_sons[node], root)]
+        while stack:
+            node, father = stack.pop()
+            while node >= 0:
+                tree_node = SyntaxTreeNode(
+                    values[node], _types[node], extra_infos[node])
+                tree_node.father = father
+                if father.last_son is None:
+                    father.first_son = tree_node
+                else:
+                    father.last_son.right = tree_node
+                    tree_node.left = father.last_son
+                father.last_son = tree_node
+                if first_sons[node] >= 0:
+                    stack.append((rights[node], father))
+                    node, father = first_sons[node], tree_node
+                else:
+                    node = rights[node]
+        return root
+
+
+class AstCache(object):
+    '''
+    syntax trees of the parsed sources, one file per tree named by the hash
+    of the source, VERSION, compiler.py and grammar.txt, the least recently
+    used ones are removed when the directory grows over max_size bytes
+    '''
+
+    def __init__(self, directory, max_size=AST_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, source):
+        digest = self._digest()
+        digest.update(source)
+        return digest.hexdigest()
+
+    def file_key(self, path):
+        digest = self._digest()
+        self._update(digest, path)
+        return digest.hexdigest()
+
+    # the trees parsed by another version of the parser are not read, the
+    # code and the grammar of this one are hashed
+    def _digest(self):
+        digest = hashlib.sha1(VERSION.encode('ascii') + b'\0')
+        code = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        for path in [code, os.path.join(os.path.dirname(code), 'grammar.txt')]:
+            self._update(digest, path)
+        return digest
+
+    def _update(self, digest, path):
+        source_file = open(path, 'rb')
+        try:
+            block = source_file.read(1 << 16)
+            while block:
+                digest.update(block)
+                block = source_file.read(1 << 16)
+        finally:
+            source_file.close()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.ast')
+
+    # the SyntaxTree of key, or None on a miss
+    def load(self, key):
+        path = self._path(key)
+        try:
+            tree_file = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            data = tree_file.read()
+        finally:
+            tree_file.close()
+        try:
+            arena = SyntaxTreeArena.loads(data)
+        except (ValueError, IndexError, struct.error):
+            return None
+        # the modification time orders the entries for the eviction
+        os.utime(path, None)
+        tree = SyntaxTree()
+        tree.current = tree.root = arena.unpack(0)
+        return tree
+
+    def store(self, key, tree):
+        arena = SyntaxTreeArena()
+        arena.pack(tree.root)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._path(key)
+        tmp_path = path + '.' + str(os.getpid())
+        tree_file = open(tmp_path, 'wb')
+        try:
+            tree_file.write(arena.dumps())
+        finally:
+            tree_file.close()
+        # the readers see the old entry or the new one, rename replaces the
+        # file at once on posix when there is no os.replace
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.ast'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class Grammar(object):
+    '''
+    context free grammar read from grammar.txt, the terminals are token kinds
+    and the nonterminals are names, table is the LL(1) parse table keyed by
+    (nonterminal, kind)
+    '''
+
+    def __init__(self, productions, start):
+        # nonterminal -> alternatives, an alternative is a tuple of symbols
+        self.productions = productions
+        self.start = start
+        for alternatives in productions.values():
+            for alternative in alternatives:
+                for symbol in alternative:
+                    if not isinstance(symbol, int) and symbol not in productions:
+                        print ('grammar error: no production of ' + symbol)
+                        exit()
+        self.first = self._first_sets()
+        self.follow = self._follow_sets()
+        self.table = self._table()
+
+    @classmethod
+    def load(cls, path):
+        grammar_file = open(path, 'rb')
+        text = grammar_file.read().decode('utf-8')
+        grammar_file.close()
+        productions = {}
+        start = None
+        for line in text.splitlines():
+            # comments
+            line = line.split('//')[0]
+            if line.startswith("'") or '-->' not in line:
+                continue
+            name, body = line.split('-->')
+            name = str(name.strip())
+            start = start or name
+            alternatives = productions.setdefault(name, [])
+            for alternative in body.split('|'):
+                alternatives.append(tuple(
+                    cls._symbol(symbol) for symbol in alternative.split()
+                    if symbol != GRAMMAR_EMPTY))
+        return cls(productions, start)
+
+    @staticmethod
+    def _symbol(symbol):
+        if symbol in GRAMMAR_TERMINALS:
+            return GRAMMAR_TERMINALS[symbol]
+        if symbol[0].isupper():
+            return str(symbol)
+        kind = LEXEME_KINDS.get(symbol.encode('utf-8'))
+        if kind is None:
+            print ('grammar error: unknown symbol ' + symbol)
+            exit()
+        return kind
+
+    # FIRST of a sequence of symbols, None stands for the empty string
+    def first_of(self, symbols, first=None):
+        first = first or self.first
+        result = set()
+        for symbol in symbols:
+            if isinstance(symbol, int):
+                result.add(symbol)
+                return result
+            result |= first[symbol]
+            if None not in result:
+                return result
+            result.discard(None)
+        result.add(None)
+        return result
+
+    def _first_sets(self):
+        first = dict((name, set()) for name in self.productions)
+        changed = True
+        while changed:
+            changed = False
+            for name, alternatives in self.productions.items():
+                for alternative in alternatives:
+                    symbols = self.first_of(alternative, first)
+                    if not symbols <= first[name]:
+                        first[name] |= symbols
+                        changed = True
+        return first
+
+    def _follow_sets(self):
+        follow = dict((name, set()) for name in self.productions)
+        follow[self.start].add(GRAMMAR_END)
+        changed = True
+        while changed:
+            changed = False
+            for name, alternatives in self.productions.items():
+                for alternative in alternatives:
+                    for index, symbol in enumerate(alternative):
+                        if isinstance(symbol, int):
+                            continue
+                        symbols = self.first_of(alternative[index + 1:])
+                        if None in symbols:
+                            symbols.discard(None)
+                            symbols |= follow[name]
+                        if not symbols <= follow[symbol]:
+                            follow[symbol] |= symbols
+                            changed = True
+        return follow
+
+    def _table(self):
+        table = {}
+        for name, alternatives in self.productions.items():
+            for alternative in alternatives:
+                kinds = self.first_of(alternative)
+                if None in kinds:
+                    kinds.discard(None)
+                    kinds |= self.follow[name]
+                for kind in kinds:
+                    if table.setdefault((name, kind), alternative) is not alternative:
+                        print ('grammar error: %s is not LL(1) at %s' % (
+                            name, self.symbol_name(kind)))
+                        exit()
+        return table
+
+    @staticmethod
+    def symbol_name(symbol):
+        if not isinstance(symbol, int):
+            return symbol
+        if symbol == GRAMMAR_END:
+            return '$'
+        for name, kind in GRAMMAR_TERMINALS.items():
+            if kind == symbol:
+                return str(name)
+        return TOKEN_VALUES[symbol]
+
+    # the pattern predicted from the stack of symbols when the next token is
+    # kind, or the stack left after the token is matched
+    def _predict(self, stack, kind, patterns):
+        while stack:
+            top = stack[-1]
+            if top in patterns:
+                kinds = self.first[top]
+                if kind in kinds or None in kinds and kind in self.follow[top]:
+                    return top
+                return None
+            stack = stack[:-1]
+            if isinstance(top, int):
+                return stack if top == kind else None
+            alternative = self.table.get((top, kind))
+            if alternative is None:
+                return None
+            stack += alternative[::-1]
+        return None
+
+    # nested dicts keyed by the kinds of the tokens of a sentence of start,
+    # one after another, down to the one of patterns the sentence is
+    def dispatch(self, start, patterns):
+        root = {}
+        pending = [(root, (start,), 1)]
+        while pending:
+            node, stack, depth = pending.pop()
+            if depth > GRAMMAR_LOOKAHEAD:
+                print ('grammar error: the sentences of %s are not told apart by %d tokens' % (
+                    start, GRAMMAR_LOOKAHEAD))
+                exit()
+            for kind in range(len(TOKEN_TYPES)):
+                result = self._predict(stack, kind, patterns)
+                if isinstance(result, tuple):
+                    node[kind] = {}
+                    pending.append((node[kind], result, depth + 1))
+                elif result is not None:
+                    node[kind] = result
+        return root
+
+
+GRAMMAR = Grammar.load(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'grammar.txt'))
+
+# the sentences of each nonterminal the parser tells apart, by the nonterminal
+# of the handler of the sentence
+SENTENCE_DISPATCH = dict(
+    (start, GRAMMAR.dispatch(start, patterns)) for start, patterns in [
+        ('Sentence', ('Include', 'Statement', 'FunctionStatement', 'FunctionCall')),
+        ('BlockSentence', ('Statement', 'Assignment', 'FunctionCall', 'Control', 'Return')),
+        ('Control', ('IfElseControl', 'WhileControl', 'ForControl'))])
+
+
+class Parser(object):
+
+    def __init__(self, tokens=None):
+        if tokens is None:
+            if stream_mode:
+                tokens = TokenStream(Lexer().stream(source_name))
+            else:
+                lexer = Lexer()
+                lexer.main()
+                tokens = lexer.tokens
         # tokens
-        self.tokens = lexer.tokens
+        self.tokens = tokens
+        self.kind = tokens.kind
+        self.value = tokens.value
+        self.match = tokens.match
         # tokens
         self.index = 0
         self.tree = SyntaxTree()
+        # the blocks being parsed, with what is parsed after each of them
+        self.blocks = []
+        # handlers of the sentence patterns of SENTENCE_DISPATCH
+        self.main_handlers = {
+            'Include': self._include, 'Statement': self._statement,
+            'FunctionStatement': self._function_statement,
+            'FunctionCall': self._function_call}
+        self.block_handlers = {
+            'Statement': self._statement, 'Assignment': self._assignment,
+            'FunctionCall': self._function_call, 'Control': self._control,
+            'Return': self._return}
+        self.control_handlers = {
+            'IfElseControl': self._if_else, 'WhileControl': self._while,
+            'ForControl': self._for}
 
-    def _block(self, father_tree):
+    # the block at index, then is called after its '}'. a block in a block
+    # is pushed on self.blocks and parsed by the loop of the outer one, so
+    # the nesting of the blocks does not nest the calls
+    def _block(self, father_tree, then=None):
         self.index += 1
         sentence_tree = SyntaxTree()
         sentence_tree.current = sentence_tree.root = SyntaxTreeNode('Sentence')
         father_tree.add_child_node(sentence_tree.root, father_tree.root)
-        while True:
-            sentence_pattern = self._judge_sentence_pattern()
-            if sentence_pattern == 'STATEMENT':
-                self._statement(sentence_tree.root)
-            elif sentence_pattern == 'ASSIGNMENT':
-                self._assignment(sentence_tree.root)
-            elif sentence_pattern == 'FUNCTION_CALL':
-                self._function_call(sentence_tree.root)
-            elif sentence_pattern == 'CONTROL':
-                self._control(sentence_tree.root)
-            # return
-            elif sentence_pattern == 'RETURN':
-                self._return(sentence_tree.root)
-            elif sentence_pattern == 'RB_BRACKET':
-                break
-            else:
-                print ('block error!')
-                exit()
+        blocks = self.blocks
+        blocks.append((sentence_tree.root, then))
+        if len(blocks) > 1:
+            return
+        # the brackets are balanced, so the first '}' in front of a sentence
+        # closes the block, and a stream does not need to read ahead to it
+        while blocks:
+            father, then = blocks[-1]
+            if self.kind(self.index) != T_RB_BRACKET:
+                self._block_sentence(father)
+                continue
+            self.index += 1
+            blocks.pop()
+            if then:
+                then()
+
+    # one sentence in a block
+    def _block_sentence(self, father):
+        handler = self.block_handlers.get(
+            self._judge_sentence_pattern('BlockSentence'))
+        if not handler:
+            print ('block error!')
+            exit()
+        handler(father)
 
     # include
     def _include(self, father=None):
@@ -308,12 +1367,12 @@ class Parser(object):
         cnt = 0
         flag = True
         while flag:
-            if self.tokens[self.index] == '\"':
+            if self.kind(self.index) == T_DOUBLE_QUOTE:
                 cnt += 1
-            if self.index >= len(self.tokens) or cnt >= 2 or self.tokens[self.index].value == '>':
+            if self._is_end(self.index + 1) or cnt >= 2 or self.kind(self.index) == T_GT:
                 flag = False
             include_tree.add_child_node(
-                SyntaxTreeNode(self.tokens[self.index].value), include_tree.root)
+                SyntaxTreeNode(self.value(self.index)), include_tree.root)
             self.index += 1
 
     def _function_statement(self, father=None):
@@ -324,44 +1383,44 @@ class Parser(object):
             'FunctionStatement')
         self.tree.add_child_node(func_statement_tree.root, father)
         flag = True
-        while flag and self.index < len(self.tokens):
-            if self.tokens[self.index].value in keywords[0]:
+        while flag and not self._is_end(self.index):
+            if self.kind(self.index) in TYPE_KINDS:
                 return_type = SyntaxTreeNode('Type')
                 func_statement_tree.add_child_node(return_type)
                 func_statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}))
+                    SyntaxTreeNode(self.value(self.index), 'FIELD_TYPE', {'type': self.value(self.index)}))
                 self.index += 1
-            elif self.tokens[self.index].type == 'IDENTIFIER':
+            elif self.kind(self.index) == T_IDENTIFIER:
                 func_name = SyntaxTreeNode('FunctionName')
                 func_statement_tree.add_child_node(
                     func_name, func_statement_tree.root)
                 # extra_info
                 func_statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER', {'type': 'FUNCTION_NAME'}))
+                    SyntaxTreeNode(self.value(self.index), 'IDENTIFIER', {'type': 'FUNCTION_NAME'}))
                 self.index += 1
-            elif self.tokens[self.index].type == 'LL_BRACKET':
+            elif self.kind(self.index) == T_LL_BRACKET:
                 params_list = SyntaxTreeNode('StateParameterList')
                 func_statement_tree.add_child_node(
                     params_list, func_statement_tree.root)
                 self.index += 1
-                while self.tokens[self.index].type != 'RL_BRACKET':
-                    if self.tokens[self.index].value in keywords[0]:
+                while self.kind(self.index) != T_RL_BRACKET:
+                    if self.kind(self.index) in TYPE_KINDS:
                         param = SyntaxTreeNode('Parameter')
                         func_statement_tree.add_child_node(param, params_list)
                         # extra_info
                         func_statement_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}), param)
-                        if self.tokens[self.index + 1].type == 'IDENTIFIER':
+                            SyntaxTreeNode(self.value(self.index), 'FIELD_TYPE', {'type': self.value(self.index)}), param)
+                        if self.kind(self.index + 1) == T_IDENTIFIER:
                             # extra_info
-                            func_statement_tree.add_child_node(SyntaxTreeNode(self.tokens[self.index + 1].value, 'IDENTIFIER', {
-                                                               'type': 'VARIABLE', 'variable_type': self.tokens[self.index].value}), param)
+                            func_statement_tree.add_child_node(SyntaxTreeNode(self.value(self.index + 1), 'IDENTIFIER', {
+                                                               'type': 'VARIABLE', 'variable_type': self.value(self.index)}), param)
                         else:
                             print ('??')
                             exit()
                         self.index += 1
                     self.index += 1
                 self.index += 1
-            elif self.tokens[self.index].type == 'LB_BRACKET':
+            elif self.kind(self.index) == T_LB_BRACKET:
                 self._block(func_statement_tree)
 
     def _statement(self, father=None):
@@ -372,36 +1431,36 @@ class Parser(object):
             'Statement')
         self.tree.add_child_node(statement_tree.root, father)
         tmp_variable_type = None
-        while self.tokens[self.index].type != 'SEMICOLON':
-            if self.tokens[self.index].value in keywords[0]:
-                tmp_variable_type = self.tokens[self.index].value
+        while self.kind(self.index) != T_SEMICOLON:
+            if self.kind(self.index) in TYPE_KINDS:
+                tmp_variable_type = self.value(self.index)
                 variable_type = SyntaxTreeNode('Type')
                 statement_tree.add_child_node(variable_type)
                 # extra_info
                 statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'FIELD_TYPE', {'type': self.tokens[self.index].value}))
-            elif self.tokens[self.index].type == 'IDENTIFIER':
+                    SyntaxTreeNode(self.value(self.index), 'FIELD_TYPE', {'type': self.value(self.index)}))
+            elif self.kind(self.index) == T_IDENTIFIER:
                 # extra_info
-                statement_tree.add_child_node(SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER', {
+                statement_tree.add_child_node(SyntaxTreeNode(self.value(self.index), 'IDENTIFIER', {
                                               'type': 'VARIABLE', 'variable_type': tmp_variable_type}), statement_tree.root)
-            elif self.tokens[self.index].type == 'DIGIT_CONSTANT':
+            elif self.kind(self.index) == T_DIGIT_CONSTANT:
                 statement_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'DIGIT_CONSTANT'), statement_tree.root)
+                    SyntaxTreeNode(self.value(self.index), 'DIGIT_CONSTANT'), statement_tree.root)
                 statement_tree.current.left.set_extra_info(
                     {'type': 'LIST', 'list_type': tmp_variable_type})
-            elif self.tokens[self.index].type == 'LB_BRACKET':
+            elif self.kind(self.index) == T_LB_BRACKET:
                 self.index += 1
                 constant_list = SyntaxTreeNode('ConstantList')
                 statement_tree.add_child_node(
                     constant_list, statement_tree.root)
-                while self.tokens[self.index].type != 'RB_BRACKET':
-                    if self.tokens[self.index].type == 'DIGIT_CONSTANT':
+                while self.kind(self.index) != T_RB_BRACKET:
+                    if self.kind(self.index) == T_DIGIT_CONSTANT:
                         statement_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, 'DIGIT_CONSTANT'), constant_list)
+                            SyntaxTreeNode(self.value(self.index), 'DIGIT_CONSTANT'), constant_list)
                     self.index += 1
-            elif self.tokens[self.index].type == 'COMMA':
-                while self.tokens[self.index].type != 'SEMICOLON':
-                    if self.tokens[self.index].type == 'IDENTIFIER':
+            elif self.kind(self.index) == T_COMMA:
+                while self.kind(self.index) != T_SEMICOLON:
+                    if self.kind(self.index) == T_IDENTIFIER:
                         tree = SyntaxTree()
                         tree.current = tree.root = SyntaxTreeNode('Statement')
                         self.tree.add_child_node(tree.root, father)
@@ -410,7 +1469,7 @@ class Parser(object):
                         # extra_info
                         tree.add_child_node(
                             SyntaxTreeNode(tmp_variable_type, 'FIELD_TYPE', {'type': tmp_variable_type}))
-                        tree.add_child_node(SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER', {
+                        tree.add_child_node(SyntaxTreeNode(self.value(self.index), 'IDENTIFIER', {
                                             'type': 'VARIABLE', 'variable_type': tmp_variable_type}), tree.root)
                     self.index += 1
                 break
@@ -423,12 +1482,12 @@ class Parser(object):
         assign_tree = SyntaxTree()
         assign_tree.current = assign_tree.root = SyntaxTreeNode('Assignment')
         self.tree.add_child_node(assign_tree.root, father)
-        while self.tokens[self.index].type != 'SEMICOLON':
-            if self.tokens[self.index].type == 'IDENTIFIER':
+        while self.kind(self.index) != T_SEMICOLON:
+            if self.kind(self.index) == T_IDENTIFIER:
                 assign_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'IDENTIFIER'))
+                    SyntaxTreeNode(self.value(self.index), 'IDENTIFIER'))
                 self.index += 1
-            elif self.tokens[self.index].type == 'ASSIGN':
+            elif self.kind(self.index) == T_ASSIGN:
                 self.index += 1
                 self._expression(assign_tree.root)
         self.index += 1
@@ -441,14 +1500,17 @@ class Parser(object):
         self.tree.add_child_node(while_tree.root, father)
 
         self.index += 1
-        if self.tokens[self.index].type == 'LL_BRACKET':
-            tmp_index = self.index
-            while self.tokens[tmp_index].type != 'RL_BRACKET':
-                tmp_index += 1
+        if self.kind(self.index) == T_LL_BRACKET:
+            tmp_index = self.match(self.index)
+            self.index += 1
             self._expression(while_tree.root, tmp_index)
+            self.index += 1
 
-            if self.tokens[self.index].type == 'LB_BRACKET':
+            if self.kind(self.index) == T_LB_BRACKET:
                 self._block(while_tree)
+        else:
+            print ('error: lack of left bracket!')
+            exit()
 
     # for
     def _for(self, father=None):
@@ -457,20 +1519,18 @@ class Parser(object):
             'Control', 'ForControl')
         self.tree.add_child_node(for_tree.root, father)
         while True:
-            token_type = self.tokens[self.index].type
-            if token_type == 'FOR':
+            kind = self.kind(self.index)
+            if kind == T_FOR:
                 self.index += 1
-            elif token_type == 'LL_BRACKET':
+            elif kind == T_LL_BRACKET:
+                tmp_index = self.match(self.index)
                 self.index += 1
-                tmp_index = self.index
-                while self.tokens[tmp_index].type != 'RL_BRACKET':
-                    tmp_index += 1
                 self._assignment(for_tree.root)
                 self._expression(for_tree.root)
                 self.index += 1
                 self._expression(for_tree.root, tmp_index)
                 self.index += 1
-            elif token_type == 'LB_BRACKET':
+            elif kind == T_LB_BRACKET:
                 self._block(for_tree)
                 break
         current_node = for_tree.root.first_son.right.right
@@ -487,139 +1547,140 @@ class Parser(object):
         if_tree.current = if_tree.root = SyntaxTreeNode('IfControl')
         if_else_tree.add_child_node(if_tree.root)
 
-        if self.tokens[self.index].type == 'IF':
+        if self.kind(self.index) == T_IF:
             self.index += 1
-            if self.tokens[self.index].type == 'LL_BRACKET':
+            if self.kind(self.index) == T_LL_BRACKET:
+                tmp_index = self.match(self.index)
                 self.index += 1
-                tmp_index = self.index
-                while self.tokens[tmp_index].type != 'RL_BRACKET':
-                    tmp_index += 1
                 self._expression(if_tree.root, tmp_index)
                 self.index += 1
             else:
                 print ('error: lack of left bracket!')
                 exit()
 
-            if self.tokens[self.index].type == 'LB_BRACKET':
-                self._block(if_tree)
+            if self.kind(self.index) == T_LB_BRACKET:
+                self._block(if_tree, lambda: self._else(if_else_tree))
+                return
+        self._else(if_else_tree)
 
-        if self.tokens[self.index].type == 'ELSE':
+    # the else after the block of the if, if there is one
+    def _else(self, if_else_tree):
+        # a block being parsed again may end after the if
+        if not self._is_end(self.index) and self.kind(self.index) == T_ELSE:
             self.index += 1
             else_tree = SyntaxTree()
             else_tree.current = else_tree.root = SyntaxTreeNode('ElseControl')
             if_else_tree.add_child_node(else_tree.root, if_else_tree.root)
 
-            if self.tokens[self.index].type == 'LB_BRACKET':
+            if self.kind(self.index) == T_LB_BRACKET:
                 self._block(else_tree)
 
     def _control(self, father=None):
-        token_type = self.tokens[self.index].type
-        if token_type == 'WHILE' or token_type == 'DO':
-            self._while(father)
-        elif token_type == 'IF':
-            self._if_else(father)
-        elif token_type == 'FOR':
-            self._for(father)
-        else:
+        handler = self.control_handlers.get(
+            self._judge_sentence_pattern('Control'))
+        if not handler:
             print ('error: control style not supported!')
             exit()
+        handler(father)
 
+    # expression ends at the semicolon, or at index if given
     def _expression(self, father=None, index=None):
         if not father:
             father = self.tree.root
-        operator_priority = {'>': 0, '<': 0, '>=': 0, '<=': 0,
-                             '+': 1, '-': 1, '*': 2, '/': 2, '++': 3, '--': 3, '!': 3}
-        operator_stack = []
-        reverse_polish_expression = []
-        while self.tokens[self.index].type != 'SEMICOLON':
-            if index and self.index >= index:
-                break
-            if self.tokens[self.index].type == 'DIGIT_CONSTANT':
-                tree = SyntaxTree()
-                tree.current = tree.root = SyntaxTreeNode(
-                    'Expression', 'Constant')
-                tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, '_Constant'))
-                reverse_polish_expression.append(tree)
-            elif self.tokens[self.index].type == 'IDENTIFIER':
-                if self.tokens[self.index + 1].value in operators or self.tokens[self.index + 1].type == 'SEMICOLON':
-                    tree = SyntaxTree()
-                    tree.current = tree.root = SyntaxTreeNode(
-                        'Expression', 'Variable')
-                    tree.add_child_node(
-                        SyntaxTreeNode(self.tokens[self.index].value, '_Variable'))
-                    reverse_polish_expression.append(tree)
-                # ID[i]
-                elif self.tokens[self.index + 1].type == 'LM_BRACKET':
-                    tree = SyntaxTree()
-                    tree.current = tree.root = SyntaxTreeNode(
-                        'Expression', 'ArrayItem')
-                    tree.add_child_node(
-                        SyntaxTreeNode(self.tokens[self.index].value, '_ArrayName'))
-                    self.index += 2
-                    if self.tokens[self.index].type != 'DIGIT_CONSTANT' and self.tokens[self.index].type != 'IDENTIFIER':
-                        print ('error')
-                        print (self.tokens[self.index].type)
-                        exit()
-                    else:
-                        tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, '_ArrayIndex'), tree.root)
-                        reverse_polish_expression.append(tree)
-            elif self.tokens[self.index].value in operators or self.tokens[self.index].type == 'LL_BRACKET' or self.tokens[self.index].type == 'RL_BRACKET':
-                tree = SyntaxTree()
-                tree.current = tree.root = SyntaxTreeNode(
-                    'Operator', 'Operator')
-                tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, '_Operator'))
-                if self.tokens[self.index].type == 'LL_BRACKET':
-                    operator_stack.append(tree.root)
-                elif self.tokens[self.index].type == 'RL_BRACKET':
-                    while operator_stack and operator_stack[-1].current.type != 'LL_BRACKET':
-                        reverse_polish_expression.append(operator_stack.pop())
-                    if operator_stack:
-                        operator_stack.pop()
+        node = self._expression_node(0)
+        if self.index != index if index else self.kind(self.index) != T_SEMICOLON:
+            print ('expression error!')
+            exit()
+        self.tree.add_child_node(node, father)
+
+    # precedence climbing, operators of lower priority end the expression.
+    # the operands still waiting for their right side are kept on a stack
+    # with the priority to go back to, a '(' or a ++i does the same, so the
+    # nesting of the expression does not nest the calls
+    def _expression_node(self, priority):
+        stack = []
+        while True:
+            kind = self.kind(self.index)
+            if kind == T_LL_BRACKET:
+                self.index += 1
+                stack.append((priority, None, None))
+                priority = 0
+                continue
+            # ++i, --i
+            if kind == T_SELF_PLUS or kind == T_SELF_MINUS:
+                stack.append((priority, None, self._operator_node()))
+                priority = UNARY_PRIORITY
+                continue
+            left = self._operand()
+            while True:
+                kind = self.kind(self.index)
+                # i++, i--
+                if kind == T_SELF_PLUS or kind == T_SELF_MINUS:
+                    left = self._operand_node(
+                        'SingleOperand', self._operator_node(), left)
+                    continue
+                operator_priority = BINARY_PRIORITY.get(kind)
+                if operator_priority is not None and operator_priority >= priority:
+                    stack.append((priority, left, self._operator_node()))
+                    priority = operator_priority + 1
+                    break
+                if not stack:
+                    return left
+                priority, operand, operator = stack.pop()
+                if operand:
+                    left = self._operand_node('DoubleOperand', operand, operator, left)
+                elif operator:
+                    left = self._operand_node('SingleOperand', operator, left)
                 else:
-                    while operator_stack and operator_priority[tree.current.value] < operator_priority[operator_stack[-1].current.value]:
-                        reverse_polish_expression.append(operator_stack.pop())
-                    operator_stack.append(tree)
+                    if kind != T_RL_BRACKET:
+                        print ('error: lack of right bracket!')
+                        exit()
+                    self.index += 1
+
+    # a constant, a variable or an item of an array
+    def _operand(self):
+        kind = self.kind(self.index)
+        if kind == T_DIGIT_CONSTANT:
+            node = self._operand_node('Constant', SyntaxTreeNode(
+                self.value(self.index), '_Constant'))
             self.index += 1
-        # reverse_polish_expression
-        while operator_stack:
-            reverse_polish_expression.append(operator_stack.pop())
-
-        # for item in reverse_polish_expression:
-        #   print item.current.value,
-        # print
-
-        operand_stack = []
-        child_operators = [['!', '++', '--'], [
-            '+', '-', '*', '/', '>', '<', '>=', '<=']]
-        for item in reverse_polish_expression:
-            if item.root.type != 'Operator':
-                operand_stack.append(item)
-            else:
-                if item.current.value in child_operators[0]:
-                    a = operand_stack.pop()
-                    new_tree = SyntaxTree()
-                    new_tree.current = new_tree.root = SyntaxTreeNode(
-                        'Expression', 'SingleOperand')
-                    new_tree.add_child_node(item.root)
-                    new_tree.add_child_node(a.root, new_tree.root)
-                    operand_stack.append(new_tree)
-                elif item.current.value in child_operators[1]:
-                    b = operand_stack.pop()
-                    a = operand_stack.pop()
-                    new_tree = SyntaxTree()
-                    new_tree.current = new_tree.root = SyntaxTreeNode(
-                        'Expression', 'DoubleOperand')
-                    new_tree.add_child_node(a.root)
-                    new_tree.add_child_node(item.root, new_tree.root)
-                    new_tree.add_child_node(b.root, new_tree.root)
-                    operand_stack.append(new_tree)
-                else:
-                    print ('operator ', item.current.value, ' not supported!')
+        elif kind == T_IDENTIFIER:
+            # ID[i]
+            if self.kind(self.index + 1) == T_LM_BRACKET:
+                index_kind = self.kind(self.index + 2)
+                if index_kind != T_DIGIT_CONSTANT and index_kind != T_IDENTIFIER:
+                    print ('error')
+                    print (TOKEN_TYPES[index_kind])
+                    exit()
+                if self.kind(self.index + 3) != T_RM_BRACKET:
+                    print ('error: lack of right bracket!')
                     exit()
-        self.tree.add_child_node(operand_stack[0].root, father)
+                node = self._operand_node('ArrayItem', SyntaxTreeNode(
+                    self.value(self.index), '_ArrayName'), SyntaxTreeNode(
+                    self.value(self.index + 2), '_ArrayIndex'))
+                self.index += 4
+            else:
+                node = self._operand_node('Variable', SyntaxTreeNode(
+                    self.value(self.index), '_Variable'))
+                self.index += 1
+        else:
+            print ('operand expected, but got ' + TOKEN_TYPES[kind])
+            exit()
+        return node
+
+    # operator at index
+    def _operator_node(self):
+        node = SyntaxTreeNode('Operator', 'Operator')
+        self.tree.add_child_node(
+            SyntaxTreeNode(self.value(self.index), '_Operator'), node)
+        self.index += 1
+        return node
+
+    def _operand_node(self, _type, *sons):
+        node = SyntaxTreeNode('Expression', _type)
+        for son in sons:
+            self.tree.add_child_node(son, node)
+        return node
 
     def _function_call(self, father=None):
         if not father:
@@ -629,26 +1690,26 @@ class Parser(object):
             'FunctionCall')
         self.tree.add_child_node(func_call_tree.root, father)
 
-        while self.tokens[self.index].type != 'SEMICOLON':
-            if self.tokens[self.index].type == 'IDENTIFIER':
+        while self.kind(self.index) != T_SEMICOLON:
+            if self.kind(self.index) == T_IDENTIFIER:
                 func_call_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value, 'FUNCTION_NAME'))
-            elif self.tokens[self.index].type == 'LL_BRACKET':
+                    SyntaxTreeNode(self.value(self.index), 'FUNCTION_NAME'))
+            elif self.kind(self.index) == T_LL_BRACKET:
                 self.index += 1
                 params_list = SyntaxTreeNode('CallParameterList')
                 func_call_tree.add_child_node(params_list, func_call_tree.root)
-                while self.tokens[self.index].type != 'RL_BRACKET':
-                    if self.tokens[self.index].type == 'IDENTIFIER' or self.tokens[self.index].type == 'DIGIT_CONSTANT' or self.tokens[self.index].type == 'STRING_CONSTANT':
+                while self.kind(self.index) != T_RL_BRACKET:
+                    if self.kind(self.index) == T_IDENTIFIER or self.kind(self.index) == T_DIGIT_CONSTANT or self.kind(self.index) == T_STRING_CONSTANT:
                         func_call_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, self.tokens[self.index].type), params_list)
-                    elif self.tokens[self.index].type == 'DOUBLE_QUOTE':
+                            SyntaxTreeNode(self.value(self.index), TOKEN_TYPES[self.kind(self.index)]), params_list)
+                    elif self.kind(self.index) == T_DOUBLE_QUOTE:
                         self.index += 1
                         func_call_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, self.tokens[self.index].type), params_list)
+                            SyntaxTreeNode(self.value(self.index), TOKEN_TYPES[self.kind(self.index)]), params_list)
                         self.index += 1
-                    elif self.tokens[self.index].type == 'ADDRESS':
+                    elif self.kind(self.index) == T_ADDRESS:
                         func_call_tree.add_child_node(
-                            SyntaxTreeNode(self.tokens[self.index].value, 'ADDRESS'), params_list)
+                            SyntaxTreeNode(self.value(self.index), 'ADDRESS'), params_list)
                     self.index += 1
             else:
                 print ('function call error!')
@@ -663,188 +1724,1253 @@ class Parser(object):
         return_tree = SyntaxTree()
         return_tree.current = return_tree.root = SyntaxTreeNode('Return')
         self.tree.add_child_node(return_tree.root, father)
-        while self.tokens[self.index].type != 'SEMICOLON':
-            if self.tokens[self.index].type == 'RETURN':
+        while self.kind(self.index) != T_SEMICOLON:
+            if self.kind(self.index) == T_RETURN:
                 return_tree.add_child_node(
-                    SyntaxTreeNode(self.tokens[self.index].value))
+                    SyntaxTreeNode(self.value(self.index)))
                 self.index += 1
             else:
                 self._expression(return_tree.root)
         self.index += 1
 
-    def _judge_sentence_pattern(self):
-        token_value = self.tokens[self.index].value
-        token_type = self.tokens[self.index].type
-        # include
-        if token_type == 'SHARP' and self.tokens[self.index + 1].type == 'INCLUDE':
-            return 'INCLUDE'
-        elif token_value in keywords[1]:
-            return 'CONTROL'
-        elif token_value in keywords[0] and self.tokens[self.index + 1].type == 'IDENTIFIER':
-            index_2_token_type = self.tokens[self.index + 2].type
-            if index_2_token_type == 'LL_BRACKET':
-                return 'FUNCTION_STATEMENT'
-            elif index_2_token_type == 'SEMICOLON' or index_2_token_type == 'LM_BRACKET' or index_2_token_type == 'COMMA':
-                return 'STATEMENT'
-            else:
-                return 'ERROR'
-        elif token_type == 'IDENTIFIER':
-            index_1_token_type = self.tokens[self.index + 1].type
-            if index_1_token_type == 'LL_BRACKET':
-                return 'FUNCTION_CALL'
-            elif index_1_token_type == 'ASSIGN':
-                return 'ASSIGNMENT'
-            else:
-                return 'ERROR'
-        # return
-        elif token_type == 'RETURN':
-            return 'RETURN'
-        elif token_type == 'RB_BRACKET':
-            self.index += 1
-            return 'RB_BRACKET'
-        else:
-            return 'ERROR'
+    def _is_end(self, index):
+        try:
+            self.kind(index)
+        except IndexError:
+            return True
+        return False
+
+    # the pattern of the sentence of start at index, the kinds of its tokens
+    # are looked up one after another in SENTENCE_DISPATCH
+    def _judge_sentence_pattern(self, start='Sentence'):
+        # the tokens of the finished sentences are not needed any more
+        self.tokens.release(self.index)
+        table = SENTENCE_DISPATCH[start]
+        index = self.index
+        while True:
+            pattern = table.get(self.kind(index))
+            if not isinstance(pattern, dict):
+                return pattern or 'ERROR'
+            table = pattern
+            index += 1
 
     def main(self):
         self.tree.current = self.tree.root = SyntaxTreeNode('Sentence')
-        while self.index < len(self.tokens):
-            sentence_pattern = self._judge_sentence_pattern()
-            # include
-            if sentence_pattern == 'INCLUDE':
-                self._include()
-            elif sentence_pattern == 'FUNCTION_STATEMENT':
-                self._function_statement()
+        while not self._is_end(self.index):
+            # nothing after the function is parsed
+            if self._main_sentence() == 'FunctionStatement':
                 break
-            elif sentence_pattern == 'STATEMENT':
-                self._statement()
-            elif sentence_pattern == 'FUNCTION_CALL':
-                self._function_call()
-            else:
-                print ('main error!')
-                exit()
+
+    # one sentence out of the functions, returns its pattern
+    def _main_sentence(self):
+        sentence_pattern = self._judge_sentence_pattern()
+        handler = self.main_handlers.get(sentence_pattern)
+        if not handler:
+            print ('main error!')
+            exit()
+        handler()
+        return sentence_pattern
 
     # DFS
     def display(self, node):
         if not node:
             return
-        print ('( self: ', node.value, ',', node.type, ', father: ', node.father.value,
-                ', left: ', node.left.value if node.left else None, ', right: ', node.right.value if node.right else None, ' )')
-        child = node.first_son
-        while child:
-            self.display(child)
-            child = child.right
+        for node in node.preorder():
+            print ('( self: ', node.value, ',', node.type, ', father: ', node.father.value if node.father else None,
+                    ', left: ', node.left.value if node.left else None, ', right: ', node.right.value if node.right else None, ' )')
 
 
-class AssemblerFileHandler(object):
+class SentenceUnit(object):
+    '''
+    a top-level sentence, or a sentence of a function body: its span in the
+    source and the first and last nodes made from it, a function also keeps
+    the units of its body
+    '''
 
-    def __init__(self):
-        self.result = ['.data', '.bss', '.lcomm bss_tmp, 4', '.text']
-        self.data_pointer = 1
-        self.bss_pointer = 3
-        self.text_pointer = 4
+    __slots__ = ('start', 'end', 'first_node', 'last_node',
+                 'body', 'body_father', 'open_end', 'close_start')
 
-    def insert(self, value, _type):
-        if _type == 'DATA':
-            self.result.insert(self.data_pointer, value)
-            self.data_pointer += 1
-            self.bss_pointer += 1
-            self.text_pointer += 1
-        elif _type == 'BSS':
-            self.result.insert(self.bss_pointer, value)
-            self.bss_pointer += 1
-            self.text_pointer += 1
-        elif _type == 'TEXT':
-            self.result.insert(self.text_pointer, value)
-            self.text_pointer += 1
-        else:
-            print ('error!')
-            exit()
+    def __init__(self, start, end, first_node, last_node):
+        self.start = start
+        self.end = end
+        self.first_node = first_node
+        self.last_node = last_node
+        self.body = None
+        self.body_father = None
+        self.open_end = None
+        self.close_start = None
 
-    def generate_ass_file(self):
-        self.file = open(file_name + '.S', 'w+')
-        self.file.write('\n'.join(self.result) + '\n')
-        self.file.close()
+    def shift(self, delta):
+        self.start += delta
+        self.end += delta
+        if self.body is not None:
+            self.open_end += delta
+            self.close_start += delta
+            for unit in self.body:
+                unit.shift(delta)
 
 
-class Assembler(object):
+# length of the common head of a and b, or of the common tail if backward
+def _common_length(a, b, backward=False):
+    limit = min(len(a), len(b))
+    size = 0
+    step = 4096
+    while step:
+        while size + step <= limit and (
+                a[len(a) - size - step:len(a) - size] == b[len(b) - size - step:len(b) - size]
+                if backward else a[size:size + step] == b[size:size + step]):
+            size += step
+        step //= 2
+    return size
+
+
+class IncrementalParser(Parser):
+    '''
+    parser of a source that is edited again and again, only the sentences
+    touched by an edit are lexed and parsed again, the syntax trees of the
+    other sentences are kept
+    '''
 
     def __init__(self):
-        self.parser = Parser()
-        self.parser.main()
-        self.tree = self.parser.tree
-        self.ass_file_handler = AssemblerFileHandler()
-        self.symbol_table = {}
-        self.sentence_type = ['Sentence', 'Include', 'FunctionStatement',
-                              'Statement', 'FunctionCall', 'Assignment', 'Control', 'Expression', 'Return']
-        self.operator_stack = []
-        self.operand_stack = []
-        # label
-        self.label_cnt = 0
-        self.labels_ifelse = {}
+        self.source = None
+        self.syntax_tree = None
+        self.units = []
+        # body of the last function parsed
+        self.body = None
 
-    # include
-    def _include(self, node=None):
-        pass
+    def _use_tokens(self, source, start, end):
+        tokens = TokenArray(source)
+        for kind, token_start, token_end, opener in Lexer().scan_brackets(source, start, end):
+            tokens.append(kind, token_start, token_end, opener)
+        Parser.__init__(self, tokens)
 
-    def _function_statement(self, node=None):
-        current_node = node.first_son
-        while current_node:
-            if current_node.value == 'FunctionName':
-                if current_node.first_son.value != 'main':
-                    print ('other function statement except for main is not supported!')
-                    exit()
-                else:
-                    self.ass_file_handler.insert('.globl main', 'TEXT')
-                    self.ass_file_handler.insert('main:', 'TEXT')
-                    self.ass_file_handler.insert('finit', 'TEXT')
-            elif current_node.value == 'Sentence':
-                self.traverse(current_node.first_son)
-            current_node = current_node.right
+    # the units of the sentences parsed under father, to the end of the
+    # tokens or of the block
+    def _parse_units(self, father, top):
+        self.tree.current = self.tree.root = father
+        units = []
+        tokens = self.tokens
+        while not self._is_end(self.index) and (top or self.kind(self.index) != T_RB_BRACKET):
+            first_token = self.index
+            last_node = father.last_son
+            if top:
+                sentence_pattern = self._main_sentence()
+            else:
+                self._block_sentence(father)
+            unit = SentenceUnit(tokens.starts[first_token], tokens.ends[self.index - 1],
+                                last_node.right if last_node else father.first_son, father.last_son)
+            units.append(unit)
+            if top and sentence_pattern == 'FunctionStatement':
+                unit.body, unit.body_father, unit.open_end, unit.close_start = self.body
+                break
+            self.tree.current = self.tree.root = father
+        return units
 
-    # sizeof
-    def _sizeof(self, _type):
-        size = -1
-        if _type == 'int' or _type == 'float' or _type == 'long':
-            size = 4
-        elif _type == 'char':
-            size = 1
-        elif _type == 'double':
-            size = 8
-        return str(size)
+    def _block(self, father_tree, then=None):
+        if father_tree.root.value != 'FunctionStatement':
+            return Parser._block(self, father_tree, then)
+        open_end = self.tokens.ends[self.index]
+        self.index += 1
+        sentence_tree = SyntaxTree()
+        sentence_tree.current = sentence_tree.root = SyntaxTreeNode('Sentence')
+        father_tree.add_child_node(sentence_tree.root, father_tree.root)
+        tree = self.tree
+        self.tree = sentence_tree
+        units = self._parse_units(sentence_tree.root, False)
+        self.tree = tree
+        self.body = (units, sentence_tree.root, open_end,
+                     self.tokens.starts[self.index])
+        self.index += 1
+
+    # parse source[start:end] again, its sentences take the place of
+    # units[first:last] under father
+    def _reparse(self, source, start, end, units, first, last, father, top):
+        self._use_tokens(source, start, end)
+        new_father = SyntaxTreeNode('Sentence')
+        new_units = self._parse_units(new_father, top)
+        self.tree.replace_sons(
+            father, units[first - 1].last_node if first > 0 else None,
+            units[last].first_node if last < len(units) else None, new_father)
+        units[first:last] = new_units
+        return first + len(new_units)
+
+    # units[first:last] cover source[low:high] when the spans of the units
+    # are stretched over the blanks between them and over begin:end, the
+    # unit before the edit is taken too as an else may be added to it
+    def _affected(self, units, begin, end, low, high):
+        first = 0
+        while first < len(units) - 1 and units[first].end <= low:
+            first += 1
+        first = max(first - 1, 0)
+        last = first + 1
+        while last < len(units) and units[last - 1].end < high:
+            last += 1
+        return (first, last, units[first - 1].end if first > 0 else begin,
+                units[last - 1].end if last < len(units) else end)
+
+    def _cold_parse(self, source):
+        self._use_tokens(source, 0, len(source))
+        self.syntax_tree = SyntaxTree()
+        root = self.syntax_tree.current = self.syntax_tree.root = SyntaxTreeNode(
+            'Sentence')
+        self.units = self._parse_units(root, True)
+
+    def parse(self, source):
+        old_source = self.source
+        if old_source is None or not self.units:
+            self._cold_parse(source)
+        elif old_source != source:
+            head = _common_length(old_source, source)
+            tail = min(_common_length(old_source, source, True),
+                       min(len(old_source), len(source)) - head)
+            low, high = head, len(old_source) - tail
+            delta = len(source) - len(old_source)
+            units = self.units
+            first, last, start, end = self._affected(
+                units, 0, len(old_source), low, high)
+            unit = units[last - 1]
+            if unit.body and unit.open_end <= low and high <= unit.close_start:
+                # the edit is in the body of the function
+                body_first, body_last, start, end = self._affected(
+                    unit.body, unit.open_end, unit.close_start, low, high)
+                body_after = self._reparse(source, start, end + delta, unit.body, body_first,
+                                           body_last, unit.body_father, False)
+                for body_unit in unit.body[body_after:]:
+                    body_unit.shift(delta)
+                unit.end += delta
+                unit.close_start += delta
+                after = last
+                if not unit.body:
+                    # units need a node to be put in place, parse the function again
+                    after = self._reparse(source, unit.start, unit.end, units, last - 1,
+                                          last, self.syntax_tree.root, True)
+            else:
+                after = self._reparse(source, start, end + delta, units, first,
+                                      last, self.syntax_tree.root, True)
+            for unit in units[after:]:
+                unit.shift(delta)
+            if not units:
+                self._cold_parse(source)
+        self.source = source
+        self.tree = self.syntax_tree
+        return self.syntax_tree
+
+
+# 'float' for the constants with a fraction or an exponent
+def _constant_type(value):
+    return 'float' if '.' in value or 'e' in value else 'int'
+
+
+# value rounded to the float of the target, which has 32 bits
+def _float32(value):
+    try:
+        return struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        return math.copysign(float('inf'), value)
+
+
+# the constant text of value as field_type, None when a float is out of
+# the range of the target
+def _convert_constant(value, field_type):
+    if field_type == 'float':
+        value = _float32(float(value))
+        if value in (float('inf'), float('-inf')):
+            return None
+        return repr(value)
+    return str(int(float(value)))
+
+
+class ConstantFolder(object):
+    '''
+    rewrites the syntax tree between the parser and the assembler, the
+    operators of constants are folded, the variables whose values are known
+    in the straight-line code are replaced by the constants and the if else
+    controls with constant conditions are replaced by the branch taken.
+    the float arithmetic is folded only when floats, the x87 code keeps it
+    in more than the 32 bits of a folded float. folds, propagations and
+    branches count the rewrites
+    '''
+
+    def __init__(self, tree, floats=True):
+        self.tree = tree
+        self.floats = floats
+        self.field_types = {}
+        # constants of the initialized arrays
+        self.arrays = {}
+        self.folds = 0
+        self.propagations = 0
+        self.branches = 0
+        self.sentence_handlers = {
+            'Statement': self._statement, 'FunctionStatement': self._function_statement,
+            'FunctionCall': self._function_call, 'Assignment': self._assignment,
+            'Control': self._control, 'Return': self._return,
+            'Expression': self._expression}
+        self.control_handlers = {
+            'IfElseControl': self._control_if, 'ForControl': self._control_for,
+            'WhileControl': self._control_while}
+
+    # the handlers of the sentences with blocks are generators, they yield
+    # the (father, known) of a block to have its sentences folded before
+    # they go on. the blocks being folded are kept on a stack, so the
+    # nesting of the blocks does not nest the calls
+    def run(self):
+        self.loop_written = self._loop_written()
+        stack = [self._sentences(self.tree.root, {})]
+        while stack:
+            try:
+                father, known = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            stack.append(self._sentences(father, known))
+        return self.tree
+
+    def report(self):
+        return 'folds %d, propagations %d, branches %d' % (
+            self.folds, self.propagations, self.branches)
+
+    # the sentences under father, known maps the variables to their
+    # constants. yields the blocks of the sentences with blocks
+    def _sentences(self, father, known):
+        node = father.first_son
+        while node:
+            if node.value == 'Control' and node.type == 'IfElseControl':
+                taken = self._constant_branch(node, known)
+                if taken is not False:
+                    # the sentences of the branch are handled in place of it
+                    left = node.left
+                    self.tree.replace_sons(
+                        father, left, node.right, taken or SyntaxTreeNode('Sentence'))
+                    self.branches += 1
+                    node = left.right if left else father.first_son
+                    continue
+            handler = self.sentence_handlers.get(node.value)
+            blocks = handler(node, known) if handler else None
+            if blocks:
+                for block in blocks:
+                    yield block
+            node = node.right
+
+    def _statement(self, node, known):
+        field_type = None
+        name = None
+        for son in self._brothers(node.first_son, True):
+            if son.value == 'Type':
+                field_type = son.first_son.value
+            elif son.type == 'IDENTIFIER':
+                name = son.value
+            elif son.value == 'ConstantList':
+                self.arrays[name] = [_convert_constant(constant.value, field_type)
+                                     for constant in self._brothers(son.first_son, True)]
+        if name in self.arrays and node.last_son.value != 'ConstantList':
+            del self.arrays[name]
+        self.field_types[name] = field_type
+        known.pop(name, None)
+
+    def _function_statement(self, node, known):
+        for son in self._brothers(node.first_son, True):
+            if son.value == 'Sentence':
+                yield son, {}
+
+    # scanf writes the variables whose addresses it is given
+    def _function_call(self, node, known):
+        for son in node.preorder():
+            if son.type == 'ADDRESS' and son.right:
+                known.pop(son.right.value, None)
+
+    def _assignment(self, node, known):
+        name = node.first_son.value
+        expression = self._fold(node.first_son.right, known)
+        constant = None
+        if expression.type == 'Constant' and name in self.field_types:
+            constant = _convert_constant(
+                expression.first_son.value, self.field_types[name])
+        if constant is not None:
+            known[name] = constant
+        else:
+            known.pop(name, None)
+
+    def _return(self, node, known):
+        self._fold(node.first_son.right, known)
+
+    def _expression(self, node, known):
+        self._fold(node, known)
+
+    def _control(self, node, known):
+        handler = self.control_handlers.get(node.type)
+        if handler:
+            return handler(node, known)
+
+    # the Sentence of the branch taken, None when no branch is taken, or
+    # False when the condition is not constant
+    def _constant_branch(self, node, known):
+        if_control = node.first_son
+        condition = self._fold(if_control.first_son, known)
+        if condition.type != 'Constant':
+            return False
+        if float(condition.first_son.value):
+            return if_control.first_son.right
+        if if_control.right:
+            return if_control.right.first_son
+        return None
+
+    # the condition is folded by _constant_branch
+    def _control_if(self, node, known):
+        if_control = node.first_son
+        branch_known = dict(known)
+        yield if_control.first_son.right, branch_known
+        if if_control.right:
+            yield if_control.right.first_son, known
+        for name in list(known):
+            if branch_known.get(name) != known[name]:
+                del known[name]
+
+    # the variables written in the loop are not known in it and after it,
+    # the others are the same in every round
+    def _loop(self, node, known, condition, body, step=None):
+        for name in self.loop_written[node]:
+            known.pop(name, None)
+        self._fold(condition, known)
+        body_known = dict(known)
+        yield body, body_known
+        if step:
+            self._fold(step, body_known)
+
+    def _control_for(self, node, known):
+        assignment = node.first_son
+        self._assignment(assignment, known)
+        condition = assignment.right
+        return self._loop(node, known, condition, condition.right, condition.right.right)
+
+    def _control_while(self, node, known):
+        return self._loop(node, known, node.first_son, node.first_son.right)
+
+    # the variables written under node
+    def _written(self, node):
+        written = set()
+        for son in node.preorder():
+            name = self._writes(son)
+            if name:
+                written.add(name)
+        return written
+
+    @staticmethod
+    def _writes(node):
+        if node.value == 'Assignment':
+            return node.first_son.value
+        elif node.type == 'SingleOperand' and node.first_son.right.type == 'Variable':
+            return node.first_son.right.first_son.value
+        elif node.type == 'ADDRESS' and node.right:
+            return node.right.value
+        return None
+
+    # the variables written in every loop, found in one walk of the tree
+    # before it is folded, the sets of the loops in it are added to the
+    # one of a loop when it is left
+    def _loop_written(self):
+        loop_written = {}
+        stack = [set()]
+        for node, entering in self.tree.root.walk():
+            loop = node.type in ('ForControl', 'WhileControl')
+            if entering:
+                name = self._writes(node)
+                if name:
+                    stack[-1].add(name)
+                if loop:
+                    stack.append(set())
+            elif loop:
+                written = loop_written[node] = stack.pop()
+                stack[-1] |= written
+        return loop_written
+
+    @staticmethod
+    def _brothers(node, including=False):
+        if node and not including:
+            node = node.right
+        while node:
+            yield node
+            node = node.right
+
+    def _constant_node(self, value):
+        node = SyntaxTreeNode('Expression', 'Constant')
+        self.tree.add_child_node(SyntaxTreeNode(value, '_Constant'), node)
+        return node
+
+    # node is put in the place of old
+    def _replace(self, old, node):
+        holder = SyntaxTreeNode('Expression')
+        self.tree.add_child_node(node, holder)
+        self.tree.replace_sons(old.father, old.left, old.right, holder)
+
+    # fold the expression tree in post-order, the nodes are replaced when
+    # they are left, and return the root after it
+    def _fold(self, node, known):
+        # the variables changed by ++ and -- are left as they are
+        written = self._written(node)
+        root = node
+        for current_node, entering in node.walk():
+            if entering:
+                continue
+            constant = None
+            if current_node.type == 'Variable':
+                name = current_node.first_son.value
+                if name in known and name not in written:
+                    constant = known[name]
+                    self.propagations += 1
+            elif current_node.type == 'ArrayItem':
+                name, index = current_node.first_son, current_node.first_son.right
+                if index.value in known and index.value not in written and (
+                        known[index.value].isdigit()):
+                    index.value = known[index.value]
+                    self.propagations += 1
+                values = self.arrays.get(name.value)
+                if values and index.value.isdigit() and int(index.value) < len(values):
+                    constant = values[int(index.value)]
+                    self.propagations += 1
+            elif current_node.type == 'DoubleOperand':
+                operand_a = current_node.first_son
+                operand_b = operand_a.right.right
+                operator = operand_a.right.first_son.value
+                if operand_a.type == 'Constant' and operand_b.type == 'Constant' and (
+                        self.floats or operator in MIRRORED_COMPARISONS or
+                        _constant_type(operand_a.first_son.value) == 'int' and
+                        _constant_type(operand_b.first_son.value) == 'int'):
+                    constant = _fold_operator(
+                        operator, operand_a.first_son.value, operand_b.first_son.value)
+                    if constant is not None:
+                        self.folds += 1
+            if constant is not None:
+                new_node = self._constant_node(constant)
+                self._replace(current_node, new_node)
+                if current_node is root:
+                    root = new_node
+        for name in written:
+            known.pop(name, None)
+        return root
+
+
+# a op b of the constants a and b, or None when it is not known before the
+# program runs. the floats are the ones of the target, the operands and the
+# result are rounded to 32 bits
+def _fold_operator(operator, a, b):
+    if _constant_type(a) == 'float' or _constant_type(b) == 'float':
+        a, b = _float32(float(a)), _float32(float(b))
+    else:
+        a, b = int(a), int(b)
+    if operator in MIRRORED_COMPARISONS:
+        return '1' if {'>': a > b, '<': a < b, '>=': a >= b, '<=': a <= b}[operator] else '0'
+    if operator == '/':
+        if b == 0:
+            return None
+        if isinstance(a, int):
+            # the quotient is rounded toward zero
+            result = abs(a) // abs(b)
+            result = result if (a < 0) == (b < 0) else -result
+        else:
+            result = a / b
+    elif operator == '+':
+        result = a + b
+    elif operator == '-':
+        result = a - b
+    elif operator == '*':
+        result = a * b
+    else:
+        return None
+    if isinstance(result, float):
+        result = _float32(result)
+        if result != result or result in (float('inf'), float('-inf')):
+            return None
+        return repr(result)
+    if not -2 ** 31 <= result < 2 ** 31:
+        return None
+    return str(result)
+
+
+# names of the registers and symbols in an operand
+OPERAND_NAMES = re.compile(r'%\w+|[A-Za-z_.][\w.]*')
+
+
+class Instruction(object):
+    '''
+    a line of the .text section, labels have the opcode ':' and directives
+    the opcode '.'
+    '''
+
+    __slots__ = ('line', 'opcode', 'operands', 'effects')
+
+    def __init__(self, line):
+        self.line = line
+        # cache of Peephole.effects
+        self.effects = None
+        if line.endswith(':'):
+            self.opcode = ':'
+            self.operands = [line[:-1]]
+        elif line.startswith('.'):
+            self.opcode = '.'
+            self.operands = [line]
+        else:
+            parts = line.split(None, 1)
+            self.opcode = parts[0]
+            self.operands = []
+            # the commas in parentheses do not split operands
+            if len(parts) > 1:
+                depth = 0
+                start = 0
+                for index, char in enumerate(parts[1]):
+                    if char == '(':
+                        depth += 1
+                    elif char == ')':
+                        depth -= 1
+                    elif char == ',' and not depth:
+                        self.operands.append(parts[1][start:index].strip())
+                        start = index + 1
+                self.operands.append(parts[1][start:].strip())
+
+    @classmethod
+    def make(cls, opcode, operands):
+        return cls(opcode + ' ' + ', '.join(operands))
+
+
+def _is_register(operand):
+    return operand.startswith('%')
+
+
+# a register or a variable, the operands of which the peephole rules know
+# when they are read and written
+def _is_name(operand):
+    return _is_register(operand) or OPERAND_NAMES.match(operand) and (
+        OPERAND_NAMES.match(operand).end() == len(operand))
+
+
+def _names(operand):
+    return set(REGISTER_ALIASES.get(name, name)
+               for name in OPERAND_NAMES.findall(operand))
+
+
+class Peephole(object):
+    '''
+    rewrites the .text instructions with the rules, a rule looks at the
+    instruction at an index and the ones after it and returns True when it
+    changed them, hits counts the rewrites of every rule
+    '''
+
+    def __init__(self, rules=None, arguments=()):
+        self.rules = rules if rules is not None else PEEPHOLE_RULES
+        # registers the calls take their arguments in
+        self.arguments = frozenset(arguments)
+        self.hits = dict((name, 0) for name, rule in self.rules)
+        self.instructions = []
+        self.skip = []
+        self.labels = {}
+        # variables whose address is taken, and whether all the .text
+        # instructions are known to tell so
+        self.escaped = set()
+        self.complete = True
+
+    # (names read, names written, control), control is None, 'label',
+    # 'jump', 'branch', 'call' or 'barrier' for the unknown instructions
+    @staticmethod
+    def effects(instruction):
+        if instruction.effects is None:
+            instruction.effects = Peephole._effects(instruction)
+        return instruction.effects
+
+    @staticmethod
+    def _effects(instruction):
+        opcode = instruction.opcode
+        operands = instruction.operands
+        if opcode == ':':
+            return set(), set(), 'label'
+        if opcode == 'jmp':
+            return set(), set(), 'jump'
+        if opcode.startswith('j'):
+            return set(), set(), 'branch'
+        if opcode == 'call':
+            return set(), set(), 'call'
+        reads = set()
+        for operand in operands:
+            reads |= _names(operand)
+        if opcode in READ_OPCODES:
+            return reads, set(), None
+        # imull of one operand multiplies %eax to %edx:%eax
+        if opcode in MULTIPLY_OPCODES or opcode == 'imull' and len(operands) == 1:
+            return reads | set(['%eax', '%edx']), set(['%eax', '%edx']), None
+        if opcode in STORE_OPCODES or opcode in UPDATE_OPCODES:
+            writes = set()
+            if operands and _is_name(operands[-1]):
+                writes = _names(operands[-1])
+                if opcode in STORE_OPCODES:
+                    reads = set()
+                    for operand in operands[:-1]:
+                        reads |= _names(operand)
+            return reads, writes, None
+        return reads, set(), 'barrier'
+
+    # index of the instruction after index, the removed ones are skipped
+    # through skip, which is shortened on the way
+    def _next(self, index):
+        instructions = self.instructions
+        skip = self.skip
+        following = index + 1
+        removed = []
+        while following < len(instructions) and instructions[following] is None:
+            removed.append(following)
+            following = skip[following]
+        for index in removed:
+            skip[index] = following
+        return following if following < len(instructions) else None
+
+    # whether name may be read after the instruction at index, along every
+    # path of at most PEEPHOLE_WINDOW instructions, and where the window
+    # ends the name is taken as read
+    def live(self, index, name):
+        instructions = self.instructions
+        pending = [self._next(index)]
+        seen = set()
+        budget = PEEPHOLE_WINDOW
+        while pending:
+            index = pending.pop()
+            while True:
+                if index is None:
+                    return True
+                if index in seen:
+                    break
+                seen.add(index)
+                instruction = instructions[index]
+                index = self._next(index)
+                budget -= 1
+                if budget < 0:
+                    return True
+                reads, writes, control = self.effects(instruction)
+                if name in reads or control == 'barrier':
+                    return True
+                if control == 'call':
+                    # exit never returns, the others may read the variables
+                    # whose address they are given
+                    if name in self.arguments:
+                        return True
+                    if instruction.operands == ['exit'] or name in CALLER_SAVED:
+                        break
+                    if not _is_register(name) and (
+                            name in self.escaped or not self.complete):
+                        return True
+                elif name in writes:
+                    break
+                elif control == 'jump':
+                    index = self.labels.get(instruction.operands[0])
+                elif control == 'branch':
+                    pending.append(self.labels.get(instruction.operands[0]))
+        return False
+
+    # the whole .text section is given when complete, or it is given in parts
+    # in the order of the lines
+    def run(self, instructions, complete=True):
+        self.instructions = instructions
+        self.skip = list(range(1, len(instructions) + 1))
+        self.complete = complete
+        for instruction in instructions:
+            for operand in instruction.operands:
+                if operand.startswith('$'):
+                    self.escaped |= _names(operand)
+        self.labels = dict(
+            (instruction.operands[0], index)
+            for index, instruction in enumerate(instructions)
+            if instruction.opcode == ':')
+        changed = True
+        while changed:
+            changed = False
+            # the rules look forward, the instructions after index are
+            # rewritten first
+            for index in range(len(instructions) - 1, -1, -1):
+                for name, rule in self.rules:
+                    while instructions[index] is not None and rule(self, index):
+                        self.hits[name] += 1
+                        changed = True
+        self.instructions = []
+        self.skip = []
+        return [instruction for instruction in instructions if instruction]
+
+    def report(self):
+        return ', '.join('%s %d' % (name, self.hits[name]) for name, rule in self.rules)
+
+
+# movl %eax, x; movl x, %edi --> movl %eax, x; movl %eax, %edi
+# fstps x; flds x; fstps y --> fsts x; fstps y
+def _store_load(peephole, index):
+    instructions = peephole.instructions
+    first = instructions[index]
+    second_index = peephole._next(index)
+    if second_index is None:
+        return False
+    second = instructions[second_index]
+    if (first.opcode == 'movl' and second.opcode == 'movl' and
+            _is_register(first.operands[0]) and _is_name(first.operands[1]) and
+            second.operands[0] == first.operands[1]):
+        if second.operands[1] == first.operands[0]:
+            instructions[second_index] = None
+        elif second.operands[0] != first.operands[0]:
+            instructions[second_index] = Instruction.make(
+                'movl', [first.operands[0], second.operands[1]])
+        else:
+            return False
+        return True
+    # the value is rounded the same when it is stored again at once
+    for store, load, keep in [('fstps', 'flds', 'fsts'), ('fstpl', 'fldl', 'fstl')]:
+        if (first.opcode == store and second.opcode == load and
+                first.operands == second.operands):
+            third_index = peephole._next(second_index)
+            if third_index is not None and instructions[third_index].opcode in (store, keep):
+                instructions[index] = Instruction.make(keep, first.operands)
+                instructions[second_index] = None
+                return True
+    return False
+
+
+# a value stored where it is not read any more
+def _dead_store(peephole, index):
+    instruction = peephole.instructions[index]
+    if instruction.opcode not in ('movl', 'fsts', 'fstl'):
+        return False
+    target = instruction.operands[-1]
+    if not _is_name(target) or peephole.live(index, REGISTER_ALIASES.get(target, target)):
+        return False
+    peephole.instructions[index] = None
+    return True
+
+
+# movl a, %edi; movl %edi, b --> movl a, b when %edi is not read any more
+def _move_coalesce(peephole, index):
+    instructions = peephole.instructions
+    first = instructions[index]
+    second_index = peephole._next(index)
+    if second_index is None or first.opcode != 'movl':
+        return False
+    second = instructions[second_index]
+    register = first.operands[1]
+    if (second.opcode != 'movl' or not _is_register(register) or
+            second.operands[0] != register or register in _names(second.operands[1])):
+        return False
+    source, target = first.operands[0], second.operands[1]
+    # one of the operands of movl has to be a register or an immediate
+    if not (_is_register(source) or source.startswith('$') or _is_register(target)):
+        return False
+    if peephole.live(second_index, register):
+        return False
+    instructions[index] = Instruction.make('movl', [source, target])
+    instructions[second_index] = None
+    return True
+
+
+# jmp label_1; label_1: --> label_1:
+def _redundant_jump(peephole, index):
+    instructions = peephole.instructions
+    instruction = instructions[index]
+    if not instruction.opcode.startswith('j'):
+        return False
+    next_index = peephole._next(index)
+    while next_index is not None and instructions[next_index].opcode == ':':
+        if instructions[next_index].operands == instruction.operands:
+            instructions[index] = None
+            return True
+        next_index = peephole._next(next_index)
+    return False
+
+
+# movl $60, x; ...; movl $60, x --> movl $60, x; ... when nothing comes in
+# between by a label and x and the registers of $60 are not written
+def _redundant_store(peephole, index):
+    instructions = peephole.instructions
+    instruction = instructions[index]
+    if instruction.opcode != 'movl' or not _is_name(instruction.operands[1]):
+        return False
+    names = _names(instruction.operands[0]) | _names(instruction.operands[1])
+    next_index = peephole._next(index)
+    for step in range(PEEPHOLE_WINDOW):
+        if next_index is None:
+            return False
+        following = instructions[next_index]
+        if following.line == instruction.line:
+            instructions[next_index] = None
+            return True
+        reads, writes, control = peephole.effects(following)
+        if control not in (None, 'branch') or writes & names:
+            return False
+        next_index = peephole._next(next_index)
+    return False
+
+
+PEEPHOLE_RULES = [
+    ('store_load', _store_load), ('dead_store', _dead_store),
+    ('move_coalesce', _move_coalesce), ('redundant_jump', _redundant_jump),
+    ('redundant_store', _redundant_store)]
+
+
+class VirtualRegister(object):
+    '''
+    a register of the IR, there are as many of them as needed and every one
+    is the target of only one instruction
+    '''
+    __slots__ = ('number', 'type')
+
+    def __init__(self, number, _type):
+        self.number = number
+        self.type = _type
+
+    def __repr__(self):
+        return '%' + str(self.number)
+
+
+# int or float of a virtual register or a constant, None for the names
+def _operand_type(operand):
+    if operand.__class__ is VirtualRegister:
+        return operand.type
+    if isinstance(operand, float):
+        return 'float'
+    if isinstance(operand, int):
+        return 'int'
+    return None
+
+
+# the label a branch of two constants goes to, None if one of them is not
+def _branch_taken(instruction):
+    operator, operand_a, operand_b, label_true, label_false = instruction.operands
+    if operand_a.__class__ is VirtualRegister or operand_b.__class__ is VirtualRegister:
+        return None
+    holds = {'>': operand_a > operand_b, '<': operand_a < operand_b,
+             '>=': operand_a >= operand_b, '<=': operand_a <= operand_b,
+             '==': operand_a == operand_b, '!=': operand_a != operand_b}[operator]
+    return label_true if holds else label_false
+
+
+class IRInstruction(object):
+    '''
+    a three address instruction, target = opcode operands. the operands are
+    virtual registers, int and float constants, and the names of the
+    variables, the functions, the labels and the comparisons. type is the
+    one of the target, of the stored value or of the compared values
+    '''
+    __slots__ = ('opcode', 'operands', 'target', 'type')
+
+    def __init__(self, opcode, operands, target=None, _type='int'):
+        self.opcode = opcode
+        self.operands = operands
+        self.target = target
+        self.type = _type
+
+    def __repr__(self):
+        text = self.opcode
+        if self.opcode not in ('jump', 'call'):
+            text += ' ' + self.type
+        if self.operands:
+            text += ' ' + ', '.join(
+                repr(operand) if isinstance(operand, float) else str(operand)
+                for operand in self.operands)
+        if self.target is not None:
+            text = '%r = %s' % (self.target, text)
+        return text
+
+    # the virtual registers read
+    def registers(self):
+        return [operand for operand in self.operands
+                if operand.__class__ is VirtualRegister]
+
+
+class BasicBlock(object):
+    '''
+    instructions run one after another, the last one and only it jumps
+    '''
+    __slots__ = ('label', 'instructions')
+
+    def __init__(self, label):
+        self.label = label
+        self.instructions = []
+
+    # labels of the blocks which may run after this one
+    def successors(self):
+        terminator = self.instructions[-1]
+        if terminator.opcode == 'jump':
+            return [terminator.operands[0]]
+        elif terminator.opcode == 'branch':
+            return list(terminator.operands[3:])
+        return []
+
+
+class IRFunction(object):
+    '''
+    the basic blocks of a function, the first one is run when it is called
+    and is labelled with its name
+    '''
+    __slots__ = ('name', 'blocks', 'register_cnt')
+
+    def __init__(self, name):
+        self.name = name
+        self.blocks = []
+        self.register_cnt = 0
+
+    def new_register(self, _type):
+        self.register_cnt += 1
+        return VirtualRegister(self.register_cnt, _type)
+
+
+class IRProgram(object):
+    '''
+    the functions of a source file in the IR. symbols maps the variables,
+    the arrays and the strings to dicts like the ones of the symbol table of
+    the parser, names keeps the order they are declared in
+    '''
+    __slots__ = ('functions', 'symbols', 'names', 'label_cnt')
+
+    def __init__(self):
+        self.functions = []
+        self.symbols = {}
+        self.names = []
+        self.label_cnt = 0
+
+    def declare(self, name, symbol):
+        if name not in self.symbols:
+            self.names.append(name)
+        self.symbols[name] = symbol
+
+    # the text of the IR, one line for every symbol, label and instruction
+    def dump(self):
+        lines = []
+        for name in self.names:
+            symbol = self.symbols[name]
+            if symbol['type'] == 'STRING_CONSTANT':
+                lines.append('%s = "%s"' % (name, symbol['value']))
+            elif symbol['type'] == 'LIST':
+                line = '%s %s[%d]' % (symbol['field_type'], name, symbol['size'])
+                if symbol['values'] is not None:
+                    line += ' = {' + ', '.join(symbol['values']) + '}'
+                lines.append(line)
+            elif symbol.get('register'):
+                lines.append('register %s %s' % (symbol['field_type'], name))
+            else:
+                lines.append('%s %s' % (symbol['field_type'], name))
+        for function in self.functions:
+            lines.append('')
+            lines.append('function ' + function.name)
+            for block in function.blocks:
+                lines.append(block.label + ':')
+                for instruction in block.instructions:
+                    lines.append('    %r' % instruction)
+        return lines
+
+    # the errors of the IR, it is well formed when there are none
+    def verify(self):
+        errors = []
+        for function in self.functions:
+            labels = set()
+            definitions = {}
+            for block in function.blocks:
+                if block.label in labels:
+                    errors.append('%s: label %s is repeated' % (function.name, block.label))
+                labels.add(block.label)
+                for index, instruction in enumerate(block.instructions):
+                    if instruction.target is None:
+                        continue
+                    if instruction.target in definitions:
+                        errors.append('%s: %r is defined twice' % (
+                            function.name, instruction.target))
+                    definitions[instruction.target] = (block, index)
+            for block in function.blocks:
+                where = '%s %s' % (function.name, block.label)
+                if not block.instructions or block.instructions[-1].opcode not in IR_TERMINATORS:
+                    errors.append(where + ': the block does not end with a jump')
+                for index, instruction in enumerate(block.instructions):
+                    message = self._check(instruction, labels)
+                    if message is None and instruction.opcode in IR_TERMINATORS and (
+                            index != len(block.instructions) - 1):
+                        message = 'jump before the end of the block'
+                    if message is None and instruction.opcode in ('jump', 'branch') and (
+                            function.blocks[0].label in instruction.operands[-2:]):
+                        message = 'jump to the first block'
+                    for register in instruction.registers():
+                        if message is not None:
+                            break
+                        if register not in definitions:
+                            message = '%r is not defined' % register
+                        elif definitions[register][0] is block and definitions[register][1] >= index:
+                            message = '%r is used before it is defined' % register
+                    if message is not None:
+                        errors.append('%s: %s: %r' % (where, message, instruction))
+        return errors
+
+    def _check(self, instruction, labels):
+        opcode = instruction.opcode
+        operands = instruction.operands
+        _type = instruction.type
+        if opcode not in IR_OPCODES:
+            return 'unknown opcode'
+        if IR_OPCODES[opcode] is not None and len(operands) != IR_OPCODES[opcode]:
+            return 'wrong number of operands'
+        if _type not in VECTOR_TYPES and _type not in LANE_TYPES:
+            return 'unknown type'
+        if (instruction.target is None) != (opcode in IR_EFFECTS):
+            return 'wrong target'
+        if instruction.target is not None and instruction.target.type != _type:
+            return 'wrong type of the target'
+        types = [_operand_type(operand) for operand in operands]
+        if opcode in ('load', 'store', 'load_item', 'store_item', 'addr', 'load_vector'):
+            symbol = self.symbols.get(operands[0])
+            if symbol is None:
+                return operands[0] + ' is not declared'
+            if opcode == 'addr':
+                return None if _type == 'int' else 'wrong type'
+            if symbol['type'] != ('VARIABLE' if opcode in ('load', 'store') else 'LIST'):
+                return 'wrong kind of ' + operands[0]
+            if symbol['field_type'] != (LANE_TYPES.get(_type) if opcode == 'load_vector' else _type):
+                return 'wrong type of ' + operands[0]
+            if opcode in ('load_item', 'store_item', 'load_vector') and types[1] != 'int':
+                return 'wrong type of the index'
+            if opcode in ('store', 'store_item') and types[-1] != _type:
+                return 'wrong type of the value'
+        elif opcode in ('add', 'sub', 'mul', 'div'):
+            if types != [_type, _type]:
+                return 'wrong types of the operands'
+        elif opcode in ('itof', 'ftoi'):
+            source = 'int' if opcode == 'itof' else 'float'
+            if _type in LANE_TYPES:
+                source = VECTOR_TYPES[source]
+            if types[0] != source or types[0] == _type:
+                return 'wrong type of the operand'
+        elif opcode == 'broadcast':
+            if operands[0].__class__ is VirtualRegister or VECTOR_TYPES.get(types[0]) != _type:
+                return 'wrong type of the operand'
+        elif opcode in ('lane', 'sum'):
+            if LANE_TYPES.get(types[0]) != _type:
+                return 'wrong type of the operand'
+            if opcode == 'lane' and (operands[1].__class__ is not int or not (
+                    0 <= operands[1] < VECTOR_LANES)):
+                return 'wrong lane'
+        elif opcode == 'call':
+            if not operands or operands[0] not in ('printf', 'scanf') or None in types[1:]:
+                return 'wrong call'
+        elif opcode == 'jump':
+            if operands[0] not in labels:
+                return 'unknown label'
+        elif opcode == 'branch':
+            if operands[0] not in IR_COMPARISONS or types[1:3] != [_type, _type]:
+                return 'wrong comparison'
+            if operands[3] not in labels or operands[4] not in labels:
+                return 'unknown label'
+        elif opcode == 'return':
+            if types != ['int']:
+                return 'wrong type of the operand'
+        return None
+
+
+class IRBuilder(object):
+    '''
+    lowers the syntax tree to the IR, a function is cut into basic blocks at
+    the labels of its controls. the handlers of the sentences with sons are
+    generators like the ones of the parser, the expressions are lowered in
+    post-order with the son needing more registers first
+    '''
+
+    def __init__(self):
+        self.program = IRProgram()
+        self.function = None
+        # the block the instructions go to, None after a jump
+        self.block = None
+        # handlers of the sentences, keyed by node.value, and of the
+        # controls, keyed by node.type
+        self.handlers = {
+            'Sentence': self._sentence, 'Include': self._include,
+            'FunctionStatement': self._function_statement,
+            'Statement': self._statement, 'FunctionCall': self._function_call,
+            'Assignment': self._assignment, 'Control': self._control,
+            'Expression': self._expression_sentence, 'Return': self._return}
+        self.control_handlers = {
+            'IfElseControl': self._control_if, 'ForControl': self._control_for,
+            'WhileControl': self._control_while}
+        # label
+        self.label_cnt = 0
+
+    def build(self, node=None):
+        self.traverse(node)
+        self.program.label_cnt = self.label_cnt
+        return self.program
+
+    def _new_label(self):
+        label = 'label_' + str(self.label_cnt)
+        self.label_cnt += 1
+        return label
+
+    # a new block, the one before it falls through to it
+    def _start_block(self, label):
+        self._jump(label)
+        self.block = BasicBlock(label)
+        self.function.blocks.append(self.block)
+
+    def _jump(self, label):
+        if self.block is not None:
+            self._add('jump', [label])
+
+    # the target of the instruction if it has one
+    def _add(self, opcode, operands, _type='int'):
+        if self.block is None:
+            # the code after a return is not reached, it gets a block anyway
+            self.block = BasicBlock(self._new_label())
+            self.function.blocks.append(self.block)
+        target = None
+        if opcode not in IR_EFFECTS:
+            target = self.function.new_register(_type)
+        self.block.instructions.append(IRInstruction(opcode, operands, target, _type))
+        if opcode in IR_TERMINATORS:
+            self.block = None
+        return target
+
+    # include
+    def _include(self, node=None):
+        pass
+
+    def _function_statement(self, node=None):
+        current_node = node.first_son
+        while current_node:
+            if current_node.value == 'FunctionName':
+                if current_node.first_son.value != 'main':
+                    print ('other function statement except for main is not supported!')
+                    exit()
+                self.function = IRFunction(current_node.first_son.value)
+                self.program.functions.append(self.function)
+                self.block = None
+                self._start_block(self.function.name)
+            elif current_node.value == 'Sentence':
+                yield current_node.first_son
+            current_node = current_node.right
+        # main returns 0 when it runs off its end
+        if self.block is not None:
+            self._add('return', [0])
 
     def _statement(self, node=None):
-        line = None
-        flag = 0
-        variable_field_type = None
-        variable_type = None
-        variable_name = None
+        field_type = None
+        symbol = None
         current_node = node.first_son
         while current_node:
             if current_node.value == 'Type':
-                variable_field_type = current_node.first_son.value
+                field_type = current_node.first_son.value
             elif current_node.type == 'IDENTIFIER':
-                variable_name = current_node.value
-                variable_type = current_node.extra_info['type']
-                line = '.lcomm ' + variable_name + \
-                    ', ' + self._sizeof(variable_field_type)
+                symbol = {'type': current_node.extra_info['type'], 'field_type': field_type}
+                if symbol['type'] == 'LIST':
+                    symbol['size'] = 1
+                    symbol['values'] = None
+                self.program.declare(current_node.value, symbol)
+            elif current_node.type == 'DIGIT_CONSTANT':
+                symbol['size'] = int(current_node.value)
             elif current_node.value == 'ConstantList':
-                line = variable_name + ': .' + variable_field_type + ' '
+                values = []
                 tmp_node = current_node.first_son
-                array = []
                 while tmp_node:
-                    array.append(tmp_node.value)
+                    values.append(tmp_node.value)
                     tmp_node = tmp_node.right
-                line += ', '.join(array)
+                symbol['values'] = values
             current_node = current_node.right
-        self.ass_file_handler.insert(
-            line, 'BSS' if variable_type == 'VARIABLE' else 'DATA')
-        self.symbol_table[variable_name] = {
-            'type': variable_type, 'field_type': variable_field_type}
 
     def _function_call(self, node=None):
         current_node = node.first_son
         func_name = None
-        parameter_list = []
+        arguments = []
         while current_node:
             if current_node.type == 'FUNCTION_NAME':
                 func_name = current_node.value
@@ -854,113 +2980,46 @@ class Assembler(object):
             elif current_node.value == 'CallParameterList':
                 tmp_node = current_node.first_son
                 while tmp_node:
-                    if tmp_node.type == 'DIGIT_CONSTANT' or tmp_node.type == 'STRING_CONSTANT':
-                        label = 'label_' + str(self.label_cnt)
-                        self.label_cnt += 1
-                        if tmp_node.type == 'STRING_CONSTANT':
-                            line = label + ': .asciz "' + tmp_node.value + '"'
-                            self.ass_file_handler.insert(line, 'DATA')
-                        else:
-                            print ('in functionc_call digital constant parameter is not supported yet!')
-                            exit()
-                        self.symbol_table[label] = {
-                            'type': 'STRING_CONSTANT', 'value': tmp_node.value}
-                        parameter_list.append(label)
+                    if tmp_node.type == 'STRING_CONSTANT':
+                        label = self._new_label()
+                        self.program.declare(label, {
+                            'type': 'STRING_CONSTANT', 'value': tmp_node.value})
+                        arguments.append(self._add('addr', [label]))
+                    elif tmp_node.type == 'DIGIT_CONSTANT':
+                        print ('in functionc_call digital constant parameter is not supported yet!')
+                        exit()
                     elif tmp_node.type == 'IDENTIFIER':
-                        parameter_list.append(tmp_node.value)
-                    elif tmp_node.type == 'ADDRESS':
-                        pass
-                    else:
+                        arguments.append(self._argument(func_name, tmp_node.value))
+                    elif tmp_node.type != 'ADDRESS':
                         print (tmp_node.value)
                         print (tmp_node.type)
                         print ('parameter type is not supported yet!')
                         exit()
                     tmp_node = tmp_node.right
             current_node = current_node.right
-        if func_name == 'printf':
-            num = 0
-            for parameter in parameter_list[::-1]:
-                if self.symbol_table[parameter]['type'] == 'STRING_CONSTANT':
-                    line = 'pushl $' + parameter
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    num += 1
-                elif self.symbol_table[parameter]['type'] == 'VARIABLE':
-                    field_type = self.symbol_table[parameter]['field_type']
-                    if field_type == 'int':
-                        line = 'pushl ' + parameter
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        num += 1
-                    elif field_type == 'float':
-                        line = 'flds ' + parameter
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = r'subl $8, %esp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = r'fstpl (%esp)'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        num += 2
-                    else:
-                        print ('field type except int and float is not supported yet!')
-                        exit()
-                else:
-                    print ('parameter type not supported in printf yet!')
-                    exit()
-            line = 'call printf'
-            self.ass_file_handler.insert(line, 'TEXT')
-            line = 'add $' + str(num * 4) + ', %esp'
-            self.ass_file_handler.insert(line, 'TEXT')
-        elif func_name == 'scanf':
-            num = 0
-            for parameter in parameter_list[::-1]:
-                parameter_type = self.symbol_table[parameter]['type']
-                if parameter_type == 'STRING_CONSTANT' or parameter_type == 'VARIABLE':
-                    num += 1
-                    line = 'pushl $' + parameter
-                    self.ass_file_handler.insert(line, 'TEXT')
-                else:
-                    print ('parameter type not supported in scanf!')
-                    exit()
-            line = 'call scanf'
-            self.ass_file_handler.insert(line, 'TEXT')
-            line = 'add $' + str(num * 4) + ', %esp'
-            self.ass_file_handler.insert(line, 'TEXT')
+        self._add('call', [func_name] + arguments)
+
+    # printf takes the values of the variables and scanf their addresses
+    def _argument(self, func_name, name):
+        field_type = self._field_type(name)
+        if func_name == 'scanf':
+            return self._add('addr', [name])
+        return self._add('load', [name], field_type)
 
     def _assignment(self, node=None):
         current_node = node.first_son
         if current_node.type == 'IDENTIFIER' and current_node.right.value == 'Expression':
-            expres = self._expression(current_node.right)
-            field_type = self.symbol_table[current_node.value]['field_type']
-            if field_type == 'int':
-                if expres['type'] == 'CONSTANT':
-                    line = 'movl $' + \
-                        expres['value'] + ', ' + current_node.value
-                    self.ass_file_handler.insert(line, 'TEXT')
-                elif expres['type'] == 'VARIABLE':
-                    line = 'movl ' + expres['value'] + ', ' + '%edi'
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    line = 'movl %edi, ' + current_node.value
-                    self.ass_file_handler.insert(line, 'TEXT')
-                else:
-                    pass
-            elif field_type == 'float':
-                if expres['type'] == 'CONSTANT':
-                    line = 'movl $' + \
-                        expres['value'] + ', ' + current_node.value
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    line = 'filds ' + current_node.value
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    line = 'fstps ' + current_node.value
-                    self.ass_file_handler.insert(line, 'TEXT')
-                else:
-                    line = 'fstps ' + current_node.value
-                    self.ass_file_handler.insert(line, 'TEXT')
-            else:
-                print ('field type except int and float not supported!')
-                exit()
+            field_type = self._field_type(current_node.value)
+            value = self._expression(current_node.right)
+            self._add('store', [current_node.value, self._convert(value, field_type)],
+                      field_type)
         else:
             print ('assignment wrong.')
             exit()
 
     # for
+    # the loops are rotated, the condition is tested once in front of the
+    # body and then at the end of it, where it jumps back to the body
     def _control_for(self, node=None):
         current_node = node.first_son
         cnt = 2
@@ -972,49 +3031,55 @@ class Assembler(object):
             elif current_node.value == 'Expression':
                 if cnt == 2:
                     cnt += 1
-                    line = 'label_' + str(self.label_cnt) + ':'
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    self.label_cnt += 1
-                    self._expression(current_node)
+                    condition = current_node
+                    label_body = self._new_label()
+                    label_end = self._new_label()
+                    self._condition(condition, label_body, label_end)
+                    self._start_block(label_body)
                 else:
                     self._expression(current_node)
             # for
             elif current_node.value == 'Sentence':
-                self.traverse(current_node.first_son)
+                yield current_node.first_son
             current_node = current_node.right
-        line = 'jmp label_' + str(self.label_cnt - 1)
-        self.ass_file_handler.insert(line, 'TEXT')
-        line = 'label_' + str(self.label_cnt) + ':'
-        self.ass_file_handler.insert(line, 'TEXT')
-        self.label_cnt += 1
+        self._condition(condition, label_body, label_end)
+        self._start_block(label_end)
 
     # if else
     def _control_if(self, node=None):
         current_node = node.first_son
-        self.labels_ifelse['label_else'] = 'label_' + str(self.label_cnt)
-        self.label_cnt += 1
-        self.labels_ifelse['label_end'] = 'label_' + str(self.label_cnt)
-        self.label_cnt += 1
+        # the nested if else statements have their own labels
+        label_else = self._new_label()
+        label_end = self._new_label()
+        label_then = self._new_label()
         while current_node:
             if current_node.value == 'IfControl':
                 if current_node.first_son.value != 'Expression' or current_node.first_son.right.value != 'Sentence':
                     print ('control_if error!')
                     exit()
-                self._expression(current_node.first_son)
-                self.traverse(current_node.first_son.right.first_son)
-                line = 'jmp ' + self.labels_ifelse['label_end']
-                self.ass_file_handler.insert(line, 'TEXT')
-                line = self.labels_ifelse['label_else'] + ':'
-                self.ass_file_handler.insert(line, 'TEXT')
+                self._condition(current_node.first_son, label_then, label_else)
+                self._start_block(label_then)
+                yield current_node.first_son.right.first_son
+                self._jump(label_end)
+                self._start_block(label_else)
             elif current_node.value == 'ElseControl':
-                self.traverse(current_node.first_son)
-                line = self.labels_ifelse['label_end'] + ':'
-                self.ass_file_handler.insert(line, 'TEXT')
+                yield current_node.first_son
             current_node = current_node.right
+        self._start_block(label_end)
 
     # while
     def _control_while(self, node=None):
-        print ('while not supported yet!')
+        condition = node.first_son
+        if condition.value != 'Expression' or condition.right.value != 'Sentence':
+            print ('control_while error!')
+            exit()
+        label_body = self._new_label()
+        label_end = self._new_label()
+        self._condition(condition, label_body, label_end)
+        self._start_block(label_body)
+        yield condition.right.first_son
+        self._condition(condition, label_body, label_end)
+        self._start_block(label_end)
 
     # return
     def _return(self, node=None):
@@ -1022,358 +3087,3760 @@ class Assembler(object):
         if current_node.value != 'return' or current_node.right.value != 'Expression':
             print ('return error!')
             exit()
-        else:
-            current_node = current_node.right
-            expres = self._expression(current_node)
-            if expres['type'] == 'CONSTANT':
-                line = 'pushl $' + expres['value']
-                self.ass_file_handler.insert(line, 'TEXT')
-                line = 'call exit'
-                self.ass_file_handler.insert(line, 'TEXT')
-            else:
-                print ('return type not supported!')
-                exit()
+        value = self._expression(current_node.right)
+        self._add('return', [self._convert(value, 'int')])
 
-    def _traverse_expression(self, node=None):
-        if not node:
-            return
-        if node.type == '_Variable':
-            self.operand_stack.append(
-                {'type': 'VARIABLE', 'operand': node.value})
-        elif node.type == '_Constant':
-            self.operand_stack.append(
-                {'type': 'CONSTANT', 'operand': node.value})
-        elif node.type == '_Operator':
-            self.operator_stack.append(node.value)
-        elif node.type == '_ArrayName':
-            self.operand_stack.append(
-                {'type': 'ARRAY_ITEM', 'operand': [node.value, node.right.value]})
-            return
-        current_node = node.first_son
-        while current_node:
-            self._traverse_expression(current_node)
-            current_node = current_node.right
+    # an expression sentence is only lowered for its side effects
+    def _expression_sentence(self, node=None):
+        self._expression(node)
+
+    def _field_type(self, name, _type='VARIABLE'):
+        symbol = self.program.symbols.get(name)
+        if symbol is None or symbol['type'] == 'STRING_CONSTANT':
+            print ('variable ' + name + ' is not declared!')
+            exit()
+        if symbol['type'] != _type:
+            print ('%s is not a %s!' % (name, 'list' if _type == 'LIST' else 'variable'))
+            exit()
+        if symbol['field_type'] not in ('int', 'float'):
+            print ('field type except int and float not supported!')
+            exit()
+        return symbol['field_type']
+
+    # the value with the given type, constants are converted right away
+    def _convert(self, value, field_type):
+        if _operand_type(value) == field_type:
+            return value
+        if value.__class__ is not VirtualRegister:
+            return float(value) if field_type == 'float' else int(value)
+        return self._add('itof' if field_type == 'float' else 'ftoi', [value], field_type)
 
-    def _is_float(self, operand):
-        return operand['type'] == 'VARIABLE' and self.symbol_table[operand['operand']]['field_type'] == 'float'
+    # Ershov numbers, the registers the expressions under node need when the
+    # son needing more is evaluated first
+    def _needs(self, node):
+        # the sons come after their father in nodes
+        nodes = []
+        stack = [node]
+        while stack:
+            current_node = stack.pop()
+            nodes.append(current_node)
+            if current_node.type == 'DoubleOperand':
+                stack.append(current_node.first_son)
+                stack.append(current_node.first_son.right.right)
+            elif current_node.type == 'SingleOperand':
+                stack.append(current_node.first_son.right)
+        needs = {}
+        for current_node in reversed(nodes):
+            if current_node.type == 'DoubleOperand':
+                left = needs[id(current_node.first_son)]
+                right = needs[id(current_node.first_son.right.right)]
+                needs[id(current_node)] = max(left, right) if left != right else left + 1
+            elif current_node.type == 'SingleOperand':
+                needs[id(current_node)] = needs[id(current_node.first_son.right)]
+            else:
+                needs[id(current_node)] = 1
+        return needs
 
-    def _contain_float(self, operand_a, operand_b):
-        return self._is_float(operand_a) or self._is_float(operand_b)
+    # the value of the expression tree, lowered in post-order with the son
+    # needing more registers first. a comparison is a tuple of the
+    # operator, the operands and their type
+    def _lower(self, node):
+        needs = self._needs(node)
+        values = []
+        # nodes to enter, and (node, swapped) to leave
+        stack = [node]
+        while stack:
+            current_node = stack.pop()
+            if current_node.__class__ is tuple:
+                current_node, swapped = current_node
+                top = values.pop()
+                below = values.pop()
+                values.append(self._double_operator(
+                    current_node.first_son.right.first_son.value,
+                    top if swapped else below, below if swapped else top))
+            elif current_node.type == 'DoubleOperand':
+                left = current_node.first_son
+                right = left.right.right
+                swapped = needs[id(right)] > needs[id(left)]
+                stack.append((current_node, swapped))
+                if swapped:
+                    stack.append(left)
+                    stack.append(right)
+                else:
+                    stack.append(right)
+                    stack.append(left)
+            elif current_node.type == 'SingleOperand':
+                values.append(self._single_operator(current_node))
+            else:
+                values.append(self._leaf(current_node))
+        return values.pop()
 
+    # the virtual register or the constant of the value of the expression
     def _expression(self, node=None):
+        value = self._lower(node)
+        if value.__class__ is tuple:
+            print ('comparison is only supported in conditions!')
+            exit()
+        return value
+
+    # jump to label_true when the expression at node holds and to
+    # label_false when it does not
+    def _condition(self, node, label_true, label_false):
+        value = self._lower(node)
+        if value.__class__ is tuple:
+            operator, operand_a, operand_b, _type = value
+        else:
+            _type = _operand_type(value)
+            operator, operand_a, operand_b = '!=', value, self._convert(0, _type)
+        self._add('branch', [operator, operand_a, operand_b, label_true, label_false], _type)
+
+    def _index(self, index):
+        if index.isdigit():
+            return int(index)
+        if self._field_type(index) != 'int':
+            print ('index of array must be int!')
+            exit()
+        return self._add('load', [index])
+
+    # the value of a leaf of the expression tree
+    def _leaf(self, node):
+        son = node.first_son
         if node.type == 'Constant':
-            return {'type': 'CONSTANT', 'value': node.first_son.value}
-        self.operator_priority = []
-        self.operand_stack = []
-        self._traverse_expression(node)
-
-        double_operators = ['+', '-', '*', '/', '>', '<', '>=', '<=']
-        single_operators = ['++', '--']
-        operator_map = {'>': 'jbe', '<': 'jae', '>=': 'jb', '<=': 'ja'}
-        while self.operator_stack:
-            operator = self.operator_stack.pop()
-            if operator in double_operators:
-                operand_b = self.operand_stack.pop()
-                operand_a = self.operand_stack.pop()
-                contain_float = self._contain_float(operand_a, operand_b)
-                if operator == '+':
-                    if contain_float:
-                        line = 'flds ' if self._is_float(
-                            operand_a) else 'filds '
-                        line += operand_a['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'fadd ' if self._is_float(
-                            operand_b) else 'fiadd '
-                        line += operand_b['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-                        line = 'fstps bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'flds bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'float'}
-                    else:
-                        if operand_a['type'] == 'ARRAY_ITEM':
-                            line = 'movl ' + \
-                                operand_a['operand'][1] + r', %edi'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                            line = 'movl ' + \
-                                operand_a['operand'][0] + r'(, %edi, 4), %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_a['type'] == 'VARIABLE':
-                            line = 'movl ' + operand_a['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_a['type'] == 'CONSTANT':
-                            line = 'movl $' + operand_a['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        if operand_b['type'] == 'ARRAY_ITEM':
-                            line = 'movl ' + \
-                                operand_b['operand'][1] + r', %edi'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                            line = 'addl ' + \
-                                operand_b['operand'][0] + r'(, %edi, 4), %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_b['type'] == 'VARIABLE':
-                            line = 'addl ' + operand_b['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        elif operand_b['type'] == 'CONSTANT':
-                            line = 'addl $' + operand_b['operand'] + r', %eax'
-                            self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'movl %eax, bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'int'}
-
-                elif operator == '-':
-                    if contain_float:
-                        if self._is_float(operand_a):
-                            if operand_a['type'] == 'VARIABLE':
-                                line = 'flds ' if self._is_float(
-                                    operand_a) else 'filds '
-                                line += operand_a['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        else:
-                            if operand_a['type'] == 'CONSTANT':
-                                line = 'movl $' + \
-                                    operand_a['operand'] + ', bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        if self._is_float(operand_b):
-                            if operand_b['type'] == 'VARIABLE':
-                                line = 'flds ' if self._is_float(
-                                    operand_b) else 'filds '
-                                line += operand_b['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = 'fsub ' + operand_b['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        else:
-                            if operand_b['type'] == 'CONSTANT':
-                                line = 'movl $' + \
-                                    operand_b['operand'] + ', bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = 'fisub bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                        line = 'fstps bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'flds bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'float'}
-                    else:
-                        print ('not supported yet!')
-                        exit()
-                elif operator == '*':
-                    if operand_a['type'] == 'ARRAY_ITEM':
-                        line = 'movl ' + operand_a['operand'][1] + r', %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'movl ' + \
-                            operand_a['operand'][0] + r'(, %edi, 4), %eax'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                    else:
-                        print ('other MUL not supported yet!')
-                        exit()
+            return float(son.value) if _constant_type(son.value) == 'float' else int(son.value)
+        elif node.type == 'Variable':
+            return self._add('load', [son.value], self._field_type(son.value))
+        elif node.type == 'ArrayItem':
+            field_type = self._field_type(son.value, 'LIST')
+            return self._add('load_item', [son.value, self._index(son.right.value)], field_type)
+        print ('expression error!')
+        exit()
 
-                    if operand_b['type'] == 'ARRAY_ITEM':
-                        line = 'movl ' + operand_b['operand'][1] + r', %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'mull ' + \
-                            operand_b['operand'][0] + '(, %edi, 4)'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                    else:
-                        print ('other MUL not supported yet!')
-                        exit()
-                    line = r'movl %eax, bss_tmp'
-                    self.ass_file_handler.insert(line, 'TEXT')
-                    self.operand_stack.append(
-                        {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                    self.symbol_table['bss_tmp'] = {
-                        'type': 'IDENTIFIER', 'field_type': 'int'}
-                elif operator == '/':
-                    if contain_float:
-                        line = 'flds ' if self._is_float(
-                            operand_a) else 'filds '
-                        line += operand_a['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-                        line = 'fdiv ' if self._is_float(
-                            operand_b) else 'fidiv '
-                        line += operand_b['operand']
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-                        line = 'fstps bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        line = 'flds bss_tmp'
-                        self.ass_file_handler.insert(line, 'TEXT')
-                        self.operand_stack.append(
-                            {'type': 'VARIABLE', 'operand': 'bss_tmp'})
-                        self.symbol_table['bss_tmp'] = {
-                            'type': 'IDENTIFIER', 'field_type': 'float'}
-                    else:
-                        pass
-                elif operator == '>=':
-                    if contain_float:
-                        if self._is_float(operand_a):
-                            if operand_a['type'] == 'VARIABLE':
-                                line = 'flds ' if self._is_float(
-                                    operand_a) else 'filds '
-                                line += operand_a['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                print ('array item not supported when >=')
-                                exit()
-                        else:
-                            pass
-
-                        if self._is_float(operand_b):
-                            if operand_b['type'] == 'VARIABLE':
-                                line = 'fcom ' + operand_b['operand']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                print ('array item not supported when >=')
-                                exit()
-                        else:
-                            if operand_b['type'] == 'CONSTANT':
-                                line = 'movl $' + \
-                                    operand_b['operand'] + ', bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = 'fcom bss_tmp'
-                                self.ass_file_handler.insert(line, 'TEXT')
-                                line = operator_map[
-                                    '>='] + ' ' + self.labels_ifelse['label_else']
-                                self.ass_file_handler.insert(line, 'TEXT')
-                            else:
-                                pass
-                    else:
-                        pass
-                elif operator == '<':
-                    if contain_float:
-                        pass
-                    else:
-                        line = 'movl $' if operand_a[
-                            'type'] == 'CONSTANT' else 'movl '
-                        line += operand_a['operand'] + ', %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-                        line = 'movl $' if operand_b[
-                            'type'] == 'CONSTANT' else 'movl '
-                        line += operand_b['operand'] + ', %esi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-                        line = r'cmpl %esi, %edi'
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-                        line = operator_map[
-                            '<'] + ' ' + 'label_' + str(self.label_cnt)
-                        self.ass_file_handler.insert(line, 'TEXT')
-
-            elif operator in single_operators:
-                operand = self.operand_stack.pop()
-                if operator == '++':
-                    line = 'incl ' + operand['operand']
-                    self.ass_file_handler.insert(line, 'TEXT')
-                elif operator == '--':
-                    pass
-            else:
-                print ('operator not supported!')
-                exit()
-        result = {'type': self.operand_stack[0]['type'], 'value': self.operand_stack[
-            0]['operand']} if self.operand_stack else {'type': '', 'value': ''}
-        return result
+    def _double_operator(self, operator, operand_a, operand_b):
+        if operand_a.__class__ is tuple or operand_b.__class__ is tuple:
+            print ('comparison is only supported in conditions!')
+            exit()
+        if operator not in IR_ARITHMETIC and operator not in MIRRORED_COMPARISONS:
+            print ('operator not supported!')
+            exit()
+        _type = 'int'
+        if 'float' in (_operand_type(operand_a), _operand_type(operand_b)):
+            _type = 'float'
+        operand_a = self._convert(operand_a, _type)
+        operand_b = self._convert(operand_b, _type)
+        if operator in MIRRORED_COMPARISONS:
+            return (operator, operand_a, operand_b, _type)
+        return self._add(IR_ARITHMETIC[operator], [operand_a, operand_b], _type)
+
+    # ++ and -- of a variable or an array item, their value is the new one
+    def _single_operator(self, node):
+        operator = node.first_son.first_son.value
+        operand = node.first_son.right
+        opcode = 'add' if operator == '++' else 'sub'
+        son = operand.first_son
+        if operand.type == 'Variable':
+            field_type = self._field_type(son.value)
+            value = self._add('load', [son.value], field_type)
+            value = self._add(opcode, [value, self._convert(1, field_type)], field_type)
+            self._add('store', [son.value, value], field_type)
+        elif operand.type == 'ArrayItem':
+            field_type = self._field_type(son.value, 'LIST')
+            index = self._index(son.right.value)
+            value = self._add('load_item', [son.value, index], field_type)
+            value = self._add(opcode, [value, self._convert(1, field_type)], field_type)
+            self._add('store_item', [son.value, index, value], field_type)
+        else:
+            print ('operand of ' + operator + ' not supported!')
+            exit()
+        return value
 
+    # the handlers of the sentences with sons are generators, they yield the
+    # first node of every sibling chain to traverse before they go on
     def _handler_block(self, node=None):
         if not node:
             return
-        if node.value in self.sentence_type:
-            if node.value == 'Sentence':
-                self.traverse(node.first_son)
-            # include
-            elif node.value == 'Include':
-                self._include(node)
-            elif node.value == 'FunctionStatement':
-                self._function_statement(node)
-            elif node.value == 'Statement':
-                self._statement(node)
-            elif node.value == 'FunctionCall':
-                self._function_call(node)
-            elif node.value == 'Assignment':
-                self._assignment(node)
-            elif node.value == 'Control':
-                if node.type == 'IfElseControl':
-                    self._control_if(node)
-                elif node.type == 'ForControl':
-                    self._control_for(node)
-                elif node.type == 'WhileControl':
-                    self._control_while()
-                else:
-                    print ('control type not supported!')
-                    exit()
-            elif node.value == 'Expression':
-                self._expression(node)
-            # return
-            elif node.value == 'Return':
-                self._return(node)
-            else:
-                print ('sentenct type not supported yet！')
-                exit()
+        handler = self.handlers.get(node.value)
+        if handler:
+            return handler(node)
 
-    def traverse(self, node=None):
-        self._handler_block(node)
-        next_node = node.right
-        while next_node:
-            self._handler_block(next_node)
-            next_node = next_node.right
+    def _control(self, node=None):
+        handler = self.control_handlers.get(node.type)
+        if not handler:
+            print ('control type not supported!')
+            exit()
+        return handler(node)
 
+    def _sentence(self, node=None):
+        yield node.first_son
 
-def lexer():
-    lexer = Lexer()
-    lexer.main()
-    for token in lexer.tokens:
-        print (token.type, token.value)
+    def _handler_chain(self, node):
+        while node:
+            yield self._handler_block(node)
+            node = node.right
 
+    # node and its right brothers, with an explicit stack of the suspended
+    # handlers and sibling chains
+    def traverse(self, node=None):
+        stack = [self._handler_chain(node)]
+        while stack:
+            try:
+                task = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            if isinstance(task, SyntaxTreeNode):
+                stack.append(self._handler_chain(task))
+            elif isinstance(task, types.GeneratorType):
+                stack.append(task)
 
-def parser():
-    parser = Parser()
-    parser.main()
-    parser.display(parser.tree.root)
 
+# what is live at the start of the blocks, from what they use before they
+# define it and what they define
+def _live_in(blocks, uses, defines):
+    live = dict((block, set()) for block in blocks)
+    labels = dict((block.label, block) for block in blocks)
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            live_out = set()
+            for label in block.successors():
+                live_out |= live[labels[label]]
+            live_in = uses[block] | (live_out - defines[block])
+            if live_in != live[block]:
+                live[block] = live_in
+                changed = True
+    return live
 
-def assembler():
-    assem = Assembler()
-    assem.traverse(assem.tree.root)
-    assem.ass_file_handler.generate_ass_file()
 
-if __name__ == '__main__':
-    try:
-        opts, argvs = getopt.getopt(sys.argv[1:], 's:lpah', ['help'])
-    except:
-        print (__doc__)
-        exit()
+class ControlFlowGraph(object):
+    '''
+    the edges between the basic blocks of a function, from the jumps and
+    branches at the ends of them, the first block is the entry
+    '''
 
+    def __init__(self, function):
+        self.entry = function.blocks[0].label
+        self.blocks = {}
+        self.successors = {}
+        self.predecessors = {}
+        for block in function.blocks:
+            self.blocks[block.label] = block
+            self.successors[block.label] = block.successors()
+            self.predecessors[block.label] = []
+        for block in function.blocks:
+            for label in self.successors[block.label]:
+                self.predecessors[label].append(block.label)
+
+    # labels of the blocks reached from the entry
+    def reachable(self):
+        reached = set([self.entry])
+        stack = [self.entry]
+        while stack:
+            for label in self.successors[stack.pop()]:
+                if label not in reached:
+                    reached.add(label)
+                    stack.append(label)
+        return reached
+
+    # the loops keyed by their headers, the targets of the back edges found
+    # by a depth first search from the entry. a loop is made of its header
+    # and the blocks reaching a back edge to it without going through it.
+    # the headers found later in the search are the ones of the inner
+    # loops, they are done first and a loop reached by an outer one is
+    # added to it as a whole, the search goes on from its header
+    def loops(self):
+        tails = {}
+        visited = {self.entry: 0}
+        on_path = set([self.entry])
+        stack = [(self.entry, iter(self.successors[self.entry]))]
+        while stack:
+            label, successors = stack[-1]
+            for successor in successors:
+                if successor in on_path:
+                    tails.setdefault(successor, []).append(label)
+                elif successor not in visited:
+                    on_path.add(successor)
+                    visited[successor] = len(visited)
+                    stack.append((successor, iter(self.successors[successor])))
+                    break
+            else:
+                on_path.discard(label)
+                stack.pop()
+        bodies = {}
+        # the header of the outermost loop done around a block
+        outer = {}
+        for header in sorted(tails, key=visited.get, reverse=True):
+            body = bodies[header] = set([header])
+            work = list(tails[header])
+            while work:
+                label = work.pop()
+                path = []
+                while label in outer:
+                    path.append(label)
+                    label = outer[label]
+                for other in path:
+                    outer[other] = label
+                if label in body:
+                    continue
+                outer[label] = header
+                body.add(label)
+                if label in bodies:
+                    body.update(bodies[label])
+                    work.extend(other for other in self.predecessors[label]
+                                if other not in bodies[label])
+                else:
+                    work.extend(self.predecessors[label])
+        return bodies
+
+    # how many loops every block is in
+    def depths(self, bodies):
+        depths = dict((label, 0) for label in self.blocks)
+        for body in bodies.values():
+            for label in body:
+                depths[label] += 1
+        return depths
+
+
+class ControlFlowOptimizer(object):
+    '''
+    rewrites the control flow graphs of the IR between the builder and the
+    assembler. the branches of constants become jumps, the jumps to blocks
+    which only jump on are threaded to where those go, the blocks not
+    reached are removed, a block reached only by a jump is merged into the
+    block jumping to it, and the blocks are laid out in chains so that the
+    likely edges fall through. branches, threads, unreachable, merges and
+    moves count the rewrites
+    '''
+
+    def __init__(self):
+        self.branches = 0
+        self.threads = 0
+        self.unreachable = 0
+        self.merges = 0
+        self.moves = 0
+
+    def run(self, program):
+        for function in program.functions:
+            self._simplify(function)
+            self._thread(function)
+            self._remove_unreachable(function)
+            self._merge(function)
+            self._layout(function)
+        return program
+
+    def report(self):
+        return 'branches %d, threads %d, unreachable %d, merges %d, moves %d' % (
+            self.branches, self.threads, self.unreachable, self.merges, self.moves)
+
+    # a branch of constants, or with both labels the same, is a jump
+    def _simplify(self, function):
+        for block in function.blocks:
+            terminator = block.instructions[-1]
+            if terminator.opcode != 'branch':
+                continue
+            taken = _branch_taken(terminator)
+            if taken is None and terminator.operands[3] == terminator.operands[4]:
+                taken = terminator.operands[3]
+            if taken is not None:
+                block.instructions[-1] = IRInstruction('jump', [taken])
+                self.branches += 1
+
+    # where a jump to label ends up, through the blocks which only jump on
+    def _destination(self, blocks, label):
+        seen = set()
+        while label not in seen:
+            seen.add(label)
+            instructions = blocks[label].instructions
+            if len(instructions) != 1 or instructions[0].opcode != 'jump':
+                break
+            label = instructions[0].operands[0]
+        return label
+
+    def _thread(self, function):
+        blocks = dict((block.label, block) for block in function.blocks)
+        for block in function.blocks:
+            terminator = block.instructions[-1]
+            if terminator.opcode == 'jump':
+                positions = [0]
+            elif terminator.opcode == 'branch':
+                positions = [3, 4]
+            else:
+                continue
+            for position in positions:
+                label = terminator.operands[position]
+                destination = self._destination(blocks, label)
+                if destination != label:
+                    terminator.operands[position] = destination
+                    self.threads += 1
+            if terminator.opcode == 'jump':
+                # a jump to a return of a constant is the return
+                target = blocks[terminator.operands[0]].instructions
+                if len(target) == 1 and target[0].opcode == 'return' and (
+                        target[0].operands[0].__class__ is not VirtualRegister):
+                    block.instructions[-1] = IRInstruction('return', list(target[0].operands))
+                    self.threads += 1
+            elif terminator.operands[3] == terminator.operands[4]:
+                block.instructions[-1] = IRInstruction('jump', [terminator.operands[3]])
+                self.branches += 1
+
+    def _remove_unreachable(self, function):
+        reached = ControlFlowGraph(function).reachable()
+        blocks = [block for block in function.blocks if block.label in reached]
+        self.unreachable += len(function.blocks) - len(blocks)
+        function.blocks = blocks
+
+    def _merge(self, function):
+        graph = ControlFlowGraph(function)
+        merged = set()
+        for block in function.blocks:
+            if block.label in merged:
+                continue
+            while block.instructions[-1].opcode == 'jump':
+                label = block.instructions[-1].operands[0]
+                if label in (block.label, graph.entry) or len(graph.predecessors[label]) != 1:
+                    break
+                block.instructions[-1:] = graph.blocks[label].instructions
+                merged.add(label)
+                self.merges += 1
+        function.blocks = [block for block in function.blocks if block.label not in merged]
+
+    # the blocks are put in chains joined by their heaviest edges, an edge is
+    # weighed by how often its block runs and how likely it is taken
+    def _layout(self, function):
+        graph = ControlFlowGraph(function)
+        bodies = graph.loops()
+        depths = graph.depths(bodies)
+        order = dict((block.label, index) for index, block in enumerate(function.blocks))
+        edges = []
+        for block in function.blocks:
+            label = block.label
+            successors = graph.successors[label]
+            exits = [successor for successor in successors if depths[successor] < depths[label]]
+            for index, successor in enumerate(successors):
+                chance = 1.0 / len(successors)
+                if len(successors) == 2 and len(exits) == 1:
+                    chance = LOOP_EXIT_CHANCE if successor in exits else 1 - LOOP_EXIT_CHANCE
+                weight = LOOP_FREQUENCY ** min(depths[label], LOOP_DEPTH_LIMIT) * chance
+                # the back edges and then the edges in source order win a tie
+                back_edge = successor in bodies and label in bodies[successor]
+                edges.append((-weight, not back_edge,
+                              order[label], index, label, successor))
+        chains = dict((block.label, [block.label]) for block in function.blocks)
+        for edge in sorted(edges):
+            label, successor = edge[-2:]
+            head = chains[label]
+            tail = chains[successor]
+            if head is tail or head[-1] != label or tail[0] != successor:
+                continue
+            head.extend(tail)
+            for other in tail:
+                chains[other] = head
+        heads = sorted(set(chain[0] for chain in chains.values()), key=lambda label: order[label])
+        labels = [label for head in heads for label in chains[head]]
+        self.moves += sum(1 for index, label in enumerate(labels) if (
+            index and order[label] != order[labels[index - 1]] + 1))
+        function.blocks = [graph.blocks[label] for label in labels]
+
+
+class LoopVectorizer(object):
+    '''
+    SSE2 vectors of the loops of one block counting an int variable up by one
+    from a constant to a constant, which add the values of the items of
+    arrays at the variable to variables, or subtract them. the items may be
+    added, multiplied and so on with each other and with constants, which
+    are broadcast in front of the loop. a loop doing VECTOR_LANES iterations
+    at a time is put in front of the loop, which only does the iterations
+    left. the lanes of an int sum are added together and the ones of a
+    float sum one after another, in the order of the iterations. the arrays
+    read from an index multiple of VECTOR_LANES by all the loops are
+    aligned. loops and reductions count the rewrites
+    '''
+
+    def __init__(self):
+        self.program = None
+        self.loops = 0
+        self.reductions = 0
+
+    def run(self, program):
+        self.program = program
+        for function in program.functions:
+            graph = ControlFlowGraph(function)
+            for header, body in sorted(graph.loops().items()):
+                if len(body) == 1:
+                    self._loop(function, graph, graph.blocks[header])
+        return program
+
+    def report(self):
+        return 'loops %d, reductions %d' % (self.loops, self.reductions)
+
+    def _new_label(self):
+        label = 'label_' + str(self.program.label_cnt)
+        self.program.label_cnt += 1
+        return label
+
+    # the first value of the counter, stored by the block in front of the
+    # loop, None if it is not a constant
+    def _start(self, block, name):
+        for instruction in reversed(block.instructions):
+            if instruction.opcode == 'call':
+                return None
+            if instruction.opcode == 'store' and instruction.operands[0] == name:
+                value = instruction.operands[1]
+                return value if value.__class__ is int else None
+        return None
+
+    # the roles of the virtual registers of the loop keyed by them, or None
+    # when the loop is not vectorized. the counter is loaded for the
+    # indexes, incremented and loaded again for the test, the values of the
+    # items are vectors and the sums are loaded, updated and stored
+    def _roles(self, block, counter):
+        symbols = self.program.symbols
+        roles = {}
+        stored = set()
+        for instruction in block.instructions[:-1]:
+            opcode = instruction.opcode
+            operands = instruction.operands
+            kinds = [roles.get(operand, (None,))[0] for operand in operands]
+            target = instruction.target
+            if opcode == 'load' and operands[0] == counter:
+                roles[target] = ('test' if counter in stored else 'index',)
+            elif opcode == 'add' and kinds == ['index', None] and operands[1] == 1 and (
+                    operands[1].__class__ is int):
+                roles[target] = ('increment',)
+            elif opcode == 'store' and operands[0] == counter and kinds[1] == 'increment':
+                if counter in stored:
+                    return None
+                stored.add(counter)
+            elif opcode == 'load_item' and kinds[1] == 'index':
+                roles[target] = ('vector',)
+            elif opcode in ('add', 'sub', 'mul', 'div', 'itof') and 'vector' in kinds and all(
+                    kind == 'vector' or operand.__class__ in (int, float)
+                    for kind, operand in zip(kinds, operands)) and not (
+                    opcode == 'div' and instruction.type == 'int'):
+                roles[target] = ('vector',)
+            elif opcode == 'load' and symbols[operands[0]]['type'] == 'VARIABLE' and (
+                    operands[0] not in stored and not symbols[operands[0]].get('register')):
+                roles[target] = ('sum', operands[0])
+            elif opcode in ('add', 'sub') and sorted(kinds, key=str) == ['sum', 'vector'] and (
+                    opcode == 'add' or kinds[0] == 'sum'):
+                name = roles[operands[kinds.index('sum')]][1]
+                roles[target] = ('update', name)
+            elif opcode == 'store' and kinds[1] == 'update' and roles[operands[1]][1] == operands[0]:
+                if operands[0] in stored:
+                    return None
+                stored.add(operands[0])
+            else:
+                return None
+        if counter not in stored:
+            return None
+        return roles
+
+    def _loop(self, function, graph, block):
+        label = block.label
+        terminator = block.instructions[-1]
+        predecessors = [other for other in graph.predecessors[label] if other != label]
+        if len(predecessors) != 1 or terminator.opcode != 'branch' or (
+                terminator.type != 'int' or terminator.operands[0] not in ('<', '<=')):
+            return
+        operator, tested, bound, label_true, label_false = terminator.operands
+        if label_true != label or label_false == label or bound.__class__ is not int:
+            return
+        definition = [instruction for instruction in block.instructions
+                      if instruction.target is tested]
+        if not definition or definition[0].opcode != 'load':
+            return
+        counter = definition[0].operands[0]
+        start = self._start(graph.blocks[predecessors[0]], counter)
+        roles = self._roles(block, counter)
+        if start is None or roles is None or roles.get(tested) != ('test',):
+            return
+        # the loads and updates of the sums are used once by the update and
+        # the store, and nothing is used out of the loop
+        uses = dict((register, 0) for register in roles)
+        for other in function.blocks:
+            for instruction in other.instructions:
+                for register in instruction.registers():
+                    if register in uses:
+                        if other is not block:
+                            return
+                        uses[register] += 1
+        for register, role in roles.items():
+            if role[0] in ('sum', 'update', 'increment', 'test') and uses[register] != 1:
+                return
+        end = bound + 1 if operator == '<=' else bound
+        count = (end - start) // VECTOR_LANES * VECTOR_LANES
+        if count <= 0:
+            return
+        vector = BasicBlock(self._new_label())
+        self._vectorize(
+            function, block, vector, graph.blocks[predecessors[0]], counter, start, roles)
+        following = function.new_register('int')
+        instructions = vector.instructions
+        instructions.append(IRInstruction('add', [instructions[0].target, VECTOR_LANES], following))
+        instructions.append(IRInstruction('store', [counter, following]))
+        # the loop is left for the iterations left, or after it
+        after = label if end - start > count else label_false
+        instructions.append(IRInstruction('branch', [
+            '<', following, start + count, vector.label, after]))
+        operands = graph.blocks[predecessors[0]].instructions[-1].operands
+        for index, operand in enumerate(operands):
+            if operand == label:
+                operands[index] = vector.label
+        blocks = []
+        for other in function.blocks:
+            if other is block:
+                blocks.append(vector)
+                if after != label:
+                    continue
+            blocks.append(other)
+        function.blocks = blocks
+        self.loops += 1
+
+    # the vector instructions of the loop in the new block, the constants are
+    # broadcast by the block in front of the loop. the counter starts at start
+    def _vectorize(self, function, block, vector, front, counter, start, roles):
+        index = function.new_register('int')
+        vector.instructions.append(IRInstruction('load', [counter], index))
+        vectors = {}
+        items = {}
+        constants = {}
+        for instruction in block.instructions[:-1]:
+            opcode = instruction.opcode
+            operands = instruction.operands
+            role = roles.get(instruction.target)
+            if role == ('vector',) and opcode == 'load_item':
+                name = operands[0]
+                if name not in items:
+                    _type = VECTOR_TYPES[instruction.type]
+                    items[name] = function.new_register(_type)
+                    vector.instructions.append(
+                        IRInstruction('load_vector', [name, index], items[name], _type))
+                    symbol = self.program.symbols[name]
+                    aligned = start % VECTOR_LANES == 0 and symbol.get('aligned', True)
+                    self.program.declare(name, dict(symbol, aligned=aligned))
+                vectors[instruction.target] = items[name]
+            elif role == ('vector',):
+                _type = VECTOR_TYPES[instruction.type]
+                for operand in operands:
+                    if operand not in vectors and (operand, _type) not in constants:
+                        constants[operand, _type] = function.new_register(_type)
+                        front.instructions.insert(-1, IRInstruction(
+                            'broadcast', [operand], constants[operand, _type], _type))
+                target = function.new_register(_type)
+                vector.instructions.append(IRInstruction(opcode, [
+                    vectors[operand] if operand in vectors else constants[operand, _type]
+                    for operand in operands], target, _type))
+                vectors[instruction.target] = target
+            elif role is not None and role[0] == 'update':
+                self._reduce(function, vector, instruction, roles, vectors)
+
+    # the lanes of the vector added to the sum, or subtracted from it
+    def _reduce(self, function, vector, instruction, roles, vectors):
+        name = roles[instruction.target][1]
+        _type = instruction.type
+        operands = instruction.operands
+        value = [operand for operand in operands if operand in vectors][0]
+        if _type == 'int':
+            lanes = [function.new_register(_type)]
+            vector.instructions.append(IRInstruction('sum', [vectors[value]], lanes[0], _type))
+        else:
+            lanes = []
+            for lane in range(VECTOR_LANES):
+                lanes.append(function.new_register(_type))
+                vector.instructions.append(
+                    IRInstruction('lane', [vectors[value], lane], lanes[-1], _type))
+        for lane in lanes:
+            total = function.new_register(_type)
+            vector.instructions.append(IRInstruction('load', [name], total, _type))
+            result = function.new_register(_type)
+            vector.instructions.append(IRInstruction(instruction.opcode, [
+                lane if operand is value else total for operand in operands], result, _type))
+            vector.instructions.append(IRInstruction('store', [name, result], None, _type))
+        self.reductions += 1
+
+
+class LoopOptimizer(object):
+    '''
+    moves work of the loops of the IR out of them, the inner loops first.
+    the int variables a loop reads and writes most are promoted to register
+    variables, which are copied in before the loop and back out on the
+    edges leaving it, and the int variables and the items at constant
+    indexes the loop reads most and does not write are loaded once in front
+    of it. promotions and hoists count the rewrites
+    '''
+
+    def __init__(self):
+        self.program = None
+        self.promotions = 0
+        self.hoists = 0
+        # the state of the function being optimized
+        self.graph = None
+        self.bodies = None
+        self.parents = None
+        self.children = None
+        self.innermost = None
+        self.order = None
+        self.uses = None
+        self.summaries = None
+        self.before = None
+        self.after = None
+
+    def run(self, program):
+        self.program = program
+        for function in program.functions:
+            # the graph and the loops are found once, the blocks put in front
+            # of and after a loop are added to the innermost loop around
+            # them by _insert
+            self.graph = ControlFlowGraph(function)
+            self.bodies = self.graph.loops()
+            headers = sorted(self.bodies, key=lambda header: (len(self.bodies[header]), header))
+            # the loops right around and in every loop, a loop is in another
+            # when its header is
+            self.parents = {}
+            self.children = {}
+            roots = []
+            for header in headers:
+                body = self.bodies[header]
+                self.children[header] = [root for root in roots if root in body]
+                for child in self.children[header]:
+                    self.parents[child] = header
+                roots = [root for root in roots if root not in body] + [header]
+            self.innermost = {}
+            self.order = dict((block.label, index) for index, block in enumerate(function.blocks))
+            # the instructions reading every virtual register
+            self.uses = {}
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    for register in instruction.registers():
+                        self.uses.setdefault(register, []).append(instruction)
+            self.summaries = {}
+            self.before = {}
+            self.after = {}
+            for header in headers:
+                self._loop(function, header)
+            self._place(function)
+        return program
+
+    def report(self):
+        return 'promotions %d, hoists %d' % (self.promotions, self.hoists)
+
+    def _new_label(self):
+        label = 'label_' + str(self.program.label_cnt)
+        self.program.label_cnt += 1
+        return label
+
+    # load name to a new virtual register and store it to other
+    def _copy(self, function, name, other):
+        value = function.new_register('int')
+        store = IRInstruction('store', [other, value], None)
+        self.uses[value] = [store]
+        return [IRInstruction('load', [name], value), store]
+
+    # whether the block of label is in the loop of header, the blocks added
+    # to a loop are only in the body of the innermost one
+    def _inside(self, label, header):
+        if label in self.bodies[header]:
+            return True
+        loop = self.innermost.get(label)
+        while loop is not None and loop != header:
+            loop = self.parents.get(loop)
+        return loop is not None
+
+    # block is put on the edges from the labels of predecessors to successor,
+    # it is in the innermost loop around the loop of header which has both
+    # ends of one of the edges, and in the ones around that
+    def _insert(self, header, block, predecessors, successor):
+        graph = self.graph
+        label = block.label
+        graph.blocks[label] = block
+        graph.successors[label] = [successor]
+        graph.predecessors[label] = list(predecessors)
+        graph.predecessors[successor] = [other for other in graph.predecessors[successor]
+                                         if other not in predecessors] + [label]
+        for other in predecessors:
+            graph.successors[other] = [label if other_successor == successor else other_successor
+                                       for other_successor in graph.successors[other]]
+        self.order[label] = len(self.order)
+        loop = self.parents.get(header)
+        while loop is not None and not (self._inside(successor, loop) and any(
+                self._inside(other, loop) for other in predecessors)):
+            loop = self.parents.get(loop)
+        if loop is not None:
+            self.bodies[loop].add(label)
+            self.innermost[label] = loop
+
+    # the int loads of the loop keyed by the variable, or by the array and
+    # the index, as blocks and instructions, the stores keyed by the
+    # variable or the array, the variables whose address is taken, the
+    # blocks returning and the edges leaving the loop. the summaries of the
+    # loops in it are taken, the largest one is added to, and only the
+    # other blocks are gone through. the register variables are left out,
+    # the loops which read them write them
+    def _summary(self, header):
+        body = self.bodies[header]
+        children = sorted(self.children[header], key=lambda child: -len(self.bodies[child]))
+        if children:
+            loads, stores, addressed, returns, exits = self.summaries.pop(children[0])
+        else:
+            loads, stores, addressed, returns, exits = {}, {}, set(), [], []
+        for child in children[1:]:
+            other_loads, other_stores, other_addressed, other_returns, other_exits = (
+                self.summaries.pop(child))
+            for key, entries in other_loads.items():
+                loads.setdefault(key, []).extend(entries)
+            for key, entries in other_stores.items():
+                stores.setdefault(key, []).extend(entries)
+            addressed.update(other_addressed)
+            returns.extend(other_returns)
+            exits.extend(other_exits)
+        exits = [(block, label) for block, label in exits if not self._inside(label, header)]
+        symbols = self.program.symbols
+        labels = body.difference(*[self.bodies[child] for child in children])
+        for label in sorted(labels, key=self.order.get):
+            block = self.graph.blocks[label]
+            for instruction in block.instructions:
+                opcode = instruction.opcode
+                operands = instruction.operands
+                if opcode == 'return':
+                    returns.append(block)
+                elif opcode in ('store', 'store_item'):
+                    if not symbols[operands[0]].get('register'):
+                        stores.setdefault(operands[0], []).append(instruction)
+                elif opcode == 'addr':
+                    addressed.add(operands[0])
+                elif instruction.type != 'int':
+                    continue
+                elif opcode == 'load' and not symbols[operands[0]].get('register'):
+                    loads.setdefault(operands[0], []).append((block, instruction))
+                elif opcode == 'load_item' and operands[1].__class__ is not VirtualRegister:
+                    loads.setdefault(tuple(operands), []).append((block, instruction))
+            for successor in sorted(set(block.successors())):
+                if not self._inside(successor, header):
+                    exits.append((block, successor))
+        return loads, stores, addressed, returns, exits
+
+    def _loop(self, function, header):
+        loads, stores, addressed, returns, exits = summary = self._summary(header)
+        self.summaries[header] = summary
+        symbols = self.program.symbols
+        promoted = sorted(
+            [key for key in loads if key.__class__ is str and key in stores and (
+                key not in addressed)],
+            key=lambda key: (-len(loads[key]), key))[:len(LOOP_REGISTERS)]
+        written = addressed.union(stores)
+        hoisted = sorted(
+            [key for key in loads if (key if key.__class__ is str else key[0]) not in written],
+            key=lambda key: (-len(loads[key]), str(key)))[:LOOP_HOISTS]
+        if not promoted and not hoisted:
+            return
+        preheader = BasicBlock(self._new_label())
+        removed = {}
+        for key in hoisted:
+            entries = loads.pop(key)
+            first = entries[0][1]
+            preheader.instructions.append(
+                IRInstruction(first.opcode, list(first.operands), first.target))
+            for block, instruction in entries:
+                removed.setdefault(block, set()).add(instruction)
+                if instruction.target is not first.target:
+                    self._rename(instruction.target, first.target)
+            self.hoists += 1
+        for block, instructions in removed.items():
+            block.instructions = [instruction for instruction in block.instructions
+                                  if instruction not in instructions]
+        variables = {}
+        for name in promoted:
+            variable = '%s.%d' % (name, self.promotions)
+            self.program.declare(variable, {
+                'type': 'VARIABLE', 'field_type': 'int', 'register': True})
+            variables[name] = variable
+            preheader.instructions.extend(self._copy(function, name, variable))
+            for block, instruction in loads.pop(name):
+                instruction.operands[0] = variable
+            for instruction in stores.pop(name):
+                instruction.operands[0] = variable
+            self.promotions += 1
+        for block in returns:
+            copies = []
+            for name in promoted:
+                copies.extend(self._copy(function, variables[name], name))
+                stores.setdefault(name, []).append(copies[-1])
+            block.instructions[-1:-1] = copies
+        preheader.instructions.append(IRInstruction('jump', [header]))
+        # the edges into the loop go through the preheader, and the edges
+        # out of it through blocks copying the variables back
+        entering = [label for label in self.graph.predecessors[header]
+                    if not self._inside(label, header)]
+        for label in entering:
+            self._redirect(self.graph.blocks[label], header, preheader.label)
+        self._insert(header, preheader, entering, header)
+        self.before[header] = preheader
+        if promoted:
+            after = {}
+            for block, label in exits:
+                exit_block = BasicBlock(self._new_label())
+                for name in promoted:
+                    exit_block.instructions.extend(self._copy(function, variables[name], name))
+                exit_block.instructions.append(IRInstruction('jump', [label]))
+                self._redirect(block, label, exit_block.label)
+                self._insert(header, exit_block, [block.label], label)
+                after.setdefault(block.label, []).append(exit_block)
+            # the blocks after a block leaving an inner loop follow these
+            for label, blocks in after.items():
+                self.after[label] = blocks + self.after.get(label, [])
+            del exits[:]
+
+    # the instructions reading register read other in place of it
+    def _rename(self, register, other):
+        for instruction in self.uses.pop(register, []):
+            operands = instruction.operands
+            for index, operand in enumerate(operands):
+                if operand is register:
+                    operands[index] = other
+            self.uses.setdefault(other, []).append(instruction)
+
+    # the preheaders go in front of the headers, the blocks after a block
+    # follow it
+    def _place(self, function):
+        blocks = []
+        stack = function.blocks[::-1]
+        while stack:
+            block = stack.pop()
+            preheader = self.before.pop(block.label, None)
+            if preheader is not None:
+                stack.extend([block, preheader])
+                continue
+            blocks.append(block)
+            stack.extend(self.after.get(block.label, [])[::-1])
+        function.blocks = blocks
+
+    # the jump or branch at the end of block goes to other in place of label
+    def _redirect(self, block, label, other):
+        operands = block.instructions[-1].operands
+        for index, operand in enumerate(operands):
+            if operand == label:
+                operands[index] = other
+
+
+class ValueNumbering(object):
+    '''
+    common subexpressions in the basic blocks. a value is numbered by the
+    instruction making it and the numbers of its operands, an instruction
+    making a value the block already has is removed and its uses take the
+    first one. a load after a store of the variable takes the stored value,
+    a store forgets the loads of its variable or array and a call the loads
+    of the variables whose address is taken. the loads of the register
+    variables stay, they only get the numbers of the values. the float
+    values are numbered only when floats, a float used again does not stay
+    on the x87 stack. loads, expressions and forwards count the removals
+    '''
+
+    def __init__(self, floats=True):
+        self.program = None
+        self.floats = floats
+        self.loads = 0
+        self.expressions = 0
+        self.forwards = 0
+
+    def run(self, program):
+        self.program = program
+        addressed = set()
+        for function in program.functions:
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    if instruction.opcode == 'addr':
+                        addressed.add(instruction.operands[0])
+        for function in program.functions:
+            # the removed registers and the ones their uses take
+            renames = {}
+            for block in function.blocks:
+                self._block(block, renames, addressed)
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    self._rename(instruction, renames)
+        return program
+
+    def report(self):
+        return 'loads %d, expressions %d, forwards %d' % (
+            self.loads, self.expressions, self.forwards)
+
+    def _rename(self, instruction, renames):
+        operands = instruction.operands
+        for index, operand in enumerate(operands):
+            if operand.__class__ is VirtualRegister and operand in renames:
+                operands[index] = renames[operand]
+
+    # the names and the constants are numbered by themselves
+    def _number(self, operand, numbers):
+        if operand.__class__ is VirtualRegister:
+            return numbers.get(operand, operand)
+        return (operand.__class__, operand)
+
+    def _block(self, block, renames, addressed):
+        symbols = self.program.symbols
+        # the numbers of the loads of the register variables, the registers
+        # of the numbered values, and the values which were stored
+        numbers = {}
+        values = {}
+        stored = set()
+        instructions = []
+        for instruction in block.instructions:
+            self._rename(instruction, renames)
+            opcode = instruction.opcode
+            operands = instruction.operands
+            if opcode in ('store', 'store_item', 'call'):
+                name = operands[0]
+                index = self._number(operands[1], numbers) if opcode == 'store_item' else None
+                for key in list(values):
+                    if key[0] not in ('load', 'load_item'):
+                        continue
+                    if opcode == 'call' and key[2][1] in addressed or opcode == 'store' and (
+                            key[0] == 'load' and key[2][1] == name) or opcode == 'store_item' and (
+                            key[0] == 'load_item' and key[2][1] == name and not (
+                                key[3].__class__ is tuple and index.__class__ is tuple and key[3] != index)):
+                        del values[key]
+                value = operands[-1]
+                if opcode != 'call' and value.__class__ is VirtualRegister and (
+                        instruction.type == 'int' or self.floats):
+                    key = ('load' if opcode == 'store' else 'load_item', instruction.type,
+                           self._number(name, numbers)) + ((index,) if index is not None else ())
+                    values[key] = value
+                    stored.add(key)
+                instructions.append(instruction)
+                continue
+            if opcode not in ('load', 'load_item', 'add', 'sub', 'mul', 'div', 'itof', 'ftoi') or (
+                    instruction.type == 'float' and not self.floats):
+                instructions.append(instruction)
+                continue
+            key = [self._number(operand, numbers) for operand in operands]
+            if opcode in ('add', 'mul'):
+                key.sort(key=repr)
+            key = (opcode, instruction.type) + tuple(key)
+            if opcode == 'load' and symbols[operands[0]].get('register'):
+                # reading the register is cheaper than keeping the value
+                if key in values:
+                    numbers[instruction.target] = self._number(values[key], numbers)
+                else:
+                    values[key] = instruction.target
+                instructions.append(instruction)
+                continue
+            if key not in values:
+                values[key] = instruction.target
+                instructions.append(instruction)
+                continue
+            renames[instruction.target] = values[key]
+            if key in stored:
+                self.forwards += 1
+            elif opcode in ('load', 'load_item'):
+                self.loads += 1
+            else:
+                self.expressions += 1
+        block.instructions = instructions
+
+
+class ProgramCleaner(object):
+    '''
+    removes what the program does not need from the IR. the strings with
+    the same text are pooled into the first of them, the stores to the
+    variables which are stored again or the program ends before they are
+    read are removed with the instructions making the values only they
+    used, and the variables, arrays and strings left without uses are not
+    declared. strings, stores, instructions and symbols count the removals
+    '''
+
+    def __init__(self):
+        self.program = None
+        self.strings = 0
+        self.stores = 0
+        self.instructions = 0
+        self.symbols = 0
+
+    def run(self, program):
+        self.program = program
+        self._pool()
+        addressed = set()
+        loaded = set()
+        for function in program.functions:
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    if instruction.opcode == 'addr':
+                        addressed.add(instruction.operands[0])
+                    elif instruction.opcode in ('load', 'load_item', 'load_vector'):
+                        loaded.add(instruction.operands[0])
+        changed = True
+        while changed:
+            changed = False
+            for function in program.functions:
+                if self._dead_stores(function, addressed, loaded):
+                    changed = True
+                if self._dead_instructions(function):
+                    changed = True
+        self._prune()
+        return program
+
+    def report(self):
+        return 'strings %d, stores %d, instructions %d, symbols %d' % (
+            self.strings, self.stores, self.instructions, self.symbols)
+
+    def _pool(self):
+        symbols = self.program.symbols
+        labels = {}
+        pooled = {}
+        for name in self.program.names:
+            symbol = symbols[name]
+            if symbol['type'] == 'STRING_CONSTANT':
+                pooled[name] = labels.setdefault(symbol['value'], name)
+                if pooled[name] != name:
+                    self.strings += 1
+        for function in self.program.functions:
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    if instruction.opcode == 'addr' and instruction.operands[0] in pooled:
+                        instruction.operands[0] = pooled[instruction.operands[0]]
+
+    # the stores not read, an array is read when it is loaded or its address
+    # is taken anywhere. the program ends at the return of main, the other
+    # functions return to where the variables may be read
+    def _dead_stores(self, function, addressed, loaded):
+        symbols = self.program.symbols
+        variables = set(name for name in self.program.names if (
+            symbols[name]['type'] == 'VARIABLE' and name not in addressed))
+        uses = {}
+        defines = {}
+        for block in function.blocks:
+            uses[block] = set()
+            defines[block] = set()
+            for instruction in block.instructions:
+                if instruction.opcode == 'load' and instruction.operands[0] not in defines[block]:
+                    uses[block].add(instruction.operands[0])
+                elif instruction.opcode == 'store':
+                    defines[block].add(instruction.operands[0])
+                elif instruction.opcode == 'return' and function.name != 'main':
+                    uses[block] |= variables - defines[block]
+        live = _live_in(function.blocks, uses, defines)
+        labels = dict((block.label, block) for block in function.blocks)
+        removed = False
+        for block in function.blocks:
+            live_out = set()
+            for label in block.successors():
+                live_out |= live[labels[label]]
+            if block.instructions[-1].opcode == 'return' and function.name != 'main':
+                live_out = set(variables)
+            instructions = []
+            for instruction in reversed(block.instructions):
+                opcode = instruction.opcode
+                name = instruction.operands[0] if instruction.operands else None
+                if opcode == 'store' and name in variables and name not in live_out or (
+                        opcode == 'store_item' and name not in loaded | addressed):
+                    self.stores += 1
+                    removed = True
+                    continue
+                if opcode == 'store':
+                    live_out.discard(name)
+                elif opcode == 'load':
+                    live_out.add(name)
+                instructions.append(instruction)
+            instructions.reverse()
+            block.instructions = instructions
+        return removed
+
+    # the instructions whose targets are not used
+    def _dead_instructions(self, function):
+        removed = False
+        while True:
+            used = set()
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    used.update(instruction.registers())
+            count = self.instructions
+            for block in function.blocks:
+                instructions = [instruction for instruction in block.instructions
+                                if instruction.target is None or instruction.target in used]
+                self.instructions += len(block.instructions) - len(instructions)
+                block.instructions = instructions
+            if count == self.instructions:
+                return removed
+            removed = True
+
+    def _prune(self):
+        referenced = set()
+        for function in self.program.functions:
+            for block in function.blocks:
+                for instruction in block.instructions:
+                    if instruction.opcode in (
+                            'load', 'store', 'load_item', 'store_item', 'addr', 'load_vector'):
+                        referenced.add(instruction.operands[0])
+        for name in self.program.names:
+            if name not in referenced:
+                del self.program.symbols[name]
+                self.symbols += 1
+        self.program.names = [name for name in self.program.names if name in referenced]
+
+
+class AssemblerFileHandler(object):
+    '''
+    lines of the assembler file, every section is appended to on its own
+    and they are put together in generate_ass_file, when streaming the .text
+    lines are written to the file as they come and the .data and .bss
+    sections are put after them, the .text lines go through the peephole
+    optimizer if there is one
+    '''
+
+    def __init__(self, stream=False, peephole=None):
+        self.sections = {'DATA': ['.data'], 'BSS': ['.bss'], 'TEXT': ['.text']}
+        self.file = None
+        self.peephole = peephole
+        # number of the streamed .text lines
+        self.streamed = 0
+        # instructions streamed by the peephole optimizer later, the last
+        # PEEPHOLE_WINDOW of them are kept for the rules looking back
+        self.pending = []
+        if stream:
+            self.file = open(file_name + '.S', 'w')
+            self._write(self.sections['TEXT'])
+            self.streamed = len(self.sections['TEXT'])
+            self.sections['TEXT'] = None
+
+    def __len__(self):
+        return self.streamed + len(self.pending) + sum(
+            len(lines) for lines in self.sections.values() if lines)
+
+    def _write(self, lines):
+        for line in lines:
+            self.file.write(line + '\n')
+
+    def _stream(self, instructions):
+        self._write([instruction.line for instruction in instructions])
+        self.streamed += len(instructions)
+
+    def insert(self, value, _type):
+        if _type == 'TEXT' and self.file:
+            if not self.peephole:
+                self.file.write(value + '\n')
+                self.streamed += 1
+                return
+            self.pending.append(Instruction(value))
+            if len(self.pending) >= 2 * PEEPHOLE_WINDOW:
+                pending = self.peephole.run(self.pending, False)
+                self._stream(pending[:-PEEPHOLE_WINDOW])
+                self.pending = pending[-PEEPHOLE_WINDOW:]
+            return
+        lines = self.sections.get(_type)
+        if lines is None:
+            print ('error!')
+            exit()
+        lines.append(value)
+
+    def generate_ass_file(self):
+        if self.peephole:
+            if self.file:
+                self._stream(self.peephole.run(self.pending))
+                self.pending = []
+            else:
+                self.sections['TEXT'] = [instruction.line for instruction in self.peephole.run(
+                    [Instruction(line) for line in self.sections['TEXT']])]
+        if not self.file:
+            self.file = open(file_name + '.S', 'w+')
+        # the .text section is None when it is streamed, the assembler takes
+        # the sections in any order
+        for _type in ['DATA', 'BSS', 'TEXT']:
+            if self.sections[_type] is not None:
+                self._write(self.sections[_type])
+        self.file.close()
+
+    # the relocatable object of the sections instead of the assembler file,
+    # the .text lines go through the peephole optimizer like theirs, extra
+    # lines are put after them
+    def object_file(self, long_mode=False, text=(), bss=()):
+        if self.peephole:
+            self.sections['TEXT'] = [instruction.line for instruction in self.peephole.run(
+                [Instruction(line) for line in self.sections['TEXT']])]
+        elf_object = ElfObject(long_mode)
+        elf_object.assemble({'DATA': self.sections['DATA'],
+                             'BSS': self.sections['BSS'] + list(bss),
+                             'TEXT': self.sections['TEXT'] + list(text)})
+        return elf_object
+
+    def generate_object_file(self, long_mode=False):
+        self.object_file(long_mode).write(file_name + '.o')
+
+
+# the label and the offset of a displacement like label+8 or -12
+DISPLACEMENT_PATTERN = re.compile(r'^([A-Za-z_.][\w.]*)?([+-]?(?:0x[0-9a-fA-F]+|\d+))?$')
+
+
+class MachineCode(object):
+    '''
+    the machine code of the .text instructions of the assembler, for the x86
+    or the x86-64 processor. an instruction is encoded to its bytes and the
+    relocations of the labels in them, (position, label, addend, kind) with
+    the kind absolute, relative to the next instruction or call. the
+    shortest forms are taken, like the system assembler does
+    '''
+
+    def __init__(self, long_mode=False):
+        self.long_mode = long_mode
+        # the general purpose instructions by their names without the size
+        self.handlers = {
+            'mov': self._mov, 'lea': self._lea, 'test': self._test,
+            'push': self._push, 'pop': self._pop, 'imul': self._imul}
+        for name in ARITHMETIC_OPCODES:
+            self.handlers[name] = self._arithmetic
+        for name in UNARY_OPCODES:
+            self.handlers.setdefault(name, self._unary)
+        for name in SHIFT_OPCODES:
+            self.handlers[name] = self._shift
+
+    # the bytes and the relocations of an instruction, the jumps are encoded
+    # by the object when their targets are known
+    def encode(self, instruction):
+        opcode = instruction.opcode
+        key = tuple([opcode] + instruction.operands)
+        if key in X87_BYTES:
+            return bytearray(X87_BYTES[key]), []
+        operands = [self._operand(operand) for operand in instruction.operands]
+        if opcode in X87_OPCODES:
+            byte, digit = X87_OPCODES[opcode]
+            return self._encode([byte], digit, operands[0])
+        if opcode in SSE_OPCODES:
+            return self._sse(opcode, operands)
+        if opcode == 'cltd':
+            return bytearray([0x99]), []
+        if opcode == 'ret':
+            return bytearray([0xc3]), []
+        if opcode == 'call':
+            return bytearray([0xe8, 0, 0, 0, 0]), [(1, instruction.operands[0], -4, 'call')]
+        name = opcode
+        if opcode[-1] in 'lq' and opcode[:-1] in self.handlers:
+            name = opcode[:-1]
+        if name not in self.handlers:
+            print ('unknown instruction: ' + instruction.line)
+            exit()
+        wide = name != opcode and opcode[-1] == 'q' and name not in ('push', 'pop')
+        return self.handlers[name](name, operands, wide)
+
+    # ('register', number, name), ('immediate', value, label) or ('memory',
+    # base, index, scale, offset, label), the base is 'rip' for %rip
+    def _operand(self, operand):
+        if operand.startswith('%'):
+            return ('register', self._register(operand), operand)
+        if operand.startswith('$'):
+            label, offset = self._displacement(operand[1:])
+            return ('immediate', offset, label)
+        start = operand.find('(')
+        label, offset = self._displacement(operand if start < 0 else operand[:start])
+        base = index = None
+        scale = 1
+        if start >= 0:
+            parts = [part.strip() for part in operand[start + 1:-1].split(',')]
+            if parts[0] == '%rip':
+                base = 'rip'
+            elif parts[0]:
+                base = self._register(parts[0])
+            if len(parts) > 1:
+                index = self._register(parts[1])
+                scale = int(parts[2]) if len(parts) > 2 else 1
+        return ('memory', base, index, scale, offset, label)
+
+    def _register(self, name):
+        if name not in MACHINE_REGISTERS:
+            print ('unknown register: ' + name)
+            exit()
+        return MACHINE_REGISTERS[name]
+
+    def _displacement(self, text):
+        match = DISPLACEMENT_PATTERN.match(text.strip())
+        if match is None:
+            print ('unknown operand: ' + text)
+            exit()
+        return match.group(1), int(match.group(2) or '0', 0)
+
+    # an immediate of 8 bits
+    @staticmethod
+    def _short(operand):
+        return operand[2] is None and -128 <= operand[1] < 128
+
+    # the ModRM byte, the SIB byte and the displacement of the r/m operand,
+    # the REX bits of it and the relocations
+    def _address(self, reg, operand):
+        rex = (reg >> 3) << 2
+        if operand[0] == 'register':
+            number = operand[1]
+            return bytearray([0xc0 | (reg & 7) << 3 | number & 7]), rex | number >> 3, []
+        base, index, scale, offset, label = operand[1:]
+        code = bytearray()
+        relocations = []
+        if base == 'rip':
+            code.append((reg & 7) << 3 | 5)
+        else:
+            # a label, or no base, takes a displacement of 32 bits
+            if label is not None or base is None:
+                mod = 0 if base is None else 2
+            elif offset == 0 and base & 7 != 5:
+                mod = 0
+            else:
+                mod = 1 if -128 <= offset < 128 else 2
+            if index is None and base is not None and base & 7 != 4:
+                code.append(mod << 6 | (reg & 7) << 3 | base & 7)
+                rex |= base >> 3
+            elif index is None and base is None and not self.long_mode:
+                code.append((reg & 7) << 3 | 5)
+            else:
+                # the SIB byte, the index 4 is none and the base 5 of mod 0
+                # is a displacement
+                code.append(mod << 6 | (reg & 7) << 3 | 4)
+                code.append({1: 0, 2: 1, 4: 2, 8: 3}[scale] << 6 |
+                            (4 if index is None else index & 7) << 3 |
+                            (5 if base is None else base & 7))
+                if index is not None:
+                    rex |= (index >> 3) << 1
+                if base is not None:
+                    rex |= base >> 3
+            if mod == 1:
+                code += struct.pack('<b', offset)
+                return code, rex, relocations
+            if mod == 0 and base is not None:
+                return code, rex, relocations
+        if label is not None:
+            relocations.append((len(code), label, offset,
+                                'relative' if base == 'rip' else 'absolute'))
+            offset = 0
+        code += struct.pack('<i', offset)
+        return code, rex, relocations
+
+    # prefix, REX, opcodes, the r/m operand and the immediate, the relative
+    # displacements are from the end of the instruction
+    def _encode(self, opcodes, reg, operand, prefix=None, wide=False, immediate=None):
+        address, rex, relocations = self._address(reg, operand)
+        code = bytearray()
+        if prefix is not None:
+            code.append(prefix)
+        if rex or wide:
+            code.append(0x40 | rex | (8 if wide else 0))
+        code += bytearray(opcodes)
+        relocations = [(len(code) + position, label, addend, kind)
+                       for position, label, addend, kind in relocations]
+        code += address
+        if immediate is not None:
+            code += self._immediate(immediate, relocations, len(code))
+        return code, [(position, label, addend - (len(code) - position), kind)
+                      if kind == 'relative' else (position, label, addend, kind)
+                      for position, label, addend, kind in relocations]
+
+    # the bytes of an immediate of size bytes, a label is an absolute
+    # relocation at position
+    def _immediate(self, immediate, relocations, position):
+        value, label, size = immediate
+        if label is not None:
+            relocations.append((position, label, value, 'absolute'))
+            return bytearray(4)
+        if size == 1:
+            return bytearray([value & 0xff])
+        return bytearray(struct.pack('<I', value & 0xffffffff))
+
+    # an opcode with the low bits of the register in it
+    def _short_register(self, opcode, number, immediate=None):
+        code = bytearray([0x41]) if number >> 3 else bytearray()
+        code.append(opcode | number & 7)
+        relocations = []
+        if immediate is not None:
+            code += self._immediate(immediate, relocations, len(code))
+        return code, relocations
+
+    def _arithmetic(self, name, operands, wide):
+        digit, store, load, accumulator = ARITHMETIC_OPCODES[name]
+        source, target = operands
+        if source[0] == 'immediate':
+            if self._short(source):
+                return self._encode([0x83], digit, target, wide=wide, immediate=source[1:] + (1,))
+            if target[:2] == ('register', 0):
+                code = bytearray([0x48]) if wide else bytearray()
+                code.append(accumulator)
+                relocations = []
+                code += self._immediate(source[1:] + (4,), relocations, len(code))
+                return code, relocations
+            return self._encode([0x81], digit, target, wide=wide, immediate=source[1:] + (4,))
+        if source[0] == 'register':
+            return self._encode([store], source[1], target, wide=wide)
+        return self._encode([load], target[1], source, wide=wide)
+
+    def _unary(self, name, operands, wide):
+        byte, digit = UNARY_OPCODES[name]
+        target = operands[0]
+        # inc and dec of a register are one byte out of the 64 bit mode
+        if byte == 0xff and target[0] == 'register' and not self.long_mode:
+            return bytearray([0x40 | digit << 3 | target[1]]), []
+        return self._encode([byte], digit, target, wide=wide)
+
+    def _shift(self, name, operands, wide):
+        count, target = operands
+        if count[1] == 1:
+            return self._encode([0xd1], SHIFT_OPCODES[name], target, wide=wide)
+        return self._encode([0xc1], SHIFT_OPCODES[name], target, wide=wide,
+                            immediate=count[1:] + (1,))
+
+    def _imul(self, name, operands, wide):
+        if len(operands) == 1:
+            return self._unary(name, operands, wide)
+        if len(operands) == 2:
+            return self._encode([0x0f, 0xaf], operands[1][1], operands[0], wide=wide)
+        constant, source, target = operands
+        if self._short(constant):
+            return self._encode([0x6b], target[1], source, wide=wide, immediate=constant[1:] + (1,))
+        return self._encode([0x69], target[1], source, wide=wide, immediate=constant[1:] + (4,))
+
+    def _mov(self, name, operands, wide):
+        source, target = operands
+        if source[0] == 'immediate':
+            if target[0] == 'register' and not wide:
+                return self._short_register(0xb8, target[1], immediate=source[1:] + (4,))
+            return self._encode([0xc7], 0, target, wide=wide, immediate=source[1:] + (4,))
+        # %eax is moved to and from a label without a ModRM byte
+        for register, memory, opcode in [(source, target, 0xa3), (target, source, 0xa1)]:
+            if not self.long_mode and register[:2] == ('register', 0) and (
+                    memory[0] == 'memory' and memory[1] is None and memory[2] is None):
+                return bytearray([opcode, 0, 0, 0, 0]), [(1, memory[5], memory[4], 'absolute')]
+        if source[0] == 'register':
+            return self._encode([0x89], source[1], target, wide=wide)
+        return self._encode([0x8b], target[1], source, wide=wide)
+
+    def _lea(self, name, operands, wide):
+        return self._encode([0x8d], operands[1][1], operands[0], wide=wide)
+
+    def _test(self, name, operands, wide):
+        return self._encode([0x85], operands[0][1], operands[1], wide=wide)
+
+    def _push(self, name, operands, wide):
+        operand = operands[0]
+        if operand[0] == 'register':
+            return self._short_register(0x50, operand[1])
+        if operand[0] == 'immediate':
+            short = self._short(operand)
+            code = bytearray([0x6a if short else 0x68])
+            relocations = []
+            code += self._immediate(operand[1:] + (1 if short else 4,), relocations, 1)
+            return code, relocations
+        return self._encode([0xff], 6, operand)
+
+    def _pop(self, name, operands, wide):
+        operand = operands[0]
+        if operand[0] == 'register':
+            return self._short_register(0x58, operand[1])
+        return self._encode([0x8f], 0, operand)
+
+    # the form writing the register is taken when the target is an xmm
+    # register or there is no other one, the immediate of pshufd comes first
+    def _sse(self, opcode, operands):
+        prefix, load, store = SSE_OPCODES[opcode]
+        immediate = None
+        if opcode == 'pshufd':
+            immediate = operands[0][1:] + (1,)
+            operands = operands[1:]
+        source, target = operands
+        if store is not None and not (target[0] == 'register' and target[2].startswith('%xmm')):
+            return self._encode([0x0f, store], source[1], target, prefix=prefix)
+        return self._encode([0x0f, load], target[1], source, prefix=prefix, immediate=immediate)
+
+
+# the bytes of a string constant, the escapes of C are the ones of the
+# assembler
+def _string_bytes(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    escapes = {b'n': b'\n', b't': b'\t', b'r': b'\r', b'b': b'\b', b'f': b'\f'}
+
+    def unescape(match):
+        escape = match.group(1)
+        if escape[:1] == b'x':
+            return struct.pack('B', int(escape[1:], 16) & 0xff)
+        if escape[:1].isdigit():
+            return struct.pack('B', int(escape, 8) & 0xff)
+        return escapes.get(escape, escape)
+    return bytearray(re.sub(br'\\(x[0-9a-fA-F]+|[0-7]{1,3}|.)', unescape, text))
+
+
+class ElfObject(object):
+    '''
+    the relocatable ELF object of the sections of the assembler file, ELF32
+    for x86 and ELF64 for x86-64, which the system linker takes like the one
+    of the system assembler. the jumps are short while their targets are
+    near enough, the others are made long until all of them are. the labels
+    are local symbols and their relocations go through the symbols of their
+    sections, the functions called are undefined global symbols
+    '''
+
+    def __init__(self, long_mode=False):
+        self.long_mode = long_mode
+        self.machine_code = MachineCode(long_mode)
+        self.contents = {'.text': bytearray(), '.data': bytearray()}
+        self.bss_size = 0
+        self.alignments = {'.text': 1, '.data': 1, '.bss': 1}
+        # the sections and offsets of the labels in the order they are
+        # defined, and the global ones
+        self.labels = {}
+        self.order = []
+        self.globals = []
+        # (offset, label, addend, kind) in .text
+        self.relocations = []
+
+    def assemble(self, sections):
+        self._data(sections['DATA'][1:])
+        self._bss(sections['BSS'][1:])
+        self._text(sections['TEXT'][1:])
+
+    def _define(self, label, section, offset):
+        if label in self.labels:
+            print ('label %s is defined twice' % label)
+            exit()
+        self.labels[label] = (section, offset)
+        self.order.append(label)
+
+    def _align(self, section, alignment):
+        self.alignments[section] = max(self.alignments[section], alignment)
+        if section == '.bss':
+            self.bss_size += -self.bss_size % alignment
+        else:
+            content = self.contents[section]
+            content += bytearray(-len(content) % alignment)
+
+    def _data(self, lines):
+        content = self.contents['.data']
+        for line in lines:
+            if line.startswith('.balign '):
+                self._align('.data', int(line.split()[1]))
+                continue
+            label, line = line.split(':', 1)
+            self._define(label, '.data', len(content))
+            directive, values = line.strip().split(None, 1)
+            if directive == '.int':
+                for value in values.split(','):
+                    content += struct.pack('<I', int(value) & 0xffffffff)
+            elif directive == '.float':
+                for value in values.split(','):
+                    content += struct.pack('<f', float(value))
+            elif directive == '.asciz':
+                content += _string_bytes(values.strip()[1:-1]) + b'\0'
+            else:
+                print ('unknown directive: ' + directive)
+                exit()
+
+    # .lcomm aligns like the system assembler, to the size up to 8 bytes
+    def _bss(self, lines):
+        for line in lines:
+            directive, operands = line.split(None, 1)
+            if directive == '.local':
+                continue
+            operands = [operand.strip() for operand in operands.split(',')]
+            size = int(operands[1])
+            if directive == '.comm':
+                alignment = int(operands[2])
+            else:
+                alignment = 1
+                while alignment < 8 and alignment * 2 <= size:
+                    alignment *= 2
+            self._align('.bss', alignment)
+            self._define(operands[0], '.bss', self.bss_size)
+            self.bss_size += size
+
+    def _text(self, lines):
+        # the labels, the encoded instructions and the jumps, which are
+        # [opcode, label, long]
+        items = []
+        for line in lines:
+            instruction = Instruction(line)
+            opcode = instruction.opcode
+            if opcode == ':':
+                items.append(instruction.operands[0])
+            elif opcode == '.':
+                if line.startswith('.globl '):
+                    self.globals.append(line.split()[1])
+            elif opcode == 'jmp' or opcode in JUMP_CONDITIONS:
+                items.append([opcode, instruction.operands[0], False])
+            else:
+                items.append(self.machine_code.encode(instruction))
+        # the jumps too far for 8 bits are made long, which moves the labels
+        while True:
+            offset = 0
+            offsets = {}
+            for item in items:
+                if item.__class__ is str:
+                    offsets[item] = offset
+                else:
+                    offset += self._size(item)
+            changed = False
+            offset = 0
+            for item in items:
+                if item.__class__ is str:
+                    continue
+                # the offsets are the ones before this pass
+                size = self._size(item)
+                if item.__class__ is list and not item[2]:
+                    if item[1] not in offsets:
+                        print ('unknown label: ' + item[1])
+                        exit()
+                    if not -128 <= offsets[item[1]] - offset - 2 < 128:
+                        item[2] = changed = True
+                offset += size
+            if not changed:
+                break
+        content = self.contents['.text']
+        for item in items:
+            if item.__class__ is str:
+                self._define(item, '.text', len(content))
+            elif item.__class__ is list:
+                content += self._jump(item, offsets[item[1]] - len(content))
+            else:
+                code, relocations = item
+                for position, label, addend, kind in relocations:
+                    self.relocations.append((len(content) + position, label, addend, kind))
+                content += code
+
+    @staticmethod
+    def _size(item):
+        if item.__class__ is not list:
+            return len(item[0])
+        if not item[2]:
+            return 2
+        return 5 if item[0] == 'jmp' else 6
+
+    # the jump from its address to the label distance bytes after it
+    def _jump(self, item, distance):
+        opcode, label, long_jump = item
+        if not long_jump:
+            code = bytearray([0xeb if opcode == 'jmp' else 0x70 | JUMP_CONDITIONS[opcode]])
+            return code + bytearray(struct.pack('<b', distance - 2))
+        if opcode == 'jmp':
+            return bytearray([0xe9]) + bytearray(struct.pack('<i', distance - 5))
+        code = bytearray([0x0f, 0x80 | JUMP_CONDITIONS[opcode]])
+        return code + bytearray(struct.pack('<i', distance - 6))
+
+    # the symbols and their names, the relocations of .text and the
+    # sections of the object, written to path
+    def write(self, path):
+        long_mode = self.long_mode
+        names = bytearray(b'\0')
+        symbols = [(0, 0, 0, 0, 0)]
+        sections = ['.text', '.data', '.bss']
+        # the symbols of the sections, the local labels and the global ones
+        for index, section in enumerate(sections):
+            symbols.append((0, 0, 0, 3, index + 1))
+        for label in self.order:
+            if label not in self.globals:
+                section, offset = self.labels[label]
+                symbols.append((len(names), offset, 0, 0, sections.index(section) + 1))
+                names += label.encode('ascii') + b'\0'
+        first_global = len(symbols)
+        indexes = {}
+        referenced = [label for offset, label, addend, kind in self.relocations]
+        for label in self.globals + referenced:
+            if label in indexes or label in self.labels and label not in self.globals:
+                continue
+            indexes[label] = len(symbols)
+            section, offset = self.labels.get(label, (None, 0))
+            symbols.append((len(names), offset, 0, 0x10,
+                            sections.index(section) + 1 if section else 0))
+            names += label.encode('ascii') + b'\0'
+        text = self.contents['.text']
+        relocations = bytearray()
+        for offset, label, addend, kind in self.relocations:
+            if label in indexes:
+                symbol = indexes[label]
+            else:
+                section, position = self.labels[label]
+                symbol = sections.index(section) + 1
+                addend += position
+            _type = RELOCATION_TYPES[long_mode][kind]
+            if long_mode:
+                relocations += struct.pack('<QQq', offset, symbol << 32 | _type, addend)
+            else:
+                # the addend of ELF32 is in the place relocated
+                text[offset:offset + 4] = struct.pack('<i', addend)
+                relocations += struct.pack('<II', offset, symbol << 8 | _type)
+        if long_mode:
+            table = b''.join(struct.pack('<IBBHQQ', name, info, 0, index, value, size)
+                             for name, value, size, info, index in symbols)
+        else:
+            table = b''.join(struct.pack('<IIIBBH', name, value, size, info, 0, index)
+                             for name, value, size, info, index in symbols)
+        word = 8 if long_mode else 4
+        # name, type, flags, content, size, link, info, alignment, entry size
+        headers = [
+            ('.text', 1, 6, text, len(text), 0, 0, self.alignments['.text'], 0),
+            ('.data', 1, 3, self.contents['.data'], len(self.contents['.data']), 0, 0,
+             self.alignments['.data'], 0),
+            ('.bss', 8, 3, b'', self.bss_size, 0, 0, self.alignments['.bss'], 0),
+            ('.note.GNU-stack', 1, 0, b'', 0, 0, 0, 1, 0),
+            ('.symtab', 2, 0, table, len(table), 6, first_global, word, 24 if long_mode else 16),
+            ('.strtab', 3, 0, names, len(names), 0, 0, 1, 0),
+            ('.rela.text' if long_mode else '.rel.text', 4 if long_mode else 9, 0x40,
+             relocations, len(relocations), 5, 1, word, 24 if long_mode else 8)]
+        section_names = bytearray(b'\0')
+        for header in headers + [('.shstrtab',)]:
+            section_names += header[0].encode('ascii') + b'\0'
+        headers.append(('.shstrtab', 3, 0, section_names, len(section_names), 0, 0, 1, 0))
+        header_size = 64 if long_mode else 52
+        output = bytearray(header_size)
+        table = bytearray(64 if long_mode else 40)
+        for name, _type, flags, content, size, link, info, alignment, entry_size in headers:
+            output += bytearray(-len(output) % alignment)
+            offset = len(output)
+            output += content
+            fields = (section_names.index(name.encode('ascii') + b'\0'), _type, flags, 0,
+                      offset, size, link, info, alignment, entry_size)
+            table += struct.pack('<IIQQQQIIQQ' if long_mode else '<IIIIIIIIII', *fields)
+        output += bytearray(-len(output) % 8)
+        identity = b'\x7fELF' + struct.pack('BBBB', 2 if long_mode else 1, 1, 1, 0) + b'\0' * 8
+        output[:header_size] = struct.pack(
+            '<16sHHIQQQIHHHHHH' if long_mode else '<16sHHIIIIIHHHHHH', identity, 1,
+            62 if long_mode else 3, 1, 0, 0, len(output), 0, header_size, 0, 0,
+            len(table) // len(headers + [None]), len(headers) + 1, len(headers))
+        output += table
+        object_file = open(path, 'wb')
+        object_file.write(output)
+        object_file.close()
+
+
+class JitProgram(object):
+    '''
+    the x86-64 code of an object run in this process: .text, .data, .bss
+    and the jumps to printf and scanf of libc are put in an executable
+    mapping and relocated to their addresses, then main is called through
+    ctypes. exit goes back to the caller with its status, the output of
+    printf is flushed after it
+    '''
+
+    def __init__(self, elf_object):
+        if ctypes.sizeof(ctypes.c_void_p) != 8:
+            print ('-r runs x86-64 code, python is not 64 bit')
+            exit()
+        self.libc = ctypes.CDLL(None)
+        text = elf_object.contents['.text']
+        data = elf_object.contents['.data']
+        # the offsets of the sections in the mapping, the jumps to libc are
+        # 8 bytes of jmp *(%rip) and the address
+        bases = {'.text': 0, '.data': self._round(len(text), 16)}
+        bases['.bss'] = self._round(bases['.data'] + len(data), 16)
+        stubs = self._round(bases['.bss'] + elf_object.bss_size, 16)
+        size = self._round(stubs + 16 * len(JIT_FUNCTIONS), mmap.PAGESIZE)
+        self.buffer = mmap.mmap(-1, size, prot=mmap.PROT_READ | mmap.PROT_WRITE | mmap.PROT_EXEC)
+        self.pointer = ctypes.c_char.from_buffer(self.buffer)
+        address = ctypes.addressof(self.pointer)
+        labels = dict((label, address + bases[section] + offset)
+                      for label, (section, offset) in elf_object.labels.items())
+        for index, name in enumerate(JIT_FUNCTIONS):
+            stub = stubs + 16 * index
+            labels[name] = address + stub
+            function = ctypes.cast(getattr(self.libc, name), ctypes.c_void_p).value
+            self.buffer[stub:stub + 14] = bytes(bytearray([0xff, 0x25, 0, 0, 0, 0]) +
+                                                bytearray(struct.pack('<Q', function)))
+        text = bytearray(text)
+        for offset, label, addend, kind in elf_object.relocations:
+            if label not in labels:
+                print ('unknown function: ' + label)
+                exit()
+            value = labels[label] + addend
+            # the absolute displacements are unsigned, the relative ones to
+            # the next instruction signed
+            if kind == 'absolute':
+                low, high = 0, 1 << 32
+            else:
+                value -= address + offset
+                low, high = -(1 << 31), 1 << 31
+            if not low <= value < high:
+                print ('%s is too far from the code' % label)
+                exit()
+            text[offset:offset + 4] = struct.pack('<I', value & 0xffffffff)
+        self.buffer[0:len(text)] = bytes(text)
+        self.buffer[bases['.data']:bases['.data'] + len(data)] = bytes(data)
+        self.main = ctypes.CFUNCTYPE(ctypes.c_int)(labels['jit_main'])
+
+    @staticmethod
+    def _round(size, alignment):
+        return size + -size % alignment
+
+    # the exit status of main, the output of python comes first
+    def run(self):
+        sys.stdout.flush()
+        status = self.main()
+        self.libc.fflush(None)
+        return status
+
+    def close(self):
+        # the mapping is closed when nothing points into it
+        self.main = self.pointer = None
+        self.buffer.close()
+
+
+class BytecodeCompiler(object):
+    '''
+    compiles the IR of the sentences of main to the bytecode of the virtual
+    machine. the variables and the items of the arrays are slots of the ints
+    or the floats, the virtual registers and the constants slots of the
+    values, all of them resolved here. the addresses of addr are constants,
+    the jumps to the next block are left out
+    '''
+
+    def __init__(self, program):
+        self.program = program
+        self.code = []
+        # the first slot of every variable and array in ints or floats
+        self.slots = {}
+        self.ints = array('i')
+        self.floats = array('f')
+        self.values = []
+        self.constants = {}
+        # the function, the format and the slots of the arguments of a call
+        self.calls = []
+
+    # the code, the slots and the calls are the bytecode
+    def compile(self):
+        for name in self.program.names:
+            self._variable(name, self.program.symbols[name])
+        function = self.program.functions[0]
+        self.values = [0] * function.register_cnt
+        # the instruction of every label, the targets are patched after it
+        starts = {}
+        jumps = []
+        blocks = function.blocks
+        labels = [block.label for block in blocks[1:]] + [None]
+        for block, next_label in zip(blocks, labels):
+            starts[block.label] = len(self.code)
+            for instruction in block.instructions:
+                if instruction.opcode == 'jump' and instruction.operands[0] == next_label:
+                    continue
+                if instruction.opcode in ('jump', 'branch'):
+                    jumps.append(len(self.code))
+                self._instruction(instruction)
+        for index in jumps:
+            self.code[index] = tuple(
+                starts[operand] if operand.__class__ is str else operand
+                for operand in self.code[index])
+        return self
+
+    def _variable(self, name, symbol):
+        if symbol['type'] == 'STRING_CONSTANT':
+            return
+        if symbol['field_type'] == 'float':
+            items = self.floats
+            convert = float
+        else:
+            items = self.ints
+            convert = lambda value: _wrap(int(float(value)))
+        self.slots[name] = len(items)
+        values = symbol.get('values') or []
+        items.extend([convert(value) for value in values] +
+                     [convert(0)] * (symbol.get('size', 1) - len(values)))
+
+    def _emit(self, opcode, a=0, b=0, c=0, d=0):
+        self.code.append((opcode, a, b, c, d))
+
+    # the slot of a register, or of a constant which is float as the program
+    # has it in memory
+    def _value(self, operand):
+        if operand.__class__ is VirtualRegister:
+            return operand.number - 1
+        if isinstance(operand, float):
+            operand = struct.unpack('<f', struct.pack('<f', operand))[0]
+        else:
+            operand = _wrap(operand)
+        key = (operand.__class__, operand)
+        if key not in self.constants:
+            self.constants[key] = len(self.values)
+            self.values.append(operand)
+        return self.constants[key]
+
+    def _instruction(self, instruction):
+        opcode = instruction.opcode
+        operands = instruction.operands
+        floating = instruction.type == 'float'
+        if opcode == 'load':
+            self._emit(B_LOAD_FLOAT if floating else B_LOAD_INT,
+                       self._value(instruction.target), self.slots[operands[0]])
+        elif opcode == 'store':
+            self._emit(B_STORE_FLOAT if floating else B_STORE_INT,
+                       self.slots[operands[0]], self._value(operands[1]))
+        elif opcode == 'load_item':
+            self._emit(B_LOAD_ITEM_FLOAT if floating else B_LOAD_ITEM_INT,
+                       self._value(instruction.target), self.slots[operands[0]],
+                       self._value(operands[1]))
+        elif opcode == 'store_item':
+            self._emit(B_STORE_ITEM_FLOAT if floating else B_STORE_ITEM_INT,
+                       self.slots[operands[0]], self._value(operands[1]),
+                       self._value(operands[2]))
+        elif opcode in ('add', 'sub', 'mul', 'div'):
+            self._emit(BYTECODE_OPCODES.index(opcode + ('_float' if floating else '_int')),
+                       self._value(instruction.target), self._value(operands[0]),
+                       self._value(operands[1]))
+        elif opcode in ('itof', 'ftoi'):
+            self._emit(B_ITOF if opcode == 'itof' else B_FTOI,
+                       self._value(instruction.target), self._value(operands[0]))
+        elif opcode == 'addr':
+            self.values[instruction.target.number - 1] = self._address(operands[0])
+        elif opcode == 'call':
+            self._emit(B_CALL, len(self.calls))
+            self.calls.append(self._call(operands[0], operands[1:]))
+        elif opcode == 'jump':
+            self._emit(B_JUMP, operands[0])
+        elif opcode == 'branch':
+            operator, operand_a, operand_b, label_true, label_false = operands
+            self._emit(BYTECODE_OPCODES.index('branch' + operator), self._value(operand_a),
+                       self._value(operand_b), label_true, label_false)
+        elif opcode == 'return':
+            self._emit(B_RETURN, self._value(operands[0]))
+        else:
+            print ('%s is not supported by the virtual machine!' % opcode)
+            exit()
+
+    # the bytes of a string, or the type and the slot of a variable
+    def _address(self, name):
+        symbol = self.program.symbols[name]
+        if symbol['type'] == 'STRING_CONSTANT':
+            return bytes(_string_bytes(symbol['value']))
+        return (symbol['field_type'], self.slots[name])
+
+    # the format of printf for python, the types of the conversions of scanf
+    def _call(self, function, arguments):
+        arguments = [self._value(argument) for argument in arguments]
+        if not arguments or self.values[arguments[0]].__class__ is not bytes:
+            print ('the format of %s must be a string!' % function)
+            exit()
+        text = self.values[arguments[0]]
+        if function == 'printf':
+            # the arguments of the unsigned conversions and their masks
+            masks = []
+            conversions = [match.group(2) for match in PRINTF_CONVERSION.finditer(text)]
+            for index, conversion in enumerate(
+                    conversion for conversion in conversions if conversion != b'%'):
+                if conversion in PRINTF_MASKS:
+                    masks.append((index, PRINTF_MASKS[conversion]))
+            return (function, PRINTF_CONVERSION.sub(br'%\1\2', text), arguments[1:],
+                    tuple(masks))
+        types = []
+        for conversion in SCANF_CONVERSION.findall(text):
+            if conversion in b'diu':
+                types.append('int')
+            elif conversion in b'eEfFgG':
+                types.append('float')
+            else:
+                print ('conversion %%%s of scanf is not supported!' % conversion.decode('ascii'))
+                exit()
+        return (function, types, arguments[1:], ())
+
+
+# the int of 32 bits value is in the machine
+def _wrap(value):
+    return (value + 0x80000000 & 0xffffffff) - 0x80000000
+
+
+class VirtualMachine(object):
+    '''
+    runs the bytecode of the BytecodeCompiler in a dispatch loop, the
+    opcodes are tested in halves of their numbers. the ints wrap around at
+    32 bits, the floats are rounded to 32 bits when they are stored and the
+    temporaries are doubles like the ones of the x87 registers, unless they
+    are single. printf and scanf are the ones of python on the streams
+    '''
+
+    def __init__(self, bytecode, single=False, stdin=None, stdout=None):
+        # the floats are rounded to 32 bits after every operation like the
+        # ones of SSE
+        self.single = single
+        self.code = bytecode.code
+        self.calls = bytecode.calls
+        self.values = list(bytecode.values)
+        self.ints = array('i', bytecode.ints)
+        self.floats = array('f', bytecode.floats)
+        self.stdin = stdin or getattr(sys.stdin, 'buffer', sys.stdin)
+        self.stdout = stdout or getattr(sys.stdout, 'buffer', sys.stdout)
+        # the input read by scanf and not taken yet
+        self.pending = b''
+        # the instructions run
+        self.executed = 0
+
+    # the status main returns
+    def run(self):
+        code = self.code
+        values = self.values
+        ints = self.ints
+        floats = self.floats
+        single = self.single
+        scratch = array('f', [0.0])
+        pc = 0
+        executed = 0
+        try:
+            while True:
+                opcode, a, b, c, d = code[pc]
+                pc += 1
+                executed += 1
+                if opcode < B_ADD_INT:
+                    if opcode == B_LOAD_INT:
+                        values[a] = ints[b]
+                    elif opcode == B_LOAD_FLOAT:
+                        values[a] = floats[b]
+                    elif opcode == B_STORE_INT:
+                        ints[a] = values[b]
+                    elif opcode == B_STORE_FLOAT:
+                        floats[a] = values[b]
+                    elif opcode == B_LOAD_ITEM_INT:
+                        values[a] = ints[b + values[c]]
+                    elif opcode == B_LOAD_ITEM_FLOAT:
+                        values[a] = floats[b + values[c]]
+                    elif opcode == B_STORE_ITEM_INT:
+                        ints[a + values[b]] = values[c]
+                    else:
+                        floats[a + values[b]] = values[c]
+                elif opcode < B_JUMP:
+                    if opcode < B_ADD_FLOAT:
+                        if opcode == B_ADD_INT:
+                            value = values[b] + values[c]
+                        elif opcode == B_SUB_INT:
+                            value = values[b] - values[c]
+                        elif opcode == B_MUL_INT:
+                            value = values[b] * values[c]
+                        else:
+                            value = self._divide(values[b], values[c])
+                        if -0x80000000 <= value <= 0x7fffffff:
+                            values[a] = value
+                        else:
+                            values[a] = _wrap(value)
+                    elif opcode < B_FTOI:
+                        if opcode == B_ADD_FLOAT:
+                            value = values[b] + values[c]
+                        elif opcode == B_SUB_FLOAT:
+                            value = values[b] - values[c]
+                        elif opcode == B_MUL_FLOAT:
+                            value = values[b] * values[c]
+                        elif opcode == B_ITOF:
+                            value = float(values[b])
+                        elif values[c]:
+                            value = values[b] / values[c]
+                        else:
+                            value = self._infinity(values[b], values[c])
+                        if single:
+                            scratch[0] = value
+                            value = scratch[0]
+                        values[a] = value
+                    else:
+                        value = values[b]
+                        # cvttss2si and fisttp give the least int when the
+                        # float is out of the ints
+                        values[a] = int(value) if -2147483649.0 < value < 2147483648.0 else -0x80000000
+                elif opcode < B_CALL:
+                    if opcode == B_JUMP:
+                        pc = a
+                    elif opcode == B_BRANCH_LT:
+                        pc = c if values[a] < values[b] else d
+                    elif opcode == B_BRANCH_LE:
+                        pc = c if values[a] <= values[b] else d
+                    elif opcode == B_BRANCH_GT:
+                        pc = c if values[a] > values[b] else d
+                    elif opcode == B_BRANCH_GE:
+                        pc = c if values[a] >= values[b] else d
+                    elif opcode == B_BRANCH_EQ:
+                        pc = c if values[a] == values[b] else d
+                    else:
+                        pc = c if values[a] != values[b] else d
+                elif opcode == B_CALL:
+                    self._call(self.calls[a])
+                else:
+                    return values[a]
+        except IndexError:
+            print ('index out of the array!')
+            exit(1)
+        finally:
+            self.executed += executed
+            self.stdout.flush()
+
+    @staticmethod
+    def _divide(a, b):
+        # idivl traps on them, the shell reports the status of SIGFPE
+        if not b or a == -0x80000000 and b == -1:
+            print ('floating point exception')
+            exit(136)
+        quotient = abs(a) // abs(b)
+        return -quotient if (a < 0) != (b < 0) else quotient
+
+    # a float divided by zero
+    @staticmethod
+    def _infinity(a, b):
+        if not a or a != a:
+            # the default nan of the processor
+            return a * float('inf')
+        return math.copysign(float('inf'), a) * math.copysign(1.0, b)
+
+    # the text of printf, the nans with the sign are -nan like the ones of C
+    @staticmethod
+    def _format(text, arguments):
+        if all(argument == argument for argument in arguments):
+            return text % arguments
+        pieces = []
+        arguments = iter(arguments)
+        start = 0
+        for match in PRINTF_CONVERSION.finditer(text):
+            pieces.append(text[start:match.start()])
+            start = match.end()
+            if match.group(2) == b'%':
+                pieces.append(b'%')
+                continue
+            value = next(arguments)
+            if value != value and math.copysign(1.0, value) < 0:
+                piece = match.group(0) % float('-inf')
+                pieces.append(piece.replace(b'inf', b'nan').replace(b'INF', b'NAN'))
+            else:
+                pieces.append(match.group(0) % value)
+        pieces.append(text[start:])
+        return b''.join(pieces)
+
+    def _call(self, call):
+        function, conversions, arguments, masks = call
+        values = self.values
+        if function == 'printf':
+            try:
+                printed = tuple(values[argument] for argument in arguments)
+                if masks:
+                    printed = list(printed)
+                    for index, mask in masks:
+                        if index < len(printed):
+                            printed[index] &= mask
+                    printed = tuple(printed)
+                self.stdout.write(self._format(conversions, printed))
+            except (TypeError, ValueError, StopIteration):
+                print ('the arguments of printf do not match its format!')
+                exit()
+            return
+        # the prompts are out before the input is read
+        self.stdout.flush()
+        for _type, argument in zip(conversions, arguments):
+            text = self._scan(SCANF_NUMBERS[_type])
+            if text is None:
+                return
+            field_type, slot = values[argument]
+            if field_type == 'float':
+                self.floats[slot] = float(text)
+            else:
+                self.ints[slot] = _wrap(int(float(text)) if _type == 'float' else int(text))
+
+    # the text of the number at the start of the input, None when there is
+    # none before the end of it
+    def _scan(self, pattern):
+        while not self.pending.strip():
+            line = self.stdin.readline()
+            if not line:
+                return None
+            self.pending += line
+        match = pattern.match(self.pending)
+        if match is None:
+            return None
+        self.pending = self.pending[match.end():]
+        return match.group(1)
+
+
+# the multiplier and the shift of the signed division by divisor > 1, the
+# quotient is the high half of the product shifted right, plus one when it
+# is negative. from Hacker's Delight, the multiplier is 33 bits when it is
+# 2 ** 32 or more, and the dividend is added to the high half
+def _divide_magic(divisor):
+    two31 = 2 ** 31
+    limit = two31 - 1 - two31 % divisor
+    shift = 31
+    quotient_1, remainder_1 = divmod(two31, limit)
+    quotient_2, remainder_2 = divmod(two31, divisor)
+    while True:
+        shift += 1
+        quotient_1, remainder_1 = 2 * quotient_1, 2 * remainder_1
+        if remainder_1 >= limit:
+            quotient_1, remainder_1 = quotient_1 + 1, remainder_1 - limit
+        quotient_2, remainder_2 = 2 * quotient_2, 2 * remainder_2
+        if remainder_2 >= divisor:
+            quotient_2, remainder_2 = quotient_2 + 1, remainder_2 - divisor
+        delta = divisor - remainder_2
+        if quotient_1 > delta or quotient_1 == delta and remainder_1:
+            break
+    return quotient_2 + 1, shift - 32
+
+
+# x / c is x * (1 / c) when the float constant c is a power of two, the
+# reciprocal of it is exact
+def _reciprocal(opcode, operand):
+    if opcode != 'div' or operand.__class__ is VirtualRegister:
+        return opcode, operand
+    bits = struct.unpack('<I', struct.pack('<f', float(operand)))[0]
+    exponent = bits >> 23 & 0xff
+    if bits & 0x7fffff or not 0 < exponent < 254:
+        return opcode, operand
+    return 'mul', 1.0 / float(operand)
+
+
+class Assembler(object):
+    '''
+    x86 assembler of the IR. the int virtual registers get the general
+    purpose registers by a linear scan of their live ranges, the float ones
+    stay on the x87 stack when they are used in the reverse order they are
+    made, and the others get stack slots below %ebp. a load used only once
+    is folded into the memory operand of the instruction using it, and the
+    multiplications and divisions by constants are shifts, leal and
+    multiplications
+    '''
+
+    def __init__(self, tree=None, stream=False, peephole=None):
+        if tree is None:
+            parser = Parser()
+            parser.main()
+            tree = parser.tree
+        self.tree = tree
+        self.ass_file_handler = AssemblerFileHandler(stream, peephole)
+        self.program = None
+        # registers of the register variables of the function
+        self.homes = {}
+        self.loop_registers = LOOP_REGISTERS
+        # the float virtual registers get the xmm registers, not the x87 stack
+        self.sse = False
+        # the registers the calls overwrite
+        self.caller_saved = CALLER_SAVED
+        # handlers of the IR instructions, keyed by opcode
+        self.handlers = {
+            'load': self._load, 'load_item': self._load, 'addr': self._addr,
+            'store': self._store, 'store_item': self._store,
+            'add': self._operator, 'sub': self._operator, 'mul': self._operator,
+            'div': self._operator, 'itof': self._itof, 'ftoi': self._ftoi,
+            'call': self._call, 'jump': self._jump, 'branch': self._branch,
+            'return': self._return}
+        # labels of the float constants and of the int divisors in .data
+        self.float_constants = {}
+        self.integer_constants = {}
+        # label
+        self.label_cnt = 0
+
+    # lower the tree at node to the IR and assemble it
+    def traverse(self, node=None):
+        self.emit(IRBuilder().build(node))
+
+    def emit(self, program):
+        self.program = program
+        self.label_cnt = max(self.label_cnt, program.label_cnt)
+        for name in program.names:
+            # the register variables are declared with the functions
+            if not program.symbols[name].get('register'):
+                self._declaration(name, program.symbols[name])
+        for function in program.functions:
+            self._function(function)
+
+    def _emit(self, line):
+        self.ass_file_handler.insert(line, 'TEXT')
+
+    # sizeof
+    def _sizeof(self, _type):
+        size = -1
+        if _type == 'int' or _type == 'float' or _type == 'long':
+            size = 4
+        elif _type == 'char':
+            size = 1
+        elif _type == 'double':
+            size = 8
+        return str(size)
+
+    def _declaration(self, name, symbol):
+        if symbol['type'] == 'STRING_CONSTANT':
+            line = name + ': .asciz "' + symbol['value'] + '"'
+            self.ass_file_handler.insert(line, 'DATA')
+        elif symbol['type'] == 'LIST' and symbol['values'] is not None:
+            # the items after the initializer are zero
+            values = symbol['values'] + ['0'] * (symbol['size'] - len(symbol['values']))
+            line = name + ': .' + symbol['field_type'] + ' ' + ', '.join(values)
+            # the vectors are read from the arrays at 16 bytes
+            if symbol.get('aligned'):
+                self.ass_file_handler.insert('.balign 16', 'DATA')
+            self.ass_file_handler.insert(line, 'DATA')
+        else:
+            size = int(self._sizeof(symbol['field_type'])) * symbol.get('size', 1)
+            if symbol.get('aligned'):
+                # .lcomm takes no alignment, a local .comm does
+                self.ass_file_handler.insert('.local ' + name, 'BSS')
+                self.ass_file_handler.insert('.comm %s, %d, 16' % (name, size), 'BSS')
+            else:
+                self.ass_file_handler.insert('.lcomm %s, %d' % (name, size), 'BSS')
+
+    def _function(self, function):
+        # the scratch registers are kept out of the linear scan only when
+        # some virtual registers are spilled, and then the register
+        # variables are in the memory, unless they are always kept out
+        strict = False
+        while True:
+            variables, self.homes = self._homes(function)
+            if strict:
+                self.homes = {}
+            self._analyze(function, strict)
+            spilled = self._allocate(function, strict)
+            if strict or not spilled or self.scratch:
+                break
+            strict = True
+        for name in variables:
+            if name not in self.homes:
+                self._declaration(name, self.program.symbols[name])
+        self._emit('.globl ' + function.name)
+        self._emit(function.name + ':')
+        self._prologue()
+        blocks = function.blocks
+        labels = [block.label for block in blocks[1:]] + [None]
+        referenced = set()
+        for block, next_label in zip(blocks, labels):
+            referenced.update(self._jump_targets(block.instructions[-1], next_label))
+        for index, block in enumerate(blocks):
+            if index and block.label in referenced:
+                self._emit(block.label + ':')
+            self.next_label = labels[index]
+            # the x87 stack, the float virtual registers and constants on it
+            self.x87 = []
+            for instruction in self.assembled[block]:
+                self.scratch_free = list(self.scratch)
+                self.handlers[instruction.opcode](instruction)
+
+    def _prologue(self):
+        self._emit('finit')
+        if self.frame:
+            self._emit('pushl %ebp')
+            self._emit('movl %esp, %ebp')
+            self._emit('subl $%d, %%esp' % self.frame)
+
+    # the register variables of the function, and the registers of the
+    # ones which get one. the variables live in the same blocks get
+    # different registers
+    def _homes(self, function):
+        symbols = self.program.symbols
+        variables = []
+        uses = {}
+        defines = {}
+        for block in function.blocks:
+            uses[block] = set()
+            defines[block] = set()
+            for instruction in block.instructions:
+                if instruction.opcode not in ('load', 'store'):
+                    continue
+                name = instruction.operands[0]
+                if not symbols[name].get('register'):
+                    continue
+                if name not in variables:
+                    variables.append(name)
+                if instruction.opcode == 'store':
+                    defines[block].add(name)
+                elif name not in defines[block]:
+                    uses[block].add(name)
+        if not variables:
+            return variables, {}
+        live = _live_in(function.blocks, uses, defines)
+        regions = dict((name, set()) for name in variables)
+        labels = dict((block.label, block) for block in function.blocks)
+        for block in function.blocks:
+            names = live[block] | uses[block] | defines[block]
+            for label in block.successors():
+                names = names | live[labels[label]]
+            for name in names:
+                regions[name].add(block)
+        homes = {}
+        for name in sorted(variables, key=self.program.names.index):
+            taken = set(homes[other] for other in homes if regions[other] & regions[name])
+            free = [register for register in self.loop_registers if register not in taken]
+            if free:
+                homes[name] = free[0]
+        return variables, homes
+
+    # the instructions of block which are not folded into others or unused
+    def _assembled(self, block):
+        return [instruction for instruction in block.instructions
+                if instruction not in self.fused and (
+                    instruction.target is None or instruction.target not in self.folded and
+                    self.uses[instruction.target])]
+
+    # the labels jumped to at the end of the block
+    def _jump_targets(self, terminator, next_label):
+        if terminator.opcode == 'jump':
+            labels = terminator.operands[:1]
+        elif terminator.opcode == 'branch':
+            taken = _branch_taken(terminator)
+            labels = terminator.operands[3:] if taken is None else [taken]
+        else:
+            labels = []
+        return [label for label in labels if label != next_label]
+
+    # the definitions and uses of the virtual registers, the ones folded
+    # into the instructions using them and the homes of the float ones
+    def _analyze(self, function, strict):
+        self.definitions = {}
+        self.positions = {}
+        self.uses = {}
+        # the blocks making float values
+        floats = set()
+        for block in function.blocks:
+            for index, instruction in enumerate(block.instructions):
+                target = instruction.target
+                if target is not None:
+                    self.definitions[target] = instruction
+                    self.positions[target] = (block, index)
+                    self.uses.setdefault(target, [])
+                    if target.type == 'float' and not self.sse:
+                        floats.add(block)
+                for operand in instruction.operands:
+                    if operand.__class__ is VirtualRegister:
+                        self.uses.setdefault(operand, []).append(block)
+        self.folded = set()
+        # the instructions done by the store after them
+        self.fused = set()
+        for block in function.blocks:
+            for index, instruction in enumerate(block.instructions):
+                if instruction.opcode not in ('load', 'addr', 'jump'):
+                    self._fold(block, index, instruction, strict)
+        self.slots = {}
+        self.frame = 0
+        memory = set()
+        # the xmm registers of the float ones are allocated with the int ones
+        for register, definition in self.definitions.items():
+            if register.type == 'float' and register not in self.folded and (
+                    self.uses[register]) and not self._local(register) and not self.sse:
+                memory.add(register)
+        for block in function.blocks:
+            while block in floats and not self._float_stack(block, memory):
+                pass
+        for register in sorted(memory, key=lambda register: register.number):
+            self._slot(register)
+        self.assembled = dict((block, self._assembled(block)) for block in function.blocks)
+
+    def _slot(self, register):
+        self.frame += 4
+        self.slots[register] = '-%d(%%ebp)' % self.frame
+
+    # used once, in the block it is made in
+    def _local(self, register):
+        uses = self.uses[register]
+        return len(uses) == 1 and uses[0] is self.positions[register][0]
+
+    # a load of a register variable with a register
+    def _homed(self, register):
+        definition = self.definitions[register]
+        return definition.opcode == 'load' and definition.operands[0] in self.homes
+
+    # a load, an address or an int to float conversion used once can be
+    # folded into the memory operand of the instruction at index
+    def _foldable(self, block, index, register, name=None):
+        if register.__class__ is not VirtualRegister or not self._local(register):
+            return False
+        definition = self.definitions[register]
+        if definition.opcode in ('addr', 'itof'):
+            return name is None
+        if definition.opcode not in ('load', 'load_item') or (
+                name is not None and definition.operands[0] != name):
+            return False
+        # nothing stores to the variable before it is used
+        for instruction in block.instructions[self.positions[register][1] + 1:index]:
+            if instruction.opcode == 'call' or instruction.opcode in ('store', 'store_item') and (
+                    instruction.operands[0] == definition.operands[0]):
+                return False
+        return True
+
+    def _fold(self, block, index, instruction, strict):
+        opcode = instruction.opcode
+        operands = instruction.operands
+        instructions = block.instructions
+        following = instructions[index + 1] if index + 1 < len(instructions) else None
+        if following is not None and following.opcode == 'store' and (
+                following.operands[1] is instruction.target) and len(self.uses[instruction.target]) == 1:
+            # x = x + y is an addl to x, and x = f is a fisttpl to x
+            if opcode in ('add', 'sub') and instruction.type == 'int' and (
+                    operands[1] is not operands[0]) and self._foldable(
+                        block, index, operands[0], following.operands[0]):
+                self.fused.add(instruction)
+                self.folded.add(operands[0])
+                return
+            if opcode == 'ftoi' and not self.sse:
+                self.fused.add(instruction)
+        homed = False
+        if opcode in ('add', 'sub', 'mul', 'div', 'itof', 'ftoi', 'return', 'call'):
+            positions = range(len(operands))
+        elif opcode == 'branch':
+            positions = [2, 1]
+        elif opcode == 'store' and instruction.type == 'float':
+            positions = [1]
+        elif self.homes and opcode in ('load_item', 'load_vector', 'store', 'store_item'):
+            # the register variables are read in place by any instruction
+            positions = range(1, len(operands))
+            homed = True
+        else:
+            return
+        items = 0
+        for position in positions:
+            operand = operands[position]
+            if not self._foldable(block, index, operand) or homed and not self._homed(operand):
+                continue
+            definition = self.definitions[operand]
+            # the x87 instructions take an int in the memory, cvtsi2ss does not
+            # go into another instruction
+            if definition.opcode == 'itof' and (
+                    self.sse or instruction.type != 'float' and opcode != 'ftoi'):
+                continue
+            # cmpl takes one operand in the memory
+            if opcode == 'branch' and instruction.type == 'int' and operands[2] in self.folded and (
+                    not self._homed(operands[2]) and not self._homed(operand)):
+                continue
+            # the index of only one of them goes to a scratch register, and
+            # the arguments of the SysV calls are in registers
+            if definition.opcode == 'load_item' and (strict or self.sse):
+                if items or opcode == 'call' and self.sse:
+                    continue
+                items += 1
+            self.folded.add(operand)
+
+    # whether the float virtual registers of block stay on the x87 stack, the
+    # ones which are not used in the reverse order they are made are put in
+    # memory and it is tried again
+    def _float_stack(self, block, memory):
+        stack = []
+        for instruction in block.instructions:
+            target = instruction.target
+            if target in self.folded:
+                continue
+            if instruction.opcode == 'call' and stack:
+                memory.update(stack)
+                return False
+            operands = [operand for operand in instruction.registers()
+                        if operand.type == 'float' and operand not in memory and
+                        operand not in self.folded]
+            if operands:
+                missing = [operand for operand in operands if operand not in stack]
+                if missing:
+                    memory.update(missing)
+                    return False
+                if set(stack[-len(operands):]) != set(operands):
+                    bottom = min(stack.index(operand) for operand in operands)
+                    memory.update(operand for operand in stack[bottom:]
+                                  if operand not in operands)
+                    return False
+                del stack[-len(operands):]
+            # room for the target and two operands loaded from the memory
+            if len(stack) + 3 > FLOAT_STACK_SIZE:
+                memory.add(stack[0])
+                return False
+            if target is not None and target.type == 'float' and (
+                    target not in memory and self.uses[target]):
+                stack.append(target)
+        return True
+
+    # the virtual registers with registers read when instruction is
+    # assembled, through the instructions folded into it
+    def _reads(self, instruction):
+        reads = []
+        for operand in instruction.operands:
+            reads.extend(self._operand_reads(operand))
+        return reads
+
+    def _operand_reads(self, operand):
+        if operand.__class__ is not VirtualRegister:
+            return []
+        definition = self.definitions[operand]
+        if operand in self.folded or definition in self.fused:
+            return self._reads(definition)
+        return [operand] if operand.type in self.pools else []
+
+    # the registers of the virtual registers by their types, and the scratch
+    # registers
+    def _registers(self, strict):
+        if strict:
+            return {'int': TEMPORARY_REGISTERS[:4]}, TEMPORARY_REGISTERS[4:]
+        return {'int': [register for register in TEMPORARY_REGISTERS
+                        if register not in self.homes.values()]}, []
+
+    # linear scan of the live ranges of the virtual registers, a range
+    # covers the blocks it is live in. True if some of them are spilled
+    def _allocate(self, function, strict):
+        self.pools, self.scratch = self._registers(strict)
+        blocks = function.blocks
+        # reads and targets at every position
+        reads = []
+        targets = []
+        calls = []
+        divides = []
+        hints = {}
+        uses = {}
+        defines = {}
+        for block in blocks:
+            uses[block] = set()
+            defines[block] = set()
+            for instruction in self.assembled[block]:
+                target = instruction.target
+                position = len(reads)
+                read = self._reads(instruction)
+                reads.append(read)
+                uses[block].update(register for register in read
+                                   if register not in defines[block])
+                if instruction.opcode == 'call':
+                    calls.append(position)
+                elif instruction.opcode == 'div' and instruction.type == 'int':
+                    divides.append((position, instruction))
+                if target is None or target.type not in self.pools:
+                    targets.append(None)
+                    continue
+                targets.append(target)
+                defines[block].add(target)
+                # the target may take the register of the first operand, or of
+                # the index of it, it is written after they are read
+                operand = instruction.operands[-1 if instruction.opcode == 'load_item' else 0]
+                if instruction.opcode == 'div' and target.type == 'int':
+                    hints[target] = '%eax'
+                elif instruction.opcode in ('add', 'sub', 'mul', 'div') and operand in self.folded:
+                    operand = self.definitions[operand].operands[-1]
+                    if operand not in self._operand_reads(instruction.operands[1]):
+                        hints[target] = operand
+                elif instruction.opcode in ('add', 'sub', 'mul', 'div', 'load_item'):
+                    hints[target] = operand
+        # the registers live at the start of the blocks
+        live = _live_in(blocks, uses, defines)
+        labels = dict((block.label, block) for block in blocks)
+        start = {}
+        end = {}
+        position = 0
+        for block in blocks:
+            first = position
+            last = first + len(self.assembled[block]) - 1
+            live_out = set()
+            for label in block.successors():
+                live_out |= live[labels[label]]
+            # the registers live in are live before the first instruction,
+            # which may be a call
+            for register in live[block]:
+                start[register] = min(start.get(register, first - 0.5), first - 0.5)
+                end[register] = max(end.get(register, first), first)
+            for register in live_out:
+                start[register] = min(start.get(register, last), last)
+                end[register] = max(end.get(register, last), last)
+            for position in range(first, last + 1):
+                for register in reads[position]:
+                    start[register] = min(start.get(register, position), position)
+                    end[register] = max(end.get(register, position), position)
+                target = targets[position]
+                if target is not None:
+                    start[target] = min(start.get(target, position), position)
+                    end[target] = max(end.get(target, position), position)
+            position = last + 1
+        # the calls overwrite the caller saved registers, idivl %eax and %edx
+        excluded = {}
+        divide_positions = [position for position, instruction in divides]
+        for register in start:
+            index = bisect.bisect_right(calls, start[register])
+            if index < len(calls) and calls[index] < end[register]:
+                excluded.setdefault(register, set()).update(self.caller_saved)
+            index = bisect.bisect_right(divide_positions, start[register])
+            if index < len(divide_positions) and divide_positions[index] < end[register]:
+                excluded.setdefault(register, set()).update(['%eax', '%edx'])
+        for position, instruction in divides:
+            dividend = instruction.operands[0]
+            for register in reads[position]:
+                if register is not dividend or reads[position].count(register) > 1:
+                    excluded.setdefault(register, set()).update(['%eax', '%edx'])
+        self.locations = {}
+        spills = []
+        active = []
+        # the float and vector registers are the same
+        free = []
+        for registers in self.pools.values():
+            free.extend(location for location in registers if location not in free)
+        for register in sorted(start, key=lambda register: (start[register], register.number)):
+            for other in list(active):
+                if end[other] < start[register]:
+                    active.remove(other)
+                    free.append(self.locations[other])
+            hint = hints.get(register)
+            banned = excluded.get(register, ())
+            registers = self.pools[register.type]
+            candidates = [location for location in registers
+                          if location in free and location not in banned]
+            if hint in active and end[hint] == start[register] and (
+                    self.locations[hint] in registers and self.locations[hint] not in banned):
+                # the operand ends where the target starts, it is handed over
+                active.remove(hint)
+                free.append(self.locations[hint])
+                candidates = [self.locations[hint]]
+            elif hint in candidates:
+                candidates = [hint]
+            if candidates:
+                self.locations[register] = candidates[0]
+                free.remove(candidates[0])
+                active.append(register)
+                continue
+            victims = [other for other in active
+                       if self.locations[other] in registers and self.locations[other] not in banned]
+            victim = max(victims, key=lambda other: end[other]) if victims else None
+            if victim is not None and end[victim] > end[register]:
+                self.locations[register] = self.locations.pop(victim)
+                active.remove(victim)
+                active.append(register)
+                register = victim
+            spills.append(register)
+        # the spilled ranges which do not overlap share their slots, the
+        # vectors share the ones of their size
+        slots = {}
+        active = []
+        for register in sorted(spills, key=lambda register: (start[register], register.number)):
+            for other in list(active):
+                if end[other] < start[register]:
+                    active.remove(other)
+                    slots.setdefault(other.type in LANE_TYPES, []).append(self.slots[other])
+            if slots.get(register.type in LANE_TYPES):
+                self.slots[register] = slots[register.type in LANE_TYPES].pop()
+            else:
+                self._slot(register)
+            active.append(register)
+        return bool(spills)
+
+    # the register or the stack slot of a virtual register
+    def _location(self, register):
+        return self.locations.get(register) or self.slots[register]
+
+    # the text of an int operand
+    def _source(self, operand):
+        if operand.__class__ is not VirtualRegister:
+            return '$' + str(operand)
+        if operand in self.folded:
+            definition = self.definitions[operand]
+            name = definition.operands[0]
+            if definition.opcode == 'addr':
+                return '$' + name
+            elif definition.opcode == 'load':
+                return self._variable(name)
+            return self._item(name, definition.operands[1])
+        return self._location(operand)
+
+    # a register holding the int operand, a scratch register when it is not
+    # in one
+    def _register(self, operand):
+        source = self._source(operand)
+        if source.startswith('%'):
+            return source
+        register = self.scratch_free.pop(0)
+        self._emit('movl %s, %s' % (source, register))
+        return register
+
+    # the register of a register variable, or the memory of a variable
+    def _variable(self, name):
+        return self.homes.get(name) or self._global(name)
+
+    # the memory operand of a label
+    def _global(self, name):
+        return name
+
+    def _item(self, name, index):
+        if index.__class__ is not VirtualRegister:
+            return name + '+' + str(index * 4) if index else name
+        return '%s(, %s, 4)' % (name, self._register(index))
+
+    def _constant(self, value, _type):
+        constants = self.float_constants if _type == 'float' else self.integer_constants
+        if value not in constants:
+            label = 'label_' + str(self.label_cnt)
+            self.label_cnt += 1
+            self.ass_file_handler.insert(label + ': .' + _type + ' ' + repr(value), 'DATA')
+            constants[value] = label
+        return constants[value]
+
+    # on the x87 stack, not folded and without a slot
+    def _stacked(self, operand):
+        return operand.__class__ is VirtualRegister and operand.type == 'float' and (
+            operand not in self.folded and operand not in self.slots)
+
+    # instruction with the operand in the memory, an int operand is given to
+    # the fi form of it
+    def _float_memory(self, instruction, operand):
+        if operand.__class__ is not VirtualRegister:
+            self._emit('%ss %s' % (instruction, self._constant(float(operand), 'float')))
+            return
+        definition = self.definitions[operand]
+        if operand in self.slots:
+            self._emit('%ss %s' % (instruction, self.slots[operand]))
+        elif definition.opcode != 'itof':
+            self._emit('%ss %s' % (instruction, self._source(operand)))
+        else:
+            self._integer_memory(instruction, definition.operands[0])
+
+    def _integer_memory(self, instruction, operand):
+        if operand.__class__ is not VirtualRegister:
+            self._emit('%ss %s' % (instruction, self._constant(float(operand), 'float')))
+            return
+        source = self._source(operand)
+        if source.startswith('%'):
+            self._emit('pushl ' + source)
+            self._emit('fi%sl (%%esp)' % instruction[1:])
+            self._emit('addl $4, %esp')
+        else:
+            self._emit('fi%sl %s' % (instruction[1:], source))
+
+    # the float operand at the top of the x87 stack
+    def _float_load(self, operand):
+        if self._stacked(operand):
+            return
+        if operand.__class__ is not VirtualRegister and float(operand) in (0.0, 1.0):
+            self._emit('fldz' if float(operand) == 0.0 else 'fld1')
+        else:
+            self._float_memory('fld', operand)
+        self.x87.append(operand)
+
+    # the float value at the top of the x87 stack is the target, it goes to
+    # its slot if it has one
+    def _float_target(self, target):
+        self.x87.append(target)
+        if target in self.slots:
+            self._emit('fstps ' + self.slots[target])
+            self.x87.pop()
+
+    def _load(self, instruction):
+        if instruction.opcode == 'load':
+            source = self._variable(instruction.operands[0])
+        else:
+            source = self._item(*instruction.operands)
+        if instruction.type == 'float':
+            self._emit('flds ' + source)
+            self._float_target(instruction.target)
+        else:
+            self._move(source, instruction.target)
+
+    def _addr(self, instruction):
+        self._move('$' + instruction.operands[0], instruction.target)
+
+    # movl source to the location of target
+    def _move(self, source, target):
+        location = self._location(target)
+        if location.startswith('%') or source.startswith(('%', '$')):
+            self._emit('movl %s, %s' % (source, location))
+        else:
+            register = self.scratch_free.pop(0)
+            self._emit('movl %s, %s' % (source, register))
+            self._emit('movl %s, %s' % (register, location))
+
+    def _store(self, instruction):
+        operands = instruction.operands
+        value = operands[-1]
+        if instruction.opcode == 'store':
+            target = self._variable(operands[0])
+        else:
+            target = self._item(operands[0], operands[1])
+        if instruction.type == 'float':
+            if value.__class__ is not VirtualRegister:
+                # the bits of the float constant
+                self._emit('movl $%d, %s' % (struct.unpack(
+                    '<i', struct.pack('<f', float(value)))[0], target))
+                return
+            self._float_load(value)
+            self._emit('fstps ' + target)
+            self.x87.pop()
+            return
+        definition = self.definitions.get(value)
+        if definition in self.fused and definition.opcode == 'ftoi':
+            self._float_load(definition.operands[0])
+            self._emit('fisttpl ' + target)
+            self.x87.pop()
+        elif definition in self.fused:
+            operand = definition.operands[1]
+            if operand == 1 and operand.__class__ is int:
+                self._emit(('incl ' if definition.opcode == 'add' else 'decl ') + target)
+            else:
+                source = operand if operand.__class__ is not VirtualRegister else None
+                source = '$' + str(operand) if source is not None else self._register(operand)
+                self._emit('%s %s, %s' % (INTEGER_INSTRUCTIONS[definition.opcode], source, target))
+        elif value.__class__ is not VirtualRegister:
+            self._emit('movl $%d, %s' % (value, target))
+        else:
+            self._emit('movl %s, %s' % (self._register(value), target))
+
+    def _operator(self, instruction):
+        if instruction.type == 'float':
+            self._float_operator(instruction)
+        elif instruction.opcode == 'div':
+            self._integer_divide(instruction)
+        else:
+            self._integer_operator(instruction)
+
+    def _integer_operator(self, instruction):
+        operand_a, operand_b = instruction.operands
+        location = self._location(instruction.target)
+        # the constant is the immediate of the instruction
+        if instruction.opcode != 'sub' and operand_a.__class__ is not VirtualRegister:
+            operand_a, operand_b = operand_b, operand_a
+        if instruction.opcode != 'sub' and operand_b.__class__ is VirtualRegister and (
+                operand_b not in self.folded and self._location(operand_b) == location):
+            operand_a, operand_b = operand_b, operand_a
+        register = location if location.startswith('%') else self.scratch_free.pop(0)
+        if instruction.opcode == 'mul' and operand_b.__class__ is not VirtualRegister:
+            self._multiply(self._source(operand_a), operand_b, register)
+        else:
+            source = self._source(operand_a)
+            if source != register:
+                self._emit('movl %s, %s' % (source, register))
+            self._emit('%s %s, %s' % (INTEGER_INSTRUCTIONS[instruction.opcode],
+                                      self._source(operand_b), register))
+        if register != location:
+            self._emit('movl %s, %s' % (register, location))
+
+    # register = source * constant, a shift by the powers of two, a leal for
+    # 3, 5 and 9 and the imull with the immediate for the others
+    def _multiply(self, source, constant, register):
+        if constant > 0 and not constant & (constant - 1):
+            if source != register:
+                self._emit('movl %s, %s' % (source, register))
+            if constant > 1:
+                self._emit('shll $%d, %s' % (constant.bit_length() - 1, register))
+        elif constant in (3, 5, 9):
+            if not source.startswith('%'):
+                self._emit('movl %s, %s' % (source, register))
+                source = register
+            source = self._pointer(source)
+            self._emit('leal (%s, %s, %d), %s' % (source, source, constant - 1, register))
+        else:
+            if source.startswith('$'):
+                self._emit('movl %s, %s' % (source, register))
+                source = register
+            self._emit('imull $%d, %s, %s' % (constant, source, register))
+
+    # the register of an address made of the 32 bit register
+    def _pointer(self, register):
+        return register
+
+    # idivl divides %edx:%eax and puts the quotient in %eax
+    def _integer_divide(self, instruction):
+        operand_a, operand_b = instruction.operands
+        source = self._source(operand_a)
+        constant = operand_b.__class__ is not VirtualRegister
+        if not constant or not self._divide(source, operand_b):
+            if source != '%eax':
+                self._emit('movl %s, %%eax' % source)
+            self._emit('cltd')
+            if constant:
+                self._emit('idivl ' + self._global(self._constant(operand_b, 'int')))
+            else:
+                self._emit('idivl ' + self._source(operand_b))
+        location = self._location(instruction.target)
+        if location != '%eax':
+            self._emit('movl %%eax, %s' % location)
+
+    # %eax = source / divisor without idivl, the dividend is biased by
+    # divisor - 1 when it is negative before it is shifted by a power of
+    # two, and the others are multiplied by the magic number. False when
+    # the divisor is left to idivl
+    def _divide(self, source, divisor):
+        magnitude = abs(divisor)
+        if magnitude >= 2 ** 31 or not magnitude or source.startswith('$'):
+            return False
+        if magnitude == 1 or not magnitude & (magnitude - 1):
+            shift = magnitude.bit_length() - 1
+            if source != '%eax':
+                self._emit('movl %s, %%eax' % source)
+            if shift:
+                self._emit('cltd')
+                self._emit('shrl $%d, %%edx' % (32 - shift))
+                self._emit('addl %edx, %eax')
+                self._emit('sarl $%d, %%eax' % shift)
+        else:
+            multiplier, shift = _divide_magic(magnitude)
+            # the dividend is read again after the product is in %edx:%eax
+            if multiplier >= 2 ** 31 and source in ('%eax', '%edx'):
+                return False
+            if source == '%eax':
+                self._emit('movl $%d, %%edx' % multiplier)
+                self._emit('imull %edx')
+            else:
+                self._emit('movl $%d, %%eax' % (multiplier - 2 ** 32 if multiplier >= 2 ** 31 else multiplier))
+                self._emit('imull ' + source)
+            if multiplier >= 2 ** 31:
+                self._emit('addl %s, %%edx' % source)
+            if shift:
+                self._emit('sarl $%d, %%edx' % shift)
+            self._emit('movl %edx, %eax')
+            self._emit('shrl $31, %eax')
+            self._emit('addl %edx, %eax')
+        if divisor < 0:
+            self._emit('negl %eax')
+        return True
+
+    def _float_operator(self, instruction):
+        operand_a, operand_b = instruction.operands
+        opcode, operand_b = _reciprocal(instruction.opcode, operand_b)
+        if self._stacked(operand_a) and self._stacked(operand_b):
+            # a is st(0) when it was made after b
+            if self.x87[-1] is operand_a:
+                self._emit(FLOAT_INSTRUCTIONS[opcode] + 'p')
+            else:
+                self._emit(REVERSED_FLOAT_INSTRUCTIONS[opcode] + 'p')
+            del self.x87[-2:]
+        elif self._stacked(operand_b):
+            self._float_memory(REVERSED_FLOAT_INSTRUCTIONS[opcode], operand_a)
+            self.x87.pop()
+        else:
+            self._float_load(operand_a)
+            self._float_memory(FLOAT_INSTRUCTIONS[opcode], operand_b)
+            self.x87.pop()
+        self._float_target(instruction.target)
+
+    def _itof(self, instruction):
+        self._integer_memory('fld', instruction.operands[0])
+        self._float_target(instruction.target)
+
+    def _ftoi(self, instruction):
+        self._float_load(instruction.operands[0])
+        location = self._location(instruction.target)
+        if location.startswith('%'):
+            self._emit('subl $4, %esp')
+            self._emit('fisttpl (%esp)')
+            self._emit('popl ' + location)
+        else:
+            self._emit('fisttpl ' + location)
+        self.x87.pop()
+
+    def _call(self, instruction):
+        size = 0
+        for operand in instruction.operands[:0:-1]:
+            if operand.type == 'float':
+                self._float_load(operand)
+                self._emit('subl $8, %esp')
+                self._emit('fstpl (%esp)')
+                self.x87.pop()
+                size += 8
+            else:
+                self._emit('pushl ' + self._source(operand))
+                size += 4
+        self._emit('call ' + instruction.operands[0])
+        if size:
+            self._emit('add $' + str(size) + ', %esp')
+
+    def _return(self, instruction):
+        self._emit('pushl ' + self._source(instruction.operands[0]))
+        self._emit('call exit')
+
+    def _jump(self, instruction):
+        if instruction.operands[0] != self.next_label:
+            self._emit('jmp ' + instruction.operands[0])
+
+    def _branch(self, instruction):
+        operator, operand_a, operand_b, label_true, label_false = instruction.operands
+        taken = _branch_taken(instruction)
+        if taken is not None:
+            if taken != self.next_label:
+                self._emit('jmp ' + taken)
+            return
+        if instruction.type == 'float':
+            jumps = FLOAT_JUMPS
+            operator = self._float_compare(operator, operand_a, operand_b)
+        else:
+            jumps = INTEGER_JUMPS
+            # cmpl b, a compares a with b, a is not a constant and they are
+            # not both in the memory
+            if operand_a.__class__ is not VirtualRegister:
+                operand_a, operand_b = operand_b, operand_a
+                operator = MIRRORED_COMPARISONS.get(operator, operator)
+            source_b = self._source(operand_b)
+            source_a = self._source(operand_a)
+            if not source_a.startswith('%') and not source_b.startswith(('%', '$')):
+                source_a = self._register(operand_a)
+            if source_b == '$0' and source_a.startswith('%'):
+                self._emit('testl %s, %s' % (source_a, source_a))
+            else:
+                self._emit('cmpl %s, %s' % (source_b, source_a))
+        if label_false == self.next_label:
+            self._emit('%s %s' % (jumps[operator], label_true))
+        elif label_true == self.next_label:
+            self._emit('%s %s' % (jumps[NEGATED_COMPARISONS[operator]], label_false))
+        else:
+            self._emit('%s %s' % (jumps[operator], label_true))
+            self._emit('jmp ' + label_false)
+
+    # compares the float operands, the operator of the flags is returned
+    def _float_compare(self, operator, operand_a, operand_b):
+        if self._stacked(operand_a) and self._stacked(operand_b):
+            top_is_a = self.x87[-1] is operand_a
+        elif self._stacked(operand_a):
+            self._float_load(operand_b)
+            top_is_a = False
+        else:
+            self._float_load(operand_a)
+            self._float_load(operand_b)
+            top_is_a = self._stacked(operand_b)
+        # fucomip compares st(0) with st(1)
+        self._emit('fucomip %st(1), %st')
+        self._emit('fstp %st(0)')
+        del self.x87[-2:]
+        if not top_is_a:
+            operator = MIRRORED_COMPARISONS.get(operator, operator)
+        return operator
+
+
+class Assembler64(Assembler):
+    '''
+    x86-64 assembler of the IR for the SysV ABI. the float virtual registers
+    get the xmm registers like the int ones get the general purpose ones
+    and the scalar SSE instructions work on them, the variables are
+    addressed relative to %rip and the arguments of the calls are passed
+    in the registers. the vectors share the xmm registers with the floats
+    '''
+
+    def __init__(self, tree=None, stream=False, peephole=None):
+        Assembler.__init__(self, tree, stream, peephole)
+        self.loop_registers = LONG_LOOP_REGISTERS
+        self.sse = True
+        self.caller_saved = LONG_CALLER_SAVED
+        self.handlers.update({
+            'load_vector': self._load_vector, 'broadcast': self._broadcast,
+            'lane': self._lane, 'sum': self._sum})
+        # labels of the broadcast constants in .data
+        self.vector_constants = {}
+
+    def _registers(self, strict):
+        return {'int': [register for register in LONG_TEMPORARY_REGISTERS
+                        if register not in self.homes.values()],
+                'float': LONG_FLOAT_REGISTERS, 'int4': LONG_FLOAT_REGISTERS,
+                'float4': LONG_FLOAT_REGISTERS}, LONG_SCRATCH_REGISTERS
+
+    # the stack stays aligned to 16 bytes for the calls
+    def _prologue(self):
+        self._emit('pushq %rbp')
+        self._emit('movq %rsp, %rbp')
+        if self.frame:
+            self._emit('subq $%d, %%rsp' % ((self.frame + 15) // 16 * 16))
+
+    # the slots of the vectors are 16 bytes, aligned like %rbp
+    def _slot(self, register):
+        if register.type in LANE_TYPES:
+            self.frame = (self.frame + 31) // 16 * 16
+        else:
+            self.frame += 8
+        self.slots[register] = '-%d(%%rbp)' % self.frame
+
+    def _global(self, name):
+        return name + '(%rip)'
+
+    def _pointer(self, register):
+        return QUAD_REGISTERS[register]
+
+    # the address of the array is put in a scratch register
+    def _item(self, name, index):
+        if index.__class__ is not VirtualRegister:
+            return self._global(name + '+' + str(index * 4) if index else name)
+        index = self._pointer(self._register(index))
+        base = self._pointer(self.scratch_free.pop(0))
+        self._emit('leaq %s, %s' % (self._global(name), base))
+        return '(%s, %s, 4)' % (base, index)
+
+    # the text of a float operand, the constants are in .data
+    def _float_source(self, operand):
+        if operand.__class__ is not VirtualRegister:
+            return self._global(self._constant(float(operand), 'float'))
+        return self._source(operand)
+
+    # movss source to target, through %xmm15 when both are in the memory
+    def _float_move(self, source, target):
+        if source == target:
+            return
+        if not source.startswith('%') and not target.startswith('%'):
+            self._emit('movss %s, %%xmm15' % source)
+            source = '%xmm15'
+        self._emit('movss %s, %s' % (source, target))
+
+    def _load(self, instruction):
+        if instruction.type != 'float':
+            Assembler._load(self, instruction)
+            return
+        if instruction.opcode == 'load':
+            source = self._variable(instruction.operands[0])
+        else:
+            source = self._item(*instruction.operands)
+        self._float_move(source, self._location(instruction.target))
+
+    def _addr(self, instruction):
+        location = self._location(instruction.target)
+        register = location if location.startswith('%') else self.scratch_free.pop(0)
+        self._emit('leaq %s, %s' % (self._global(instruction.operands[0]), QUAD_REGISTERS[register]))
+        if register != location:
+            self._emit('movq %s, %s' % (QUAD_REGISTERS[register], location))
+
+    def _store(self, instruction):
+        value = instruction.operands[-1]
+        if instruction.type != 'float' or value.__class__ is not VirtualRegister:
+            Assembler._store(self, instruction)
+            return
+        source = self._float_source(value)
+        if instruction.opcode == 'store':
+            target = self._variable(instruction.operands[0])
+        else:
+            target = self._item(instruction.operands[0], instruction.operands[1])
+        self._float_move(source, target)
+
+    def _float_operator(self, instruction):
+        operand_a, operand_b = instruction.operands
+        opcode, operand_b = _reciprocal(instruction.opcode, operand_b)
+        location = self._location(instruction.target)
+        if opcode in ('add', 'mul') and operand_b.__class__ is VirtualRegister and (
+                operand_b not in self.folded and self._location(operand_b) == location):
+            operand_a, operand_b = operand_b, operand_a
+        source_b = self._float_source(operand_b)
+        register = location
+        # b would be overwritten by a in the register of the target
+        if not location.startswith('%') or source_b == location and operand_a is not operand_b:
+            register = '%xmm14'
+        self._float_move(self._float_source(operand_a), register)
+        self._emit('%s %s, %s' % (SSE_INSTRUCTIONS[opcode], source_b, register))
+        self._float_move(register, location)
+
+    def _itof(self, instruction):
+        operand = instruction.operands[0]
+        location = self._location(instruction.target)
+        if instruction.type in LANE_TYPES:
+            register = location if location.startswith('%') else '%xmm15'
+            self._emit('cvtdq2ps %s, %s' % (self._vector_source(operand), register))
+            self._vector_move(register, location)
+            return
+        if operand.__class__ is not VirtualRegister:
+            self._float_move(self._float_source(operand), location)
+            return
+        register = location if location.startswith('%') else '%xmm15'
+        self._emit('cvtsi2ssl %s, %s' % (self._source(operand), register))
+        self._float_move(register, location)
+
+    def _ftoi(self, instruction):
+        location = self._location(instruction.target)
+        register = location if location.startswith('%') else self.scratch_free.pop(0)
+        self._emit('cvttss2si %s, %s' % (self._float_source(instruction.operands[0]), register))
+        if register != location:
+            self._emit('movl %s, %s' % (register, location))
+
+    # movdqa between the registers and from the aligned memory, movdqu to
+    # and from the memory which may not be aligned
+    def _vector_move(self, source, target, aligned=False):
+        if source == target:
+            return
+        if aligned or source.startswith('%') and target.startswith('%'):
+            self._emit('movdqa %s, %s' % (source, target))
+        else:
+            self._emit('movdqu %s, %s' % (source, target))
+
+    # a register holding the vector, %xmm15 when it is in the memory
+    def _vector_source(self, operand):
+        source = self._location(operand)
+        if not source.startswith('%'):
+            self._vector_move(source, '%xmm15')
+            source = '%xmm15'
+        return source
+
+    def _operator(self, instruction):
+        if instruction.type in LANE_TYPES:
+            self._vector_operator(instruction)
+        else:
+            Assembler._operator(self, instruction)
+
+    # a is copied to the register of the target, or to %xmm13 when b is in
+    # it. the int lanes are multiplied in pairs by pmuludq, the odd ones are
+    # shuffled to the even ones in %xmm14 and %xmm15 and the low halves of
+    # the products are put together
+    def _vector_operator(self, instruction):
+        operand_a, operand_b = instruction.operands
+        location = self._location(instruction.target)
+        source_b = self._vector_source(operand_b)
+        register = location
+        if not location.startswith('%') or location == source_b:
+            register = '%xmm13'
+        self._vector_move(self._location(operand_a), register)
+        if instruction.type == 'int4' and instruction.opcode == 'mul':
+            self._emit('pshufd $0xf5, %s, %%xmm14' % register)
+            self._emit('pmuludq %s, %s' % (source_b, register))
+            self._emit('pshufd $0xf5, %s, %%xmm15' % source_b)
+            self._emit('pmuludq %xmm15, %xmm14')
+            self._emit('pshufd $8, %s, %s' % (register, register))
+            self._emit('pshufd $8, %xmm14, %xmm14')
+            self._emit('punpckldq %%xmm14, %s' % register)
+        else:
+            self._emit('%s %s, %s' % (
+                VECTOR_INSTRUCTIONS[instruction.type][instruction.opcode], source_b, register))
+        self._vector_move(register, location)
+
+    def _load_vector(self, instruction):
+        name = instruction.operands[0]
+        location = self._location(instruction.target)
+        register = location if location.startswith('%') else '%xmm15'
+        self._vector_move(self._item(*instruction.operands), register,
+                          self.program.symbols[name].get('aligned'))
+        self._vector_move(register, location)
+
+    # the constant is in all the lanes of an aligned vector in .data
+    def _broadcast(self, instruction):
+        value = instruction.operands[0]
+        _type = LANE_TYPES[instruction.type]
+        if (value, _type) not in self.vector_constants:
+            label = 'label_' + str(self.label_cnt)
+            self.label_cnt += 1
+            self.ass_file_handler.insert('.balign 16', 'DATA')
+            self.ass_file_handler.insert('%s: .%s %s' % (
+                label, _type, ', '.join([repr(value)] * VECTOR_LANES)), 'DATA')
+            self.vector_constants[value, _type] = label
+        location = self._location(instruction.target)
+        register = location if location.startswith('%') else '%xmm15'
+        self._vector_move(self._global(self.vector_constants[value, _type]), register, True)
+        self._vector_move(register, location)
+
+    # the lane is shuffled to the low one
+    def _lane(self, instruction):
+        vector, lane = instruction.operands
+        location = self._location(instruction.target)
+        register = location if location.startswith('%') else '%xmm15'
+        self._emit('pshufd $%d, %s, %s' % (lane, self._vector_source(vector), register))
+        self._float_move(register, location)
+
+    # the high half is added to the low one, and the two lanes left
+    def _sum(self, instruction):
+        source = self._vector_source(instruction.operands[0])
+        self._emit('pshufd $0x4e, %s, %%xmm14' % source)
+        self._emit('paddd %s, %%xmm14' % source)
+        self._emit('pshufd $0xb1, %xmm14, %xmm15')
+        self._emit('paddd %xmm15, %xmm14')
+        self._emit('movd %%xmm14, %s' % self._location(instruction.target))
+
+    # ucomiss b, a compares a with b, a is in a register
+    def _float_compare(self, operator, operand_a, operand_b):
+        source_a = self._float_source(operand_a)
+        if not source_a.startswith('%'):
+            self._float_move(source_a, '%xmm15')
+            source_a = '%xmm15'
+        self._emit('ucomiss %s, %s' % (self._float_source(operand_b), source_a))
+        return operator
+
+    # the int arguments go to the int argument registers, the float ones are
+    # converted to double in the xmm argument registers, the others are
+    # pushed. %al is the number of the xmm registers used
+    def _call(self, instruction):
+        moves = []
+        pushed = []
+        integers = list(INTEGER_ARGUMENTS)
+        floats = list(FLOAT_ARGUMENTS)
+        for operand in instruction.operands[1:]:
+            registers = floats if operand.type == 'float' else integers
+            if registers:
+                moves.append((operand, registers.pop(0)))
+            else:
+                pushed.append(operand)
+        size = 8 * len(pushed)
+        if size % 16:
+            self._emit('subq $8, %rsp')
+            size += 8
+        for operand in reversed(pushed):
+            if operand.type == 'float':
+                self._emit('cvtss2sd %s, %%xmm15' % self._float_source(operand))
+                self._emit('subq $8, %rsp')
+                self._emit('movsd %xmm15, (%rsp)')
+            elif self._address(operand):
+                self._argument(operand, '%r11d')
+                self._emit('pushq %r11')
+            else:
+                source = self._source(operand)
+                if not source.startswith(('%', '$')):
+                    self._emit('movl %s, %%r11d' % source)
+                    source = '%r11d'
+                self._emit('pushq ' + QUAD_REGISTERS.get(source, source))
+        # a register is written when no other argument is still in it, a
+        # cycle of them is broken through %r11 or %xmm15
+        operands = dict((register, operand) for operand, register in moves)
+        sources = dict((register, self._argument_source(operand)) for operand, register in moves)
+        pending = [register for operand, register in moves]
+        while pending:
+            ready = [register for register in pending if all(
+                sources[other] != register for other in pending if other != register)]
+            if ready:
+                pending.remove(ready[0])
+                self._argument(operands[ready[0]], ready[0], sources[ready[0]])
+                continue
+            register = pending[0]
+            if register.startswith('%xmm'):
+                temporary = '%xmm15'
+                self._emit('movss %s, %s' % (register, temporary))
+            else:
+                temporary = '%r11d'
+                self._emit('movq %s, %%r11' % QUAD_REGISTERS[register])
+            for other in pending:
+                if sources[other] == register:
+                    sources[other] = temporary
+        self._emit('movl $%d, %%eax' % (len(FLOAT_ARGUMENTS) - len(floats)))
+        self._emit('call ' + instruction.operands[0])
+        if size:
+            self._emit('addq $%d, %%rsp' % size)
+
+    # an address, which takes the 64 bits of a register
+    def _address(self, operand):
+        return operand.__class__ is VirtualRegister and self.definitions[operand].opcode == 'addr'
+
+    # the register an argument is in, None when it is not in one
+    def _argument_source(self, operand):
+        if operand.__class__ is not VirtualRegister or operand in self.folded:
+            return None
+        location = self._location(operand)
+        return location if location.startswith('%') else None
+
+    # puts the argument in register, from source when it was moved
+    def _argument(self, operand, register, source=None):
+        if operand.type == 'float':
+            self._emit('cvtss2sd %s, %s' % (source or self._float_source(operand), register))
+        elif self._address(operand) and operand in self.folded:
+            self._emit('leaq %s, %s' % (self._global(self.definitions[operand].operands[0]),
+                                        QUAD_REGISTERS[register]))
+        elif self._address(operand):
+            source = source or self._location(operand)
+            self._emit('movq %s, %s' % (QUAD_REGISTERS.get(source, source), QUAD_REGISTERS[register]))
+        else:
+            source = source or self._source(operand)
+            if source != register:
+                self._emit('movl %s, %s' % (source, register))
+
+    def _return(self, instruction):
+        self._emit('movl %s, %%edi' % self._source(instruction.operands[0]))
+        self._emit('call exit')
+
+
+def lexer():
+    lexer = Lexer()
+    if stream_mode:
+        tokens = lexer.stream(source_name)
+    else:
+        lexer.main()
+        tokens = [(lexer.tokens.kind(index), lexer.tokens.value(index))
+                  for index in range(len(lexer.tokens))]
+    for kind, value in tokens:
+        print (TOKEN_TYPES[kind], value)
+
+
+# FIRST and FOLLOW sets and the LL(1) parse table of grammar.txt
+def grammar():
+    def names(symbols):
+        return ' '.join(sorted(
+            'empty' if symbol is None else Grammar.symbol_name(symbol)
+            for symbol in symbols))
+    for name in sorted(GRAMMAR.productions):
+        print ('%s FIRST: %s FOLLOW: %s' % (
+            name, names(GRAMMAR.first[name]), names(GRAMMAR.follow[name])))
+    for (name, kind), alternative in sorted(GRAMMAR.table.items()):
+        print ('%s, %s --> %s' % (name, Grammar.symbol_name(kind), ' '.join(
+            Grammar.symbol_name(symbol) for symbol in alternative)))
+
+
+def parser():
+    parser = Parser()
+    parser.main()
+    parser.display(parser.tree.root)
+
+
+# the counts of the rewrites of an -O pass go to stderr, so they do not mix
+# with the output of the program
+def _report(name, report):
+    sys.stderr.write('%s: %s\n' % (name, report))
+
+
+# the syntax tree of the source, from the cache when it is there
+def _syntax_tree():
+    tree = None
+    if cache_dir:
+        cache = AstCache(cache_dir)
+        key = cache.file_key(source_name) if stream_mode else cache.key(content)
+        tree = cache.load(key)
+    if tree is None:
+        parser = Parser()
+        parser.main()
+        tree = parser.tree
+        if cache_dir:
+            cache.store(key, tree)
+    return tree
+
+
+# the IR of the tree, under -O the tree is folded first and the control
+# flow of the IR is optimized, the errors of the verifier stop the compiler
+def _intermediate(tree, vectors=True):
+    if optimize:
+        folder = ConstantFolder(tree, long_mode)
+        folder.run()
+        _report('constant folding', folder.report())
+    program = IRBuilder().build(tree.root)
+    if optimize:
+        control = ControlFlowOptimizer()
+        control.run(program)
+        _report('control flow', control.report())
+        if long_mode and vectors:
+            vectorizer = LoopVectorizer()
+            vectorizer.run(program)
+            _report('vectorizer', vectorizer.report())
+        loops = LoopOptimizer()
+        loops.run(program)
+        _report('loops', loops.report())
+        numbering = ValueNumbering(long_mode)
+        numbering.run(program)
+        _report('value numbering', numbering.report())
+        cleaner = ProgramCleaner()
+        cleaner.run(program)
+        _report('cleanup', cleaner.report())
+    errors = program.verify()
+    if errors:
+        for error in errors:
+            print ('IR error: ' + error)
+        exit()
+    return program
+
+
+def intermediate():
+    for line in _intermediate(_syntax_tree()).dump():
+        print (line)
+
+
+# the assembler of the target, with the peephole optimizer under -O
+def _assembler(tree, stream=False):
+    if not long_mode:
+        return Assembler(tree, stream, Peephole() if optimize else None)
+    # the SysV calls read the argument registers and %al
+    peephole = Peephole(arguments=INTEGER_ARGUMENTS + ['%eax']) if optimize else None
+    return Assembler64(tree, stream, peephole)
+
+
+def assembler():
+    tree = _syntax_tree()
+    program = _intermediate(tree)
+    assem = _assembler(tree, stream_mode)
+    assem.emit(program)
+    assem.ass_file_handler.generate_ass_file()
+    if optimize:
+        _report('peephole', assem.ass_file_handler.peephole.report())
+
+
+# the object file of the source, encoded without the system assembler
+def elf():
+    tree = _syntax_tree()
+    program = _intermediate(tree)
+    assem = _assembler(tree)
+    assem.emit(program)
+    assem.ass_file_handler.generate_object_file(long_mode)
+    if optimize:
+        _report('peephole', assem.ass_file_handler.peephole.report())
+
+
+# the exit status of the x86-64 code of the tree run in this process
+def _run(tree):
+    program = _intermediate(tree)
+    assem = _assembler(tree)
+    assem.emit(program)
+    jit = JitProgram(assem.ass_file_handler.object_file(
+        True, JIT_LINES, ['.lcomm jit_stack, 8']))
+    if optimize:
+        _report('peephole', assem.ass_file_handler.peephole.report())
+    try:
+        return jit.run()
+    finally:
+        jit.close()
+
+
+def run():
+    status = _run(_syntax_tree())
+    if status:
+        exit(status)
+
+
+# the status main returns, of the bytecode of the tree run by the virtual
+# machine. it has no vectors, its floats are the ones of SSE with --m64
+def _interpret(tree):
+    bytecode = BytecodeCompiler(_intermediate(tree, False)).compile()
+    sys.stdout.flush()
+    return VirtualMachine(bytecode, long_mode).run()
+
+
+def interpret():
+    status = _interpret(_syntax_tree())
+    if status:
+        exit(status)
+
+
+# assemble the source again whenever it is saved, only the changed sentences
+# are parsed again
+def watch(interval=0.5):
+    parser = IncrementalParser()
+    mtime = None
+    try:
+        while True:
+            new_mtime = os.stat(source_name).st_mtime
+            if new_mtime != mtime:
+                mtime = new_mtime
+                source_file = open(source_name, 'rb')
+                source = source_file.read()
+                source_file.close()
+                start = time.time()
+                tree = parser.parse(source)
+                parse_cost = time.time() - start
+                start = time.time()
+                if optimize:
+                    # the parser keeps its tree for the next edit, a copy of
+                    # it is folded
+                    arena = SyntaxTreeArena()
+                    arena.pack(tree.root)
+                    tree = SyntaxTree()
+                    tree.root = arena.unpack()
+                assem = _assembler(tree)
+                assem.emit(_intermediate(tree))
+                assem.ass_file_handler.generate_ass_file()
+                print ('%s: parsed in %.3fs, assembled in %.3fs' % (
+                    source_name, parse_cost, time.time() - start))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    try:
+        opts, argvs = getopt.getopt(sys.argv[1:], 's:lpgiamc:nwOervh', ['help', 'm64'])
+    except:
+        print (__doc__)
+        exit()
+
+    actions = []
     for opt, argv in opts:
         if opt in ['-h', '--h', '--help']:
             print (__doc__)
             exit()
         elif opt == '-s':
             file_name = argv.split('.')[0]
-            source_file = open(argv, 'r')
-            content = source_file.read()
-        elif opt == '-l':
+            source_name = argv
+        elif opt == '-m':
+            stream_mode = True
+        elif opt == '-c':
+            cache_dir = argv
+        elif opt == '-n':
+            cache_dir = None
+        elif opt == '-O':
+            optimize = True
+        elif opt == '--m64':
+            long_mode = True
+        else:
+            actions.append(opt)
+
+    # the code run in this process is the x86-64 one
+    if '-r' in actions:
+        long_mode = True
+    # only -g goes without a source file
+    if set(actions) - set(['-g']) and not source_name:
+        print (__doc__)
+        exit()
+    if source_name and not stream_mode:
+        source_file = open(source_name, 'rb')
+        content = source_file.read()
+        source_file.close()
+
+    for action in actions:
+        if action == '-l':
             lexer()
-        elif opt == '-p':
+        elif action == '-p':
             parser()
-        elif opt == '-a':
+        elif action == '-g':
+            grammar()
+        elif action == '-i':
+            intermediate()
+        elif action == '-a':
             assembler()
+        elif action == '-e':
+            elf()
+        elif action == '-r':
+            run()
+        elif action == '-v':
+            interpret()
+        elif action == '-w':
+            watch()
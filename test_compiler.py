@@ -0,0 +1,1214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Tests of compiler.py, run them with python -m pytest
+'''
+
+import os
+import re
+import shutil
+import sys
+import subprocess
+
+import pytest
+
+import compiler
+import benchmark
+
+COMPILER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compiler.py')
+
+LEXER_SOURCE = '''#include <stdio.h>
+int main() {
+    float x_1;
+    x_1 = 3.25 * (x_1 - 2) / 7;
+    if (x_1 >= 1) { x_1++; } else { x_1--; }
+    printf("%f <= %d\\n", x_1, 10 <= 2);
+    return 0;
+}
+'''
+
+
+# the output of compiler.py with options on the source, in directory
+def _compile(directory, source, options, stdin=b''):
+    path = os.path.join(str(directory), 'program.c')
+    source_file = open(path, 'wb')
+    source_file.write(source.encode('ascii'))
+    source_file.close()
+    process = subprocess.Popen(
+        [sys.executable, COMPILER, '-s', 'program.c', '-n'] + list(options),
+        cwd=str(directory), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate(stdin)
+    return process.returncode, stdout.decode('latin-1'), stderr.decode('latin-1')
+
+
+# the text of the file name in directory
+def _read(directory, name):
+    text_file = open(os.path.join(str(directory), name))
+    text = text_file.read()
+    text_file.close()
+    return text
+
+
+# the lines of each section of an assembler file
+def _sections(text):
+    sections = {}
+    lines = None
+    for line in text.split('\n'):
+        if line in ['.data', '.bss', '.text']:
+            lines = sections.setdefault(line, [])
+        elif line:
+            lines.append(line)
+    return sections
+
+
+def _source():
+    source_file = open(os.path.join(os.path.dirname(COMPILER), 'source.c'), 'rb')
+    source = source_file.read().decode('ascii')
+    source_file.close()
+    return source
+
+
+# the tree of the source parsed by a cold Parser
+def _parse(source):
+    compiler.content = source.encode('ascii')
+    parser = compiler.Parser()
+    parser.main()
+    return parser.tree
+
+
+# the depth, value, type and extra_info of the nodes under node in preorder
+def _shape(node):
+    shape = []
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        shape.append((depth, node.value, node.type, node.extra_info))
+        son = node.last_son
+        while son:
+            stack.append((son, depth + 1))
+            son = son.left
+    return shape
+
+
+def _depth(tree):
+    depth = deepest = 0
+    for node, entering in tree.root.walk():
+        depth += 1 if entering else -1
+        deepest = max(deepest, depth)
+    return deepest
+
+
+# the expression under node with brackets around every operator
+def _expression(node):
+    if node.type in ('Constant', 'Variable'):
+        return node.first_son.value
+    sons = []
+    son = node.first_son
+    while son:
+        sons.append(_expression(son) if son.value == 'Expression' else son.first_son.value)
+        son = son.right
+    if node.type == 'SingleOperand':
+        return '(%s%s)' % tuple(sons)
+    return '(%s %s %s)' % tuple(sons)
+
+
+# the expressions of the assignments in the tree
+def _assignments(tree):
+    expressions = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if node.value == 'Assignment':
+            expressions.append(_expression(node.first_son.right))
+            continue
+        son = node.last_son
+        while son:
+            stack.append(son)
+            son = son.left
+    return expressions
+
+
+# the (type, value) of the tokens lexed by lex from content
+def _tokens(lex, content):
+    compiler.content = content
+    lexer = compiler.Lexer()
+    lex(lexer)
+    tokens = lexer.tokens
+    if isinstance(tokens, list):
+        return [(token.type, token.value) for token in tokens]
+    return [(compiler.TOKEN_TYPES[tokens.kind(index)], tokens.value(index))
+            for index in range(len(tokens))]
+
+
+# the master regex gives the tokens of the character by character lexer
+def test_lexer_matches_by_char():
+    for text in [_source(), LEXER_SOURCE]:
+        tokens = _tokens(compiler.Lexer.main, text.encode('ascii'))
+        assert tokens == _tokens(benchmark._lex_by_char, text)
+    assert tokens[:6] == [
+        ('SHARP', '#'), ('INCLUDE', 'include'), ('LT', '<'),
+        ('IDENTIFIER', 'stdio.h'), ('GT', '>'), ('INT', 'int')]
+    assert ('DIGIT_CONSTANT', '3.25') in tokens
+    assert ('STRING_CONSTANT', '%f <= %d\\n') in tokens
+
+
+# the tokens of a memory-mapped file are the ones of the file read whole,
+# and -m assembles the same file
+def test_lexer_stream(tmp_path):
+    assert _compile(tmp_path, LEXER_SOURCE, ['-l'])[0] == 0
+    path = os.path.join(str(tmp_path), 'program.c')
+    tokens = [(compiler.TOKEN_TYPES[token[0]], token[1])
+              for token in compiler.Lexer().stream(path)]
+    assert tokens == _tokens(compiler.Lexer.main, LEXER_SOURCE.encode('ascii'))
+    assert _compile(tmp_path, _source(), ['-a'])[0] == 0
+    buffered = _read(tmp_path, 'program.S')
+    assert _compile(tmp_path, _source(), ['-m', '-a'])[0] == 0
+    assert _sections(_read(tmp_path, 'program.S')) == _sections(buffered)
+
+
+def test_token_stream_release():
+    stream = compiler.TokenStream(
+        (compiler.T_IDENTIFIER, str(index), -1) for index in range(10))
+    assert stream.value(3) == '3'
+    stream.release(2)
+    assert stream.value(2) == '2' and stream.kind(9) == compiler.T_IDENTIFIER
+    for index in [1, 10]:
+        try:
+            stream.kind(index)
+        except IndexError:
+            pass
+        else:
+            assert False, index
+
+
+# the kinds of the tokens are small ints, the values come from the source
+def test_token_array():
+    source = b'#include "tools.h"\nint main() {\n    return 0;\n}\n'
+    compiler.content = source
+    lexer = compiler.Lexer()
+    lexer.main()
+    tokens = lexer.tokens
+    assert tokens.kinds.typecode == 'B'
+    assert [compiler.TOKEN_TYPES[tokens.kind(index)] for index in range(5)] == [
+        'SHARP', 'INCLUDE', 'DOUBLE_QUOTE', 'IDENTIFIER', 'DOUBLE_QUOTE']
+    assert tokens.value(3) == 'tools.h'
+    assert source[tokens.starts[6]:tokens.ends[6]] == b'main'
+    parser = compiler.Parser()
+    parser.main()
+    assert parser.index == len(tokens)
+
+
+def test_syntax_tree_arena():
+    tree = _parse(_source())
+    arena = compiler.SyntaxTreeArena()
+    assert arena.pack(tree.root) == 0
+    root = arena.unpack()
+    assert len(arena) == len(_shape(tree.root)) > 100
+    assert _shape(root) == _shape(tree.root)
+    # the sons are linked both ways and the last one is kept
+    sons = []
+    son = root.first_son
+    while son:
+        assert son.father is root
+        sons.append(son)
+        son = son.right
+    assert root.last_son is sons[-1] and sons[-1].left is sons[-2]
+    tree.switch(sons[0], sons[1])
+    assert root.first_son is sons[1] and root.first_son.right is sons[0]
+
+
+# the operators of a level are left associative, the brackets and the
+# priorities nest the levels
+def test_parser_expressions(tmp_path):
+    tree = _parse('int main() {\n    int x;\n    x = 1 - 2 - 3 * (4 + x++);\n'
+                  '    x = (x) / 2 * --x >= 7 + 8;\n    return 0;\n}\n')
+    assert _assignments(tree) == [
+        '((1 - 2) - (3 * (4 + (++x))))', '(((x / 2) * (--x)) >= (7 + 8))']
+    source = 'int main() {\n    int x;\n    x = 1 2;\n    return 0;\n}\n'
+    assert 'expression error!' in _compile(tmp_path, source, ['-p'])[1]
+
+
+BRACKET_SOURCE = '''int main() {
+    int a[4];
+    int x;
+    x = (a[(1 + 2)] - 3);
+    if (x > (1)) {
+        x = 1;
+    }
+    return 0;
+}
+'''
+
+
+# the brackets are paired by the lexer, an unpaired one is reported with
+# the line it is in
+def test_bracket_match(tmp_path):
+    compiler.content = BRACKET_SOURCE.encode('ascii')
+    lexer = compiler.Lexer()
+    lexer.main()
+    tokens = lexer.tokens
+    # int main ( ) {
+    assert tokens.match(2) == 3 and tokens.match(3) == 2 and tokens.match(0) == -1
+    assert tokens.kind(tokens.match(4)) == compiler.T_RB_BRACKET
+    assert tokens.match(4) == len(tokens) - 1
+    path = os.path.join(str(tmp_path), 'program.c')
+    source_file = open(path, 'wb')
+    source_file.write(BRACKET_SOURCE.encode('ascii'))
+    source_file.close()
+    stream = compiler.TokenStream(compiler.Lexer().stream(path))
+    for index in range(len(tokens)):
+        if tokens.kind(index) in compiler.OPENING_KINDS:
+            assert stream.match(index) == tokens.match(index)
+    for old, new, error in [
+            ('(1 + 2)]', '(1 + 2]', '] in line 4'),
+            ('(1 + 2)]', '1 + 2)]', ') in line 4'),
+            ('(1)) {', '(1) {', '} in line 9'),
+            ('    }\n', '    }\n    }\n', '} in line 10')]:
+        source = BRACKET_SOURCE.replace(old, new)
+        output = _compile(tmp_path, source, ['-p'])[1]
+        assert output.strip() == 'error: unbalanced bracket ' + error
+        # a stream reports the errors the parser reaches first
+        assert 'error' in _compile(tmp_path, source, ['-m', '-p'])[1]
+
+
+def test_parser_nested_blocks():
+    depth = 2000
+    tree = _parse('int main() {\n    int x;\n    x = 0;\n%s    x = x + 1;\n%s'
+                  '    return 0;\n}\n' % ('if (x < 1) {\n' * depth,
+                                          '} else {\n    x = 2;\n}\n' * depth))
+    # a Control, an IfControl and a Sentence for each if
+    assert _depth(tree) > depth * 3
+
+
+def test_parser_nested_brackets():
+    depth = 2000
+    tree = _parse('int main() {\n    int x;\n    x = %s1%s;\n    return 0;\n}\n' % (
+        '(' * depth, ' + 1)' * depth))
+    assert _depth(tree) > depth
+
+
+# the tree of a deep nesting is displayed and assembled without recursion
+def test_nested_blocks_assemble(tmp_path):
+    depth = 2000
+    source = ('int main() {\n    int x;\n    x = 0;\n%s    x = x + 1;\n%s'
+              '    return 0;\n}\n' % ('if (x < 1) {\n' * depth, '}\n' * depth))
+    status, stdout, stderr = _compile(tmp_path, source, ['-p'])
+    assert (status, stderr) == (0, '')
+    assert stdout.count('( self:  IfControl ,') == depth
+    assert _compile(tmp_path, source, ['-a']) == (0, '', '')
+    assert _read(tmp_path, 'program.S').count('cmpl') == depth
+
+
+# the virtual machine runs loops nested thousands deep, with and without -O
+def test_nested_blocks_run(tmp_path):
+    depth = 3000
+    source = ('int main() {\n    int x;\n    x = 0;\n%s    x = x + 1;\n%s'
+              '    printf("%%d\\n", x);\n    return 0;\n}\n' % (
+                  'while (x < 1) {\n' * depth, '}\n' * depth))
+    assert _compile(tmp_path, source, ['-v']) == (0, '1\n', '')
+    status, stdout, stderr = _compile(tmp_path, source, ['-v', '-O'])
+    assert (status, stdout) == (0, '1\n')
+    assert 'loops: promotions %d, ' % depth in stderr
+
+
+# the .text lines of -m are written as they come, before the .data and .bss
+# sections, and they are the lines of the buffered file
+def test_streamed_text(tmp_path):
+    source = 'int main() {\n    int x;\n%s    return 0;\n}\n' % (
+        '    x = 1;\n    printf("%d\\n", x);\n' * 500)
+    assert _compile(tmp_path, source, ['-a']) == (0, '', '')
+    buffered = _read(tmp_path, 'program.S')
+    assert buffered.startswith('.data\n')
+    assert _compile(tmp_path, source, ['-m', '-a']) == (0, '', '')
+    streamed = _read(tmp_path, 'program.S')
+    assert streamed.startswith('.text\n')
+    assert _sections(streamed) == _sections(buffered)
+    assert len(_sections(buffered)['.data']) == 500
+    assert len(streamed.split('\n')) == len(buffered.split('\n'))
+
+
+def test_ast_cache(tmp_path):
+    directory = os.path.join(str(tmp_path), 'cache')
+    cache = compiler.AstCache(directory)
+    source = _source().encode('ascii')
+    key = cache.key(source)
+    assert key == cache.key(source) != cache.key(source + b'\n')
+    assert cache.load(key) is None
+    tree = _parse(_source())
+    cache.store(key, tree)
+    assert _shape(cache.load(key).root) == _shape(tree.root)
+    # a broken entry is a miss
+    path = os.path.join(directory, key + '.ast')
+    entry_file = open(path, 'r+b')
+    entry_file.truncate(20)
+    entry_file.close()
+    assert cache.load(key) is None
+    # the least recently used entries go when the directory is too big
+    cache.store(key, tree)
+    size = os.path.getsize(path)
+    cache.max_size = size * 2
+    other = cache.key(b'other')
+    cache.store(other, tree)
+    os.utime(path, (1000, 1000))
+    os.utime(os.path.join(directory, other + '.ast'), (2000, 2000))
+    assert cache.load(key) is not None
+    cache.store(cache.key(b'third'), tree)
+    assert sorted(os.listdir(directory)) == sorted(
+        [key + '.ast', cache.key(b'third') + '.ast'])
+
+
+# the keys change with the version, the code and the grammar of the parser
+def test_ast_cache_key(tmp_path, monkeypatch):
+    for name in ['compiler.py', 'grammar.txt']:
+        shutil.copy(os.path.join(os.path.dirname(COMPILER), name), str(tmp_path))
+    cache = compiler.AstCache(str(tmp_path))
+    key = cache.key(b'int x;')
+    monkeypatch.setattr(compiler, '__file__', os.path.join(str(tmp_path), 'compiler.py'))
+    assert cache.key(b'int x;') == key
+    grammar_file = open(os.path.join(str(tmp_path), 'grammar.txt'), 'ab')
+    grammar_file.write(b'\n')
+    grammar_file.close()
+    changed = cache.key(b'int x;')
+    assert changed != key
+    monkeypatch.setattr(compiler, 'VERSION', compiler.VERSION + '.1')
+    assert cache.key(b'int x;') not in (key, changed)
+
+
+# -a reads the tree of an unchanged source from the cache
+def test_ast_cache_assembler(tmp_path):
+    assert _compile(tmp_path, _source(), ['-a'])[0] == 0
+    assembler = _read(tmp_path, 'program.S')
+    for options in [['-c', 'cache', '-a'], ['-c', 'cache', '-a'], ['-c', 'cache', '-m', '-a']]:
+        process = subprocess.Popen(
+            [sys.executable, COMPILER, '-s', 'program.c'] + options, cwd=str(tmp_path))
+        assert process.wait() == 0
+        assert _sections(_read(tmp_path, 'program.S')) == _sections(assembler)
+    # the key of a mapped file is the one of its source read whole
+    assert len(os.listdir(os.path.join(str(tmp_path), 'cache'))) == 1
+
+
+# the .text lines through the peephole optimizer with the rules, and the
+# rules that rewrote them
+def _peephole(lines, rules=None):
+    peephole = compiler.Peephole(rules)
+    instructions = peephole.run([compiler.Instruction(line) for line in lines])
+    hits = dict((name, hits) for name, hits in peephole.hits.items() if hits)
+    return [instruction.line for instruction in instructions], hits
+
+
+def test_peephole_rules():
+    assert compiler.Instruction('leal 4(%eax, %ebx, 2), %ecx').operands == [
+        '4(%eax, %ebx, 2)', '%ecx']
+    assert _peephole(['movl %eax, x', 'movl x, %edi', 'pushl %edi', 'call f']) == (
+        ['movl %eax, x', 'movl %eax, %edi', 'pushl %edi', 'call f'], {'store_load': 1})
+    assert _peephole(['fstps x', 'flds x', 'fstps y', 'call f']) == (
+        ['fsts x', 'fstps y', 'call f'], {'store_load': 1})
+    assert _peephole(['movl $1, x', 'movl $2, x', 'pushl x', 'call f']) == (
+        ['movl $2, x', 'pushl x', 'call f'], {'dead_store': 1})
+    assert _peephole(['movl $5, %ecx', 'movl %ecx, b', 'pushl b', 'call f']) == (
+        ['movl $5, b', 'pushl b', 'call f'], {'move_coalesce': 1})
+    assert _peephole(['jmp label_1', 'label_1:', 'call f']) == (
+        ['label_1:', 'call f'], {'redundant_jump': 1})
+    rules = [('redundant_store', compiler._redundant_store)]
+    assert _peephole(['movl %eax, x', 'pushl y', 'movl %eax, x', 'pushl x', 'call f'],
+                     rules) == (['movl %eax, x', 'pushl y', 'pushl x', 'call f'],
+                                {'redundant_store': 1})
+    # a label or a write of an operand in between keeps the store
+    for middle in ['label_2:', 'addl $1, %eax']:
+        lines = ['movl %eax, x', middle, 'movl %eax, x', 'pushl x', 'call f']
+        assert _peephole(lines, rules) == (lines, {})
+    # stores read on another path or through their address are kept
+    for lines in [
+            ['movl %eax, x', 'jne label_2', 'movl $1, x', 'label_2:', 'pushl x', 'call f'],
+            ['movl $1, x', 'pushl $x', 'call scanf', 'movl $2, x', 'pushl x', 'call f']]:
+        assert _peephole(lines) == (lines, {})
+
+
+# the report of -O is on stderr, the streamed .text has the data of the
+# buffered one, the rules keep more stores in it as the calls of the
+# instructions that are not streamed yet may read them
+def test_peephole_assemble(tmp_path):
+    source = 'int main() {\n    int x, y;\n%s    return 0;\n}\n' % (
+        '    x = 1;\n    y = x + 2;\n    x = y;\n    printf("%d\\n", x);\n' * 500)
+    for source in [_source(), source]:
+        assert _compile(tmp_path, source, ['-a'])[0] == 0
+        plain = _read(tmp_path, 'program.S')
+        status, stdout, stderr = _compile(tmp_path, source, ['-a', '-O'])
+        assert (status, stdout) == (0, '')
+        assert 'peephole: store_load ' in stderr
+        buffered = _sections(_read(tmp_path, 'program.S'))
+        plain = _sections(plain)
+        assert _compile(tmp_path, source, ['-m', '-a', '-O'])[:2] == (0, '')
+        streamed = _sections(_read(tmp_path, 'program.S'))
+        assert streamed['.data'] == buffered['.data']
+        assert len(buffered['.text']) <= len(streamed['.text'])
+    # the stores of y are dead
+    assert len(streamed['.text']) < len(plain['.text'])
+
+
+# the source of the balanced tree of depth levels of operator over leaf
+def _balanced(depth, leaf, operator):
+    if not depth:
+        return leaf
+    return '(%s %s %s)' % (_balanced(depth - 1, leaf, operator), operator,
+                           _balanced(depth - 1, leaf, operator))
+
+
+# the temporaries of the expressions are in registers or on the x87 stack,
+# the ones that do not fit are spilled to slots of the frame
+def test_expression_registers(tmp_path):
+    source = ('int main() {\n    int a;\n    float x;\n    a = 1;\n    x = 1.5;\n'
+              '    a = %s;\n    x = %s;\n    x = x * 2.5 + 2.5;\n'
+              '    if (x > 3) {\n        a = a / 3;\n    }\n    return a - 8;\n}\n' % (
+                  _balanced(7, 'a', '-'), _balanced(9, 'x', '+')))
+    assert _compile(tmp_path, source, ['-a']) == (0, '', '')
+    sections = _sections(_read(tmp_path, 'program.S'))
+    text = sections['.text']
+    assert sections['.data'] == ['label_3: .float 2.5', 'label_4: .float 3.0']
+    assert text[3:6] == ['pushl %ebp', 'movl %esp, %ebp', 'subl $40, %esp']
+    # 7 float and 3 int slots
+    assert len(set(re.findall(r'-\d+\(%ebp\)', ' '.join(text)))) == 10
+    assert len([line for line in text if line.startswith('fadd')]) == 511 + 1
+    # a / 3 multiplies by the magic number of 3
+    assert 'jae label_0' in text and 'movl $1431655766, %eax' in text
+    assert text[-3:] == ['subl $8, %eax', 'pushl %eax', 'call exit']
+
+
+def test_fold_operator():
+    assert compiler._fold_operator('/', '7', '-2') == '-3'
+    assert compiler._fold_operator('/', '-7', '2') == '-3'
+    assert compiler._fold_operator('<', '1.5', '2') == '1'
+    # overflows and divisions by zero are left to the program
+    assert compiler._fold_operator('+', '2147483647', '1') is None
+    assert compiler._fold_operator('/', '1', '0') is None
+    # the floats are the ones of 32 bits
+    assert compiler._fold_operator('*', '0.1', '3') == repr(compiler._float32(0.1 * 3))
+    assert compiler._fold_operator('-', '16777217.0', '16777216') == '0.0'
+    assert compiler._convert_constant('1e39', 'float') is None
+    assert compiler._convert_constant('2.7', 'int') == '2'
+
+
+FOLDING_SOURCE = '''int main() {
+    int a[3] = {4, 5, 6};
+    int x, y, i;
+    float f;
+    x = 7 - 2 * 3;
+    y = x + a[2] / 4;
+    f = 0.5 * 3;
+    if (y > 2) {
+        printf("%d\\n", y);
+    } else {
+        printf("%d\\n", x);
+    }
+    for (i = 0; i < 3; i++) {
+        x = x + y;
+    }
+    printf("%d %d %f\\n", x, y, f);
+    return 0;
+}
+'''
+
+
+def test_constant_folding(tmp_path):
+    status, stdout, stderr = _compile(tmp_path, FOLDING_SOURCE, ['-a', '-O'])
+    assert (status, stdout) == (0, '')
+    assert stderr.startswith('constant folding: folds 5, propagations 4, branches 1\n')
+    text = _sections(_read(tmp_path, 'program.S'))['.text']
+    assert text[3:5] == ['movl $1, x', 'movl $2, y']
+    # the float arithmetic is left to the x87 code, the else branch is taken
+    assert [line.split()[0] for line in text[5:8]] == ['flds', 'fmuls', 'fstps']
+    assert text[7] == 'fstps f'
+    assert text[8] == 'pushl x' and 'jle' not in ' '.join(text)
+    # x is written in the loop, y is not
+    assert 'addl $2, %edi' in text
+
+
+# the folder keeps the blocks on a stack, thousands of levels do not reach
+# the limit of the recursion
+def test_constant_folding_nested(tmp_path):
+    depth = 3000
+    source = ('int main() {\n    int x, y;\n    x = 0;\n    y = 2;\n%s'
+              '    x = x + y * 3;\n%s    return 0;\n}\n' % (
+                  'if (x < 1) {\n    for (x = x; x < 1; x++) {\n' * depth,
+                  '    }\n} else {\n    x = 2;\n}\n' * depth))
+    tree = _parse(source)
+    folder = compiler.ConstantFolder(tree, False)
+    folder.run()
+    # the first condition is known, the ones in the loops are not
+    assert folder.report() == 'folds 2, propagations 3, branches 1'
+    assert _depth(tree) > depth * 3
+    assert _compile(tmp_path, source, ['-a', '-O'])[:2] == (0, '')
+    assert _read(tmp_path, 'program.S').count('\nincl ') == depth
+
+
+IR_SOURCE = '''int main() {
+    int a[3] = {4, 5, 6};
+    int x, i;
+    float f;
+    x = a[1] * 2;
+    f = x / 2.5;
+    for (i = 0; i < 3; i++) {
+        x = x + i;
+    }
+    if (f > x) {
+        x = 1;
+    }
+    printf("%d %f\\n", x, f);
+    return 0;
+}
+'''
+
+
+# the IR of the source
+def _program(source):
+    return compiler.IRBuilder().build(_parse(source).root)
+
+
+def test_ir_dump(tmp_path):
+    lines = _program(IR_SOURCE).dump()
+    assert lines[:9] == [
+        'int a[3] = {4, 5, 6}', 'int x', 'int i', 'float f', 'label_5 = "%d %f\\n"',
+        '', 'function main', 'main:', '    %1 = load_item int a, 1']
+    assert lines[9:14] == [
+        '    %2 = mul int %1, 2', '    store int x, %2', '    %3 = load int x',
+        '    %4 = itof float %3', '    %5 = div float %4, 2.5']
+    assert [line for line in lines if line.startswith('    branch ')] == [
+        '    branch int <, %6, 3, label_0, label_1', '    branch int <, %12, 3, label_0, label_1',
+        '    branch float >, %13, %15, label_4, label_2']
+    assert lines[-2:] == ['    call printf, %16, %17, %18', '    return int 0']
+    assert _compile(tmp_path, IR_SOURCE, ['-i']) == (0, '\n'.join(lines) + '\n', '')
+
+
+# the IR of the builder is well formed, and every change breaking it is
+# reported
+def test_ir_verify():
+    assert _program(IR_SOURCE).verify() == []
+    corruptions = [
+        (lambda blocks: blocks[0].instructions.pop(),
+         'main main: the block does not end with a jump'),
+        (lambda blocks: blocks[1].instructions[-1].operands.__setitem__(4, 'label_9'),
+         'main label_0: unknown label: branch int <, %12, 3, label_0, label_9'),
+        (lambda blocks: blocks[0].instructions[1].operands.__setitem__(1, 2.0),
+         'main main: wrong types of the operands: %2 = mul int %1, 2.0'),
+        (lambda blocks: blocks[1].instructions[2].operands.__setitem__(
+            0, compiler.VirtualRegister(99, 'int')),
+         'main label_0: %99 is not defined: %9 = add int %99, %8'),
+        (lambda blocks: setattr(blocks[2], 'label', 'label_0'),
+         'main: label label_0 is repeated'),
+        (lambda blocks: blocks[0].instructions[2].operands.__setitem__(0, 'y'),
+         'main main: y is not declared: store int y, %2'),
+        (lambda blocks: blocks[0].instructions.reverse(),
+         'main main: jump before the end of the block: '
+         'branch int <, %6, 3, label_0, label_1'),
+        (lambda blocks: blocks[0].instructions.insert(0, blocks[0].instructions[1]),
+         'main: %2 is defined twice'),
+    ]
+    for corrupt, error in corruptions:
+        program = _program(IR_SOURCE)
+        corrupt(program.functions[0].blocks)
+        assert error in program.verify()
+
+
+def test_control_flow_graph():
+    graph = compiler.ControlFlowGraph(_program(IR_SOURCE).functions[0])
+    assert graph.successors == {
+        'main': ['label_0', 'label_1'], 'label_0': ['label_0', 'label_1'],
+        'label_1': ['label_4', 'label_2'], 'label_4': ['label_3'],
+        'label_2': ['label_3'], 'label_3': []}
+    assert graph.predecessors['label_1'] == ['main', 'label_0']
+    assert graph.predecessors['label_3'] == ['label_4', 'label_2']
+    bodies = graph.loops()
+    assert bodies == {'label_0': set(['label_0'])}
+    assert [label for label, depth in graph.depths(bodies).items() if depth] == ['label_0']
+
+
+# the empty else block is threaded through and removed
+def test_control_flow_optimizer():
+    program = _program(IR_SOURCE)
+    optimizer = compiler.ControlFlowOptimizer()
+    optimizer.run(program)
+    assert optimizer.report() == 'branches 0, threads 1, unreachable 1, merges 0, moves 0'
+    assert program.verify() == []
+    blocks = program.functions[0].blocks
+    assert [block.label for block in blocks] == [
+        'main', 'label_0', 'label_1', 'label_4', 'label_3']
+    assert repr(blocks[2].instructions[-1]) == (
+        'branch float >, %13, %15, label_4, label_3')
+
+
+# the weights of the loops deeper than LOOP_DEPTH_LIMIT stay floats
+def test_control_flow_nested_loops(tmp_path):
+    depth = 400
+    source = ('int main() {\n    int x, i;\n    x = 0;\n%s    x = x + 1;\n%s'
+              '    return x;\n}\n' % ('for (i = 0; i < 1; i++) {\n' * depth, '}\n' * depth))
+    program = _program(source)
+    graph = compiler.ControlFlowGraph(program.functions[0])
+    bodies = graph.loops()
+    assert len(bodies) == max(graph.depths(bodies).values()) == depth
+    optimizer = compiler.ControlFlowOptimizer()
+    optimizer.run(program)
+    assert program.verify() == []
+    assert optimizer.report().endswith(' moves %d' % (2 * depth - 1))
+    status, stdout, stderr = _compile(tmp_path, source, ['-a', '-O'])
+    assert (status, stdout) == (0, '')
+    assert 'control flow: branches 0, threads 0' in stderr
+
+
+LOOP_SOURCE = '''int main() {
+    int a[3] = {1, 2, 3};
+    int i, s, k;
+    s = 0;
+    k = 5;
+    scanf("%d", &k);
+    for (i = 0; i < 10; i++) {
+        s = s + a[2] * k;
+    }
+    while (i < 20) {
+        i = i + s;
+    }
+    return s;
+}
+'''
+
+
+# the condition of a loop is tested in front of it and at the end of its
+# body, which branches back
+def test_rotated_loops():
+    blocks = _program(LOOP_SOURCE).functions[0].blocks
+    branches = [repr(block.instructions[-1]) for block in blocks
+                if block.instructions[-1].opcode == 'branch']
+    assert branches == [
+        'branch int <, %3, 10, label_1, label_2',
+        'branch int <, %11, 10, label_1, label_2',
+        'branch int <, %12, 20, label_3, label_4',
+        'branch int <, %16, 20, label_3, label_4']
+
+
+# s and i are register variables in the first loop and i in the second,
+# k and a[2] are loaded in front of the first one and s in front of the
+# second one, a[2] is a constant after the constant folding
+def test_loop_optimizer(tmp_path):
+    program = _program(LOOP_SOURCE)
+    compiler.ControlFlowOptimizer().run(program)
+    optimizer = compiler.LoopOptimizer()
+    optimizer.run(program)
+    assert optimizer.report() == 'promotions 3, hoists 3'
+    assert program.verify() == []
+    status, stdout, stderr = _compile(tmp_path, LOOP_SOURCE, ['-a', '-O'])
+    assert (status, stdout) == (0, '')
+    assert 'loops: promotions 3, hoists 2\n' in stderr
+    text = _sections(_read(tmp_path, 'program.S'))['.text']
+    loop = text[text.index('label_1:') + 1:text.index('jl label_1')]
+    assert loop == ['leal (%eax, %eax, 2), %ecx', 'addl %ecx, %edi', 'incl %ebx',
+                    'cmpl $10, %ebx']
+    assert text[text.index('label_1:') - 3] == 'movl k, %eax'
+    loop = text[text.index('label_3:') - 2:text.index('jl label_3')]
+    assert loop == ['movl s, %eax', 'movl i, %ebx', 'label_3:', 'addl %eax, %ebx',
+                    'cmpl $20, %ebx']
+
+
+# the loops are found once for the whole function, however deep they nest
+def test_loop_optimizer_nested():
+    depth = 800
+    source = ('int main() {\n    int x, i;\n    x = 0;\n%s    x = x + i;\n%s'
+              '    return x;\n}\n' % ('for (i = 0; i < 1; i++) {\n' * depth, '}\n' * depth))
+    program = _program(source)
+    compiler.ControlFlowOptimizer().run(program)
+    optimizer = compiler.LoopOptimizer()
+    optimizer.run(program)
+    assert optimizer.report() == 'promotions %d, hoists 0' % (2 * depth)
+    assert program.verify() == []
+
+
+CLEANUP_SOURCE = '''int main() {
+    int a[3] = {1, 2, 3};
+    int b[2];
+    int x, y, z, k;
+    x = 1;
+    x = 2;
+    y = x + 1;
+    k = a[1];
+    scanf("%d", &z);
+    z = 6;
+    printf("%d\\n", x);
+    printf("%d\\n", z);
+    printf("%d %d\\n", x, k);
+    y = 7;
+    return 0;
+}
+'''
+
+
+# the stores of x and y are dead, the one of z is read by scanf, y and b
+# are not declared and the second "%d\n" is the first one
+def test_program_cleaner():
+    program = _program(CLEANUP_SOURCE)
+    cleaner = compiler.ProgramCleaner()
+    cleaner.run(program)
+    assert cleaner.report() == 'strings 1, stores 3, instructions 2, symbols 3'
+    assert program.verify() == []
+    lines = program.dump()
+    assert lines[:8] == ['int a[3] = {1, 2, 3}', 'int x', 'int z', 'int k',
+                         'label_0 = "%d"', 'label_1 = "%d\\n"', 'label_3 = "%d %d\\n"', '']
+    assert lines[9:11] == ['main:', '    store int x, 2']
+    assert '    store int z, 6' in lines and '    %6 = addr int label_1' in lines
+    assert lines[-1] == '    return int 0'
+
+
+# a format repeated in the source is in .data once
+def test_string_pooling(tmp_path):
+    source = 'int main() {\n    int x;\n    x = 1;\n%s    return 0;\n}\n' % (
+        '    printf("%d\\n", x);\n' * 500)
+    assert _compile(tmp_path, source, ['-a'])[0] == 0
+    assert len(_sections(_read(tmp_path, 'program.S'))['.data']) == 500
+    status, stdout, stderr = _compile(tmp_path, source, ['-a', '-O'])
+    assert (status, stdout) == (0, '')
+    assert 'cleanup: strings 499, ' in stderr
+    text = _read(tmp_path, 'program.S')
+    assert _sections(text)['.data'] == ['label_0: .asciz "%d\\n"']
+    assert text.count('pushl $label_0\n') == 500
+
+
+# the status and output of the program gcc makes of the files in directory
+def _gcc(directory, files, stdin=b''):
+    path = os.path.join(str(directory), 'program')
+    try:
+        process = subprocess.Popen(
+            ['gcc', '-w', '-o', path] + files, cwd=str(directory),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        pytest.skip('gcc is not installed')
+    stderr = process.communicate()[1]
+    assert process.returncode == 0, stderr
+    process = subprocess.Popen([path], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    stdout = process.communicate(stdin)[0]
+    return process.returncode, stdout.decode('latin-1')
+
+
+# the programs of --m64 print what the ones of gcc print, the floats are
+# folded by -O as they are the ones of SSE
+def test_m64_programs(tmp_path):
+    for source, stdin in [(_source(), b'12\n'), (FOLDING_SOURCE, b''), (LOOP_SOURCE, b'3\n'),
+                          (CLEANUP_SOURCE, b'4\n')]:
+        # program.c is written by the lexer run
+        assert _compile(tmp_path, source, ['-l'])[0] == 0
+        expected = _gcc(tmp_path, ['-include', 'stdio.h', '-x', 'c', 'program.c'], stdin)
+        for options in [['--m64', '-a'], ['--m64', '-a', '-O']]:
+            assert _compile(tmp_path, source, options)[:2] == (0, '')
+            assert _gcc(tmp_path, ['program.S'], stdin) == expected
+    assert expected == (0, '2\n6\n2 2\n')
+    status, stdout, stderr = _compile(tmp_path, FOLDING_SOURCE, ['--m64', '-a', '-O'])
+    assert 'constant folding: folds 6, ' in stderr
+    text = _read(tmp_path, 'program.S')
+    # the bits of 1.5
+    assert 'mulss' not in text and 'movl $1069547520, f(%rip)' in text
+    assert _compile(tmp_path, FOLDING_SOURCE, ['--m64', '-a'])[:2] == (0, '')
+    assert 'mulss' in _read(tmp_path, 'program.S')
+
+
+SELECTION_SOURCE = '''int main() {
+    int x, i, a, b, c, d, e;
+    float f, g, h;
+    for (i = 0; i < 6; i++) {
+        scanf("%d", &x);
+        a = x * 8;
+        b = x * 3;
+        c = x * 5;
+        d = x * 9;
+        e = x * 641;
+        printf("%d %d %d %d %d\\n", a, b, c, d, e);
+        a = x / 8;
+        b = x / 7;
+        c = x / 641;
+        d = x / (0 - 8);
+        e = x / (0 - 7);
+        printf("%d %d %d %d %d\\n", a, b, c, d, e);
+        f = x;
+        g = f / 4;
+        h = f / 3;
+        printf("%f %f\\n", g, h);
+    }
+    return 0;
+}
+'''
+
+SELECTION_INPUT = [0, 100, -100, 123456789, 2147483647, -2147483648]
+
+
+# the instructions of the rules of the multiplications and the divisions by
+# constants, the same in both targets
+SELECTION_RULES = [
+    ('x * 8', 'shll $3, '), ('x * 3', 'leal ('), ('x * 5', ', 4), '),
+    ('x * 9', ', 8), '), ('x * 641', 'imull $641, '),
+    ('x / 8', 'sarl $3, %eax'), ('x / 7', 'movl $-1840700269, %eax'),
+    ('x / 641', 'movl $6700417, %eax'),
+    ('x / -8 and x / -7', 'negl %eax')]
+
+
+def _wrap(value):
+    return (value + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+# the quotient of C, rounded toward zero
+def _c_divide(a, b):
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def _selection_output():
+    lines = []
+    for x in SELECTION_INPUT:
+        lines.append('%d %d %d %d %d' % tuple(_wrap(x * k) for k in [8, 3, 5, 9, 641]))
+        lines.append('%d %d %d %d %d' % tuple(_c_divide(x, k) for k in [8, 7, 641, -8, -7]))
+        f = compiler._float32(x)
+        lines.append('%f %f' % (f / 4, compiler._float32(f / 3)))
+    return '\n'.join(lines) + '\n'
+
+
+def test_selection_rules(tmp_path):
+    expected = (0, _selection_output())
+    stdin = ''.join('%d\n' % x for x in SELECTION_INPUT).encode('ascii')
+    for options in [['-a'], ['-a', '-O'], ['-a', '--m64'], ['-a', '-O', '--m64']]:
+        assert _compile(tmp_path, SELECTION_SOURCE, options)[:2] == (0, '')
+        text = _read(tmp_path, 'program.S')
+        if '--m64' in options:
+            assert _gcc(tmp_path, ['program.S'], stdin) == expected
+        # the virtual machine divides with python
+        assert _compile(tmp_path, SELECTION_SOURCE, ['-v'] + options[1:], stdin)[:2] == expected
+        if '-O' not in options:
+            continue
+        for rule, instruction in SELECTION_RULES:
+            assert instruction in text, rule
+        assert 'idivl' not in text
+        # x / 4.0 is x * 0.25
+        assert ('mulss' if '--m64' in options else 'fmuls') in text
+
+
+# whether gcc links programs with flags, not every system has the 32-bit
+# libc
+def _links(directory, flags):
+    path = os.path.join(str(directory), 'empty.c')
+    source_file = open(path, 'w')
+    source_file.write('int main() {\n    return 0;\n}\n')
+    source_file.close()
+    try:
+        process = subprocess.Popen(
+            ['gcc'] + flags + ['-o', path[:-2], path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return False
+    process.communicate()
+    return process.returncode == 0
+
+
+def test_selection_rules_m32(tmp_path):
+    if not _links(tmp_path, ['-m32']):
+        pytest.skip('gcc does not link 32-bit programs')
+    expected = (0, _selection_output())
+    stdin = ''.join('%d\n' % x for x in SELECTION_INPUT).encode('ascii')
+    for options in [['-a'], ['-a', '-O']]:
+        assert _compile(tmp_path, SELECTION_SOURCE, options)[:2] == (0, '')
+        assert _gcc(tmp_path, ['-m32', 'program.S'], stdin) == expected
+
+
+# the .text lines of the loop of the source through the passes of -O, value
+# numbering only when numbering, from the label of the block jumping back
+# to itself to that jump
+def _numbered_loop(source, numbering, long_mode):
+    tree = _parse(source)
+    compiler.ConstantFolder(tree, long_mode).run()
+    program = compiler.IRBuilder().build(tree.root)
+    passes = [compiler.ControlFlowOptimizer(), compiler.LoopOptimizer()]
+    if numbering:
+        passes.append(compiler.ValueNumbering(long_mode))
+    for optimizer in passes + [compiler.ProgramCleaner()]:
+        optimizer.run(program)
+    assert not program.verify()
+    label = [block.label for function in program.functions for block in function.blocks
+             if block.label in block.successors()][0]
+    assem = (compiler.Assembler64 if long_mode else compiler.Assembler)(tree)
+    assem.emit(program)
+    text = assem.ass_file_handler.sections['TEXT']
+    start = end = text.index(label + ':') + 1
+    while not text[end].endswith(' ' + label):
+        end += 1
+    return text[start:end + 1]
+
+
+def test_value_numbering_loop(tmp_path):
+    for long_mode in [False, True]:
+        sizes = []
+        for numbering in [False, True]:
+            loop = _numbered_loop(_source(), numbering, long_mode)
+            # credit[i] is read once
+            assert len([line for line in loop if 'credit' in line]) == (1 if numbering else 2)
+            sizes.append(len(loop))
+        # the x86 one reads the second credit[i] in the operand of imull, it
+        # has one load less but as many instructions
+        if long_mode:
+            assert sizes[1] < sizes[0]
+        else:
+            assert sizes[1] == sizes[0]
+    # the floats are numbered for --m64 only, and the lanes of the sums
+    status, stdout, stderr = _compile(tmp_path, _source(), ['-a', '-O', '--m64'])
+    assert 'value numbering: loads 1, expressions 0, forwards 6\n' in stderr
+    status, stdout, stderr = _compile(tmp_path, _source(), ['-a', '-O'])
+    assert 'value numbering: loads 1, expressions 0, forwards 0\n' in stderr
+
+
+VECTOR_SOURCE = '''int a[10] = {1, 2, 3, 4, 5, 6, 7, 8, 9, 10};
+float b[10] = {1.5, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5, 10.5};
+int c[8] = {3, 1, 4, 1, 5, 9, 2, 6};
+int z[6];
+int main() {
+    int i, s, t, u, v;
+    float f;
+    s = 0;
+    t = 0;
+    u = 0;
+    v = 0;
+    f = 0.0;
+    for (i = 0; i < 10; i++) {
+        s = s + a[i] * 3;
+        f = f + b[i] / 2.0;
+    }
+    for (i = 0; i < 8; i++) {
+        t = t - c[i] * a[i];
+    }
+    for (i = 0; i < 6; i++) {
+        u = u + (z[i] + 2);
+    }
+    for (i = 1; i < 8; i++) {
+        v = v + c[i];
+    }
+    printf("%d %d %d %d %f\\n", s, t, u, v, f);
+    return 0;
+}
+'''
+
+
+# the sums over the arrays are the ones of gcc, with the iterations left
+# after the vectors of 10, 6 and 7, the arrays only read from a multiple of
+# VECTOR_LANES are aligned and read by movdqa
+def test_vectorized_reductions(tmp_path):
+    assert _compile(tmp_path, VECTOR_SOURCE, ['-l'])[0] == 0
+    expected = _gcc(tmp_path, ['-include', 'stdio.h', '-x', 'c', 'program.c'])
+    assert expected == (0, '165 -162 12 28 30.000000\n')
+    status, stdout, stderr = _compile(tmp_path, VECTOR_SOURCE, ['--m64', '-a', '-O'])
+    assert 'vectorizer: loops 4, reductions 5\n' in stderr
+    assert _gcc(tmp_path, ['program.S']) == expected
+    sections = _sections(_read(tmp_path, 'program.S'))
+    data = sections['.data']
+    # the constants are broadcast from aligned vectors
+    for line in ['a: .int 1, 2, 3, 4, 5, 6, 7, 8, 9, 10',
+                 'b: .float 1.5, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5, 10.5']:
+        assert data[data.index(line) - 1] == '.balign 16'
+    for value in [' .int 3, 3, 3, 3', ' .float 2.0, 2.0, 2.0, 2.0', ' .int 2, 2, 2, 2']:
+        line = [line for line in data if line.endswith(value)][0]
+        assert data[data.index(line) - 1] == '.balign 16'
+        assert 'movdqa %s(%%rip), ' % line.split(':')[0] in '\n'.join(sections['.text'])
+    # c is read from 0 and from 1
+    assert data[data.index('c: .int 3, 1, 4, 1, 5, 9, 2, 6') - 1] != '.balign 16'
+    assert sections['.bss'][:2] == ['.local z', '.comm z, 24, 16']
+    text = sections['.text']
+    assert len([line for line in text if line.startswith('movdqa (')]) == 4
+    assert len([line for line in text if line.startswith('movdqu (')]) == 2
+    assert len([line for line in text if line.startswith('divps ')]) == 1
+    # the x86 ones are not vectorized
+    status, stdout, stderr = _compile(tmp_path, VECTOR_SOURCE, ['-a', '-O'])
+    assert 'vectorizer' not in stderr and 'xmm' not in _read(tmp_path, 'program.S')
+
+
+# the bytes of a section of an object file, None without objcopy
+def _section_bytes(directory, name, section):
+    path = os.path.join(str(directory), 'section.bin')
+    try:
+        process = subprocess.Popen(
+            ['objcopy', '-O', 'binary', '--only-section=' + section, name, path],
+            cwd=str(directory), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        pytest.skip('binutils are not installed')
+    stderr = process.communicate()[1]
+    assert process.returncode == 0, stderr
+    with open(path, 'rb') as section_file:
+        return section_file.read()
+
+
+# the .text and .data of -e are the bytes the system assembler makes of the
+# assembler file of -a, and the object links to the same program, the x86
+# ones where gcc links 32-bit programs
+def test_elf_object(tmp_path):
+    m32 = _links(tmp_path, ['-m32'])
+    selection = ''.join('%d\n' % x for x in SELECTION_INPUT).encode('ascii')
+    for source, stdin in [(_source(), b'12\n'), (VECTOR_SOURCE, b''),
+                          (SELECTION_SOURCE, selection)]:
+        for options in [[], ['-O'], ['--m64'], ['--m64', '-O']]:
+            long_mode = '--m64' in options
+            assert _compile(tmp_path, source, ['-a'] + options)[:2] == (0, '')
+            try:
+                process = subprocess.Popen(
+                    ['as', '--64' if long_mode else '--32', '-o', 'as.o', 'program.S'],
+                    cwd=str(tmp_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError:
+                pytest.skip('as is not installed')
+            stderr = process.communicate()[1]
+            assert process.returncode == 0, stderr
+            assert _compile(tmp_path, source, ['-e'] + options)[:2] == (0, '')
+            for section in ['.text', '.data']:
+                assert (_section_bytes(tmp_path, 'program.o', section) ==
+                        _section_bytes(tmp_path, 'as.o', section))
+            if long_mode or m32:
+                flags = [] if long_mode else ['-m32']
+                expected = _gcc(tmp_path, flags + ['program.S'], stdin)
+                assert _gcc(tmp_path, flags + ['program.o'], stdin) == expected
+
+
+RUN_SOURCE = '''int main() {
+    int x;
+    x = 6;
+    x = x * 7;
+    printf("%d\\n", x);
+    if (x > 40) {
+        return x - 37;
+    }
+    return 0;
+}
+'''
+
+
+# the status of main is the exit status of -r, its output the one of gcc and
+# the reports of -O are on stderr, apart from it
+def test_run_in_process(tmp_path):
+    for options in [['-r'], ['-r', '-O']]:
+        status, stdout, stderr = _compile(tmp_path, RUN_SOURCE, options)
+        assert (status, stdout) == (5, '42\n')
+        assert ('peephole: ' in stderr) == ('-O' in options)
+        assert _compile(tmp_path, RUN_SOURCE.replace('x - 37', '0'), options)[:2] == (0, '42\n')
+    for source, stdin in [(_source(), b'12\n'), (LOOP_SOURCE, b'3\n'), (VECTOR_SOURCE, b'')]:
+        assert _compile(tmp_path, source, ['--m64', '-a'])[:2] == (0, '')
+        expected = _gcc(tmp_path, ['program.S'], stdin)
+        for options in [['-r'], ['-r', '-O']]:
+            assert _compile(tmp_path, source, options, stdin)[:2] == expected
+
+
+# the reports of -O are on stderr, the output of the program alone on stdout
+def test_optimize_reports(tmp_path):
+    for options in [['-v'], ['-r']]:
+        status, stdout, stderr = _compile(tmp_path, RUN_SOURCE, options + ['-O'])
+        assert (status, stdout) == (5, '42\n')
+        assert 'constant folding: ' in stderr and 'cleanup: ' in stderr
+
+
+# the floats of the virtual machine round like the ones of its target, and
+# the ones folded by -O too
+def test_vm_float_constants(tmp_path):
+    source = (
+        'int main() {\n    float x, y, z, w;\n    int i;\n'
+        '    x = 16777217;\n    y = x - 16777216;\n'
+        '    z = 0.1;\n    z = z * 3 - 0.3;\n'
+        '    w = 1.1 * 1.1;\n    w = w * 100000000 - 121000000;\n'
+        '    i = 16777217;\n    x = i;\n    x = x + 1;\n'
+        '    if (x > 16777216) {\n        x = 0;\n    }\n'
+        '    printf("%f %f %f %f\\n", y, z, w, x);\n    return 0;\n}\n')
+    # the output of gcc, its floats are the ones of SSE
+    expected = '0.000000 0.000000 0.000000 16777216.000000\n'
+    for options in [['-v', '--m64'], ['-r']]:
+        assert _compile(tmp_path, source, options)[:2] == (0, expected)
+        assert _compile(tmp_path, source, options + ['-O'])[:2] == (0, expected)
+    # the x87 code rounds the floats when they are stored
+    status, stdout, stderr = _compile(tmp_path, source, ['-v'])
+    assert stdout.startswith('0.000000 ')
+    assert _compile(tmp_path, source, ['-v', '-O'])[:2] == (status, stdout)
+
+
+# the virtual machine prints what printf of libc prints
+def test_vm_printf_formats(tmp_path):
+    source = (
+        'int main() {\n    int n, c, p;\n    float f;\n'
+        '    n = 0 - 42000;\n    c = 321;\n    p = 255;\n    f = 2.5;\n'
+        '    printf("%d %u %x %X %o|\\n", n, n, n, n, n);\n'
+        '    printf("%c %c %5d %-5x| %08X %i %%\\n", c, p, p, p, p, n);\n'
+        '    printf("%u %x %#x %f %5.2f %e\\n", p, p, p, f, f, f);\n'
+        '    return 0;\n}\n')
+    status, native, stderr = _compile(tmp_path, source, ['-r'])
+    assert status == 0
+    assert native.split('\n')[0] == '-42000 4294925296 ffff5bf0 FFFF5BF0 37777655760|'
+    for options in [['-v'], ['-v', '--m64']]:
+        assert _compile(tmp_path, source, options)[:2] == (0, native)
+
+
+# the programs of the virtual machine print what the native ones print
+def test_vm_programs(tmp_path):
+    for source, stdin in [(_source(), b'12\n'), (FOLDING_SOURCE, b''), (LOOP_SOURCE, b'3\n'),
+                          (CLEANUP_SOURCE, b'4\n'), (VECTOR_SOURCE, b'')]:
+        expected = _compile(tmp_path, source, ['-r'], stdin)[:2]
+        for options in [['-v', '--m64'], ['-v', '--m64', '-O']]:
+            assert _compile(tmp_path, source, options, stdin)[:2] == expected
+
+
+# every tree of the incremental parser is the one of a cold parse of the
+# same source
+def test_incremental_edits():
+    source = _source()
+    edits = [
+        ('{76, 82,', '{7, 82,'),
+        ('temp = 0;', 'temp = 1;'),
+        ('{7, 82,', '{76, 82,'),
+        ('sum = 0;\n', ''),
+        ('    int i;\n', '    int i;\n    sum = 0;\n'),
+        ('mean - 60 ;', 'mean - 60 + temp ;'),
+        ('    } else {', '    }\n    if (temp) {\n        temp = 0;\n    } else {'),
+        ('#include <stdio.h>\n', ''),
+        ('int main() {', '#include <stdio.h>\n\nint main() {'),
+        ('    return 0;\n', ''),
+    ]
+    parser = compiler.IncrementalParser()
+    parser.parse(source.encode('ascii'))
+    for old, new in edits:
+        assert old in source
+        source = source.replace(old, new, 1)
+        tree = parser.parse(source.encode('ascii'))
+        assert tree.root.same(_parse(source).root), (old, new)
+
+
+# the grammar of the text, from a file in directory
+def _grammar(directory, text):
+    path = os.path.join(str(directory), 'grammar.txt')
+    grammar_file = open(path, 'wb')
+    grammar_file.write(text.encode('utf-8'))
+    grammar_file.close()
+    return compiler.Grammar.load(path)
+
+
+def test_grammar_table(tmp_path):
+    grammar = compiler.GRAMMAR
+    assert grammar.first['Type'] == set(range(compiler.T_INT, compiler.T_VOID + 1))
+    assert grammar.follow['VariableRest'] == set([compiler.T_SEMICOLON])
+    assert grammar.table[('Library', compiler.T_LT)] == (
+        compiler.T_LT, compiler.T_IDENTIFIER, compiler.T_GT)
+    dispatch = compiler.SENTENCE_DISPATCH
+    assert dispatch['Control'] == {compiler.T_IF: 'IfElseControl',
+                                   compiler.T_FOR: 'ForControl',
+                                   compiler.T_WHILE: 'WhileControl'}
+    assert dispatch['Sentence'][compiler.T_INT][compiler.T_IDENTIFIER][
+        compiler.T_LL_BRACKET] == 'FunctionStatement'
+    assert dispatch['BlockSentence'][compiler.T_IDENTIFIER] == {
+        compiler.T_ASSIGN: 'Assignment', compiler.T_LL_BRACKET: 'FunctionCall'}
+    # the empty alternative is taken on the FOLLOW of its nonterminal
+    grammar = _grammar(tmp_path, u'S --> A | ;\nA --> \u2211 | ID\n')
+    assert grammar.table == {
+        ('S', compiler.T_IDENTIFIER): ('A',), ('S', compiler.GRAMMAR_END): ('A',),
+        ('S', compiler.T_SEMICOLON): (compiler.T_SEMICOLON,),
+        ('A', compiler.T_IDENTIFIER): (compiler.T_IDENTIFIER,), ('A', compiler.GRAMMAR_END): ()}
+
+
+def test_grammar_conflicts(tmp_path, capsys):
+    for text, error in [
+            ('S --> ID | ID ;\n', 'grammar error: S is not LL(1) at ID'),
+            (u'S --> A ID\nA --> \u2211 | ID\n', 'grammar error: A is not LL(1) at ID'),
+            ('S --> B\n', 'grammar error: no production of B')]:
+        with pytest.raises(SystemExit):
+            _grammar(tmp_path, text)
+        assert capsys.readouterr().out.strip() == error